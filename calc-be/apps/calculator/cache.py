@@ -0,0 +1,222 @@
+"""
+Result cache for image analysis.
+
+Answers are keyed on a fingerprint of the drawn ink plus the canonicalized
+variable dictionary, so resubmitting the same canvas skips the model call.
+An in-process LRU tier (entry, byte and TTL bounded) sits in front of an
+optional SQLite tier that survives restarts.
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from PIL import Image
+from constants import (
+    RESULT_CACHE_ENABLED,
+    RESULT_CACHE_MAX_ENTRIES,
+    RESULT_CACHE_MAX_BYTES,
+    RESULT_CACHE_TTL_SECONDS,
+    RESULT_CACHE_DB_PATH,
+    RESULT_CACHE_DB_MAX_ENTRIES,
+)
+
+logger = logging.getLogger(__name__)
+
+def canonicalize_vars(dict_of_vars: dict) -> str:
+    """Serialize the variable dictionary so equal dicts always produce the same string"""
+    return json.dumps(dict_of_vars or {}, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+def image_fingerprint(img: Image.Image) -> str:
+    """Hash the ink of an image, ignoring empty canvas around it"""
+    normalized = img.convert("RGBA")
+    # Transparent canvas margins carry no information, so crop them away
+    # before hashing to make the key independent of the canvas size.
+    bbox = normalized.getchannel("A").getbbox()
+    if bbox:
+        normalized = normalized.crop(bbox)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{normalized.size[0]}x{normalized.size[1]}".encode())
+    digest.update(normalized.tobytes())
+    return digest.hexdigest()
+
+def make_cache_key(img_fingerprint: str, dict_of_vars: dict) -> str:
+    """Combine an image fingerprint with the canonical variables into a cache key"""
+    vars_digest = hashlib.blake2b(canonicalize_vars(dict_of_vars).encode(), digest_size=8).hexdigest()
+    return f"{img_fingerprint}:{vars_digest}"
+
+class SQLiteResultStore:
+    """Persistent result tier backed by a single SQLite table"""
+
+    def __init__(self, path: str, max_entries: int = RESULT_CACHE_DB_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)")
+        self._conn.commit()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at <= now:
+                self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return value, expires_at
+
+    def set(self, key: str, value: str, expires_at: float):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now),
+            )
+            self._conn.execute("DELETE FROM results WHERE expires_at <= ?", (now,))
+            # Keep the table bounded by dropping the least recently used rows
+            self._conn.execute(
+                "DELETE FROM results WHERE key IN ("
+                "SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+class ResultCache:
+    """Two-tier LRU/TTL cache for image analysis results"""
+
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES, max_bytes: int = RESULT_CACHE_MAX_BYTES,
+                 ttl_seconds: float = RESULT_CACHE_TTL_SECONDS, disk_store: SQLiteResultStore = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk_store = disk_store
+        self._entries = OrderedDict()  # key -> (expires_at, serialized value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str):
+        """Return a fresh copy of the cached answers, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return json.loads(value)
+                self._remove(key)
+                self.expirations += 1
+
+        if self.disk_store is not None:
+            try:
+                row = self.disk_store.get(key)
+            except sqlite3.Error as e:
+                logger.warning(f"Result cache disk lookup failed: {str(e)}")
+                row = None
+            if row is not None:
+                value, expires_at = row
+                with self._lock:
+                    self.disk_hits += 1
+                    self._insert(key, value, expires_at)
+                return json.loads(value)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, answers: list):
+        """Store answers under the given key in every tier"""
+        value = json.dumps(answers, ensure_ascii=False)
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._insert(key, value, expires_at)
+        if self.disk_store is not None:
+            try:
+                self.disk_store.set(key, value, expires_at)
+            except sqlite3.Error as e:
+                logger.warning(f"Result cache disk write failed: {str(e)}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.disk_store is not None:
+            self.disk_store.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "disk_enabled": self.disk_store is not None,
+            }
+
+    def _insert(self, key: str, value: str, expires_at: float):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (expires_at, value)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value)
+
+def _build_result_cache():
+    disk_store = None
+    if RESULT_CACHE_DB_PATH:
+        try:
+            disk_store = SQLiteResultStore(RESULT_CACHE_DB_PATH)
+            logger.info(f"Result cache persisting to {RESULT_CACHE_DB_PATH}")
+        except sqlite3.Error as e:
+            logger.error(f"Failed to open result cache database: {str(e)}")
+    return ResultCache(disk_store=disk_store)
+
+result_cache = _build_result_cache() if RESULT_CACHE_ENABLED else None
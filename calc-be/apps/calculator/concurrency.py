@@ -0,0 +1,99 @@
+"""
+Admission control for model calls.
+
+Bounds how many analyses run concurrently on one worker, how many may wait
+for a slot, and how long each may take, so a burst of traffic is turned
+away with a 429 instead of piling up behind the event loop.
+"""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from apps.calculator.metrics import registry, Gauge
+from constants import ANALYSIS_MAX_CONCURRENCY, ANALYSIS_MAX_QUEUE, ANALYSIS_TIMEOUT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+class QueueFullError(Exception):
+    """Raised when the analysis queue is at capacity"""
+
+class AnalysisLimiter:
+    """Semaphore-based limiter with a bounded wait queue and per-call timeout"""
+
+    def __init__(self, max_concurrency: int = ANALYSIS_MAX_CONCURRENCY, max_queue: int = ANALYSIS_MAX_QUEUE,
+                 timeout_seconds: float = ANALYSIS_TIMEOUT_SECONDS):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout_seconds = timeout_seconds
+        self._semaphore = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def _get_semaphore(self):
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one analysis slot for the duration of the block, enforcing queue depth"""
+        semaphore = self._get_semaphore()
+        if self.in_flight >= self.max_concurrency and self.waiting >= self.max_queue:
+            self.rejected += 1
+            logger.warning(f"Analysis queue full ({self.waiting} waiting, {self.in_flight} in flight)")
+            raise QueueFullError("Too many analyses in progress, please retry shortly")
+
+        self.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            semaphore.release()
+
+    async def run(self, coro_factory):
+        """Run coro_factory() once a slot is free, enforcing queue depth and timeout"""
+        async with self.slot():
+            try:
+                return await asyncio.wait_for(coro_factory(), timeout=self.timeout_seconds)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                logger.error(f"Analysis timed out after {self.timeout_seconds}s")
+                raise
+
+    async def drain(self, timeout_seconds: float) -> bool:
+        """Wait up to timeout_seconds for in-flight and queued analyses to finish"""
+        deadline = asyncio.get_running_loop().time() + timeout_seconds
+        while self.in_flight or self.waiting:
+            if asyncio.get_running_loop().time() >= deadline:
+                logger.warning(f"Shutting down with {self.in_flight} analyses still in flight")
+                return False
+            await asyncio.sleep(0.1)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "timeout_seconds": self.timeout_seconds,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+analysis_limiter = AnalysisLimiter()
+
+registry.register(Gauge(
+    "calculator_analyses_in_flight", "Analyses holding a limiter slot",
+    function=lambda: analysis_limiter.in_flight))
+registry.register(Gauge(
+    "calculator_analyses_waiting", "Analyses queued for a limiter slot",
+    function=lambda: analysis_limiter.waiting))
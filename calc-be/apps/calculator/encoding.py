@@ -0,0 +1,152 @@
+"""
+Response encodings and compression.
+
+encode_result serializes a calculate response for the client's Accept
+header: MessagePack for application/msgpack (or application/x-msgpack)
+when the msgpack package is installed, otherwise JSON, written with orjson
+when it is installed instead of going through FastAPI's jsonable_encoder
+and the stdlib encoder.
+
+CompressionMiddleware compresses responses of at least
+COMPRESSION_MIN_BYTES with brotli (when the brotli package is installed)
+or gzip, whichever the client's Accept-Encoding prefers. Streamed
+responses (SSE, NDJSON) are passed through untouched so events are not
+held back, and small bodies are sent as they are because the framing
+overhead outweighs the saving.
+"""
+import gzip
+import json
+import logging
+from constants import (
+    COMPRESSION_MIN_BYTES,
+    COMPRESSION_GZIP_LEVEL,
+    COMPRESSION_BROTLI_QUALITY,
+)
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+def parse_quality_list(header: str) -> dict:
+    """Map each token of an Accept or Accept-Encoding header to its q value"""
+    values = {}
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        values[token] = quality
+    return values
+
+def dumps_json(payload) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload)
+        except (TypeError, OverflowError) as e:
+            # e.g. integers beyond 64 bits, which the model returns for large powers
+            logger.debug(f"orjson cannot encode the response, using json: {str(e)}")
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+def encode_result(payload, accept: str = None):
+    """Return (body bytes, media type) for the preferred encoding the server supports
+
+    Responses MessagePack cannot represent (integers beyond 64 bits) are sent as JSON.
+    """
+    if msgpack is not None:
+        accepted = parse_quality_list(accept)
+        msgpack_quality = max(accepted.get(media_type, 0.0) for media_type in MSGPACK_TYPES)
+        json_quality = max(accepted.get("application/json", 0.0), accepted.get("*/*", 0.0),
+                           accepted.get("application/*", 0.0))
+        if msgpack_quality > 0 and msgpack_quality >= json_quality:
+            try:
+                return msgpack.packb(payload, use_bin_type=True), "application/msgpack"
+            except (TypeError, OverflowError, ValueError) as e:
+                logger.debug(f"msgpack cannot encode the response, using JSON: {str(e)}")
+    return dumps_json(payload), "application/json"
+
+def choose_encoding(accept_encoding: str):
+    """br or gzip as preferred by Accept-Encoding, or None for identity"""
+    accepted = parse_quality_list(accept_encoding)
+    candidates = [("gzip", accepted.get("gzip", accepted.get("*", 0.0)))]
+    if brotli is not None:
+        # Listed first so it wins ties
+        candidates.insert(0, ("br", accepted.get("br", accepted.get("*", 0.0))))
+    encoding, quality = max(candidates, key=lambda candidate: candidate[1])
+    return encoding if quality > 0 else None
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+class CompressionMiddleware:
+    """Pure ASGI middleware compressing complete response bodies above a size threshold"""
+
+    def __init__(self, app, min_bytes: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.min_bytes = min_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+        encoding = choose_encoding(accept_encoding)
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        state = {"start": None, "passthrough": False}
+
+        async def compressing_send(message):
+            if message["type"] == "http.response.start":
+                state["start"] = message
+                return
+            if message["type"] != "http.response.body" or state["passthrough"]:
+                return await send(message)
+            start = state["start"]
+            headers = [(name, value) for name, value in start["headers"]]
+            already_encoded = any(name.lower() == b"content-encoding" for name, _ in headers)
+            body = message.get("body", b"")
+            if message.get("more_body", False) or already_encoded or len(body) < self.min_bytes:
+                # Streamed, pre-encoded or small responses go out as produced
+                state["passthrough"] = True
+                await send(start)
+                return await send(message)
+            body = compress(body, encoding)
+            headers = [(name, value) for name, value in headers if name.lower() != b"content-length"]
+            headers += [
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(body)).encode()),
+            ]
+            vary = [value for name, value in headers if name.lower() == b"vary"]
+            headers = [(name, value) for name, value in headers if name.lower() != b"vary"]
+            headers.append((b"vary", b", ".join(vary + [b"Accept-Encoding"])))
+            await send({**start, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, compressing_send)
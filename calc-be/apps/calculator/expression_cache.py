@@ -0,0 +1,205 @@
+"""
+Expression-level result cache with variable dependency tracking.
+
+The result cache keys whole answers on the canvas and the full variable
+dictionary, so changing any variable misses it. This store remembers which
+expressions each drawing produced and, per expression (keyed on its expr
+and latex), the variables its result depends on with the values it was
+computed for. Resubmitting a drawing with different variables reuses every
+expression whose dependencies are unchanged, re-evaluates the ones whose
+dependencies changed with the local arithmetic evaluator, and only falls
+back to the model when an affected expression cannot be evaluated locally.
+"""
+import copy
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from apps.calculator.cache import canonicalize_vars
+from apps.calculator.local_eval import UnsupportedExpression, assignment_parts, evaluate_line, expression_names
+from constants import (
+    EXPRESSION_CACHE_ENABLED,
+    EXPRESSION_CACHE_MAX_ENTRIES,
+    EXPRESSION_CACHE_TTL_SECONDS,
+    RESULT_CACHE_ENABLED,
+)
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+def expression_key(answer: dict) -> tuple:
+    """Identify the drawn expression independently of its result
+
+    Model latex usually ends in "= <result>", which changes with the
+    variables, so that suffix is dropped.
+    """
+    expr = _WHITESPACE.sub(" ", str(answer.get("expr", ""))).strip()
+    latex = str(answer.get("latex", "")).strip()
+    result = str(answer.get("result", "")).strip()
+    if result and latex.endswith(result):
+        stripped = latex[:-len(result)].rstrip()
+        if stripped.endswith("="):
+            latex = stripped[:-1].rstrip()
+    return expr, _WHITESPACE.sub(" ", latex)
+
+def _parse_names(text: str):
+    try:
+        return expression_names(text)
+    except (SyntaxError, ValueError):
+        return None
+
+def analyze_dependencies(answer: dict):
+    """Return (variable names the result depends on or None if unknown, locally evaluable source or None)"""
+    if answer.get("assign"):
+        target, source = assignment_parts(answer)
+        if target is None or source is None:
+            return None, None
+        names = _parse_names(source)
+        if names is None:
+            return None, None
+        return names - {target}, f"{target} = {source}"
+    if answer.get("type") not in (None, "arithmetic"):
+        # Equations, calculus and word problems are solved for their own
+        # symbols; their dependencies cannot be read off the expression
+        return None, None
+    expr = str(answer.get("expr", ""))
+    names = _parse_names(expr)
+    if names is None:
+        return None, None
+    return names, expr
+
+def dependency_snapshot(dependencies, dict_of_vars: dict) -> str:
+    """Canonical values of the dependencies; unknown dependencies mean the whole dictionary"""
+    dict_of_vars = dict_of_vars or {}
+    if dependencies is None:
+        return canonicalize_vars(dict_of_vars)
+    return canonicalize_vars({name: dict_of_vars[name] for name in dependencies if name in dict_of_vars})
+
+class ExpressionCache:
+    """Drawing -> expressions index plus per-expression results tagged with their dependency values"""
+
+    def __init__(self, max_entries: int = EXPRESSION_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = EXPRESSION_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._drawings = OrderedDict()  # image fingerprint -> (expires_at, expression keys)
+        self._expressions = OrderedDict()  # expression key -> entry dict
+        self._lock = threading.Lock()
+        self.reused = 0
+        self.reevaluated = 0
+        self.invalidated = 0
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, drawing: str, answers: list, dict_of_vars: dict):
+        """Remember the expressions found in a drawing and what each result depends on"""
+        if not answers:
+            return
+        expires_at = time.time() + self.ttl_seconds
+        keys = []
+        with self._lock:
+            for answer in answers:
+                key = expression_key(answer)
+                dependencies, source = analyze_dependencies(answer)
+                self._put(self._expressions, key, {
+                    "answer": copy.deepcopy(answer),
+                    "dependencies": dependencies,
+                    "source": source,
+                    "snapshot": dependency_snapshot(dependencies, dict_of_vars),
+                    "expires_at": expires_at,
+                })
+                keys.append(key)
+            self._put(self._drawings, drawing, (expires_at, tuple(keys)))
+
+    def resolve(self, drawing: str, dict_of_vars: dict):
+        """Answers for a known drawing under new variables, or None when the model is needed"""
+        now = time.time()
+        with self._lock:
+            indexed = self._drawings.get(drawing)
+            if indexed is None or indexed[0] <= now:
+                self.misses += 1
+                return None
+            self._drawings.move_to_end(drawing)
+            answers = []
+            refreshed = []
+            for key in indexed[1]:
+                entry = self._expressions.get(key)
+                if entry is None or entry["expires_at"] <= now:
+                    self.misses += 1
+                    return None
+                snapshot = dependency_snapshot(entry["dependencies"], dict_of_vars)
+                if snapshot == entry["snapshot"]:
+                    answers.append(copy.deepcopy(entry["answer"]))
+                    continue
+                answer = self._reevaluate(entry, dict_of_vars)
+                if answer is None:
+                    # A dependency changed and the result cannot be recomputed here
+                    del self._expressions[key]
+                    self.invalidated += 1
+                    self.misses += 1
+                    return None
+                refreshed.append((key, entry, answer, snapshot))
+                answers.append(answer)
+            # Commit updated entries only once the whole drawing resolved
+            for key, entry, answer, snapshot in refreshed:
+                entry["answer"] = copy.deepcopy(answer)
+                entry["snapshot"] = snapshot
+                self._expressions.move_to_end(key)
+            self.reused += len(answers) - len(refreshed)
+            self.reevaluated += len(refreshed)
+            self.hits += 1
+        return answers
+
+    def referenced_names(self, drawing: str):
+        """Variable names a known drawing's expressions depend on, or None when unknown"""
+        now = time.time()
+        with self._lock:
+            indexed = self._drawings.get(drawing)
+            if indexed is None or indexed[0] <= now:
+                return None
+            names = set()
+            for key in indexed[1]:
+                entry = self._expressions.get(key)
+                if entry is None or entry["dependencies"] is None:
+                    return None
+                names |= entry["dependencies"]
+            return names
+
+    @staticmethod
+    def _reevaluate(entry: dict, dict_of_vars: dict):
+        if entry["source"] is None:
+            return None
+        try:
+            return evaluate_line(entry["source"], dict_of_vars)
+        except (UnsupportedExpression, KeyError) as e:
+            logger.debug(f"Cannot re-evaluate {entry['source']!r} locally: {str(e)}")
+            return None
+
+    def _put(self, table: OrderedDict, key, value):
+        table[key] = value
+        table.move_to_end(key)
+        while len(table) > self.max_entries:
+            table.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._drawings.clear()
+            self._expressions.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "drawings": len(self._drawings),
+                "expressions": len(self._expressions),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "reused": self.reused,
+                "reevaluated": self.reevaluated,
+                "invalidated": self.invalidated,
+            }
+
+expression_cache = ExpressionCache() if EXPRESSION_CACHE_ENABLED and RESULT_CACHE_ENABLED else None
@@ -0,0 +1,134 @@
+"""
+Offline stand-in for the Gemini model.
+
+FakeGenerativeModel implements the parts of genai.GenerativeModel the app
+uses (generate_content, generate_content_async, streaming). It replays
+recorded response texts in order, with lognormal latency, an optional slow
+tail and a configurable rate of 429/5xx errors, so retries, hedging, the
+circuit breaker and load behaviour can be exercised without an API key or
+network. Enable it with FAKE_MODEL_ENABLED=true; with FAKE_MODEL_SEED set,
+every run sees the same sequence.
+"""
+import asyncio
+import itertools
+import json
+import math
+import random
+import time
+from google.api_core import exceptions as google_exceptions
+from constants import (
+    FAKE_MODEL_LATENCY_MS,
+    FAKE_MODEL_LATENCY_SIGMA,
+    FAKE_MODEL_FAILURE_RATE,
+    FAKE_MODEL_FAILURE_STATUS,
+    FAKE_MODEL_TAIL_RATE,
+    FAKE_MODEL_TAIL_MS,
+    FAKE_MODEL_RECORDINGS,
+    FAKE_MODEL_SEED,
+)
+
+_FAILURES = {
+    429: google_exceptions.ResourceExhausted,
+    500: google_exceptions.InternalServerError,
+    503: google_exceptions.ServiceUnavailable,
+}
+
+DEFAULT_ANSWERS = [{
+    "expr": "2 + 3 * 4",
+    "result": "14",
+    "steps": [
+        {"type": "text", "content": "Multiply before adding"},
+        {"type": "math", "content": "3 \\times 4 = 12"},
+        {"type": "math", "content": "2 + 12 = 14"},
+    ],
+    "type": "arithmetic",
+    "assign": False,
+    "latex": "2 + 3 \\times 4 = 14",
+}]
+
+def load_recordings(path: str) -> list:
+    """Read recorded response texts: a JSON list of strings or of objects with a "text" field"""
+    with open(path) as f:
+        recordings = json.load(f)
+    return [item["text"] if isinstance(item, dict) else item for item in recordings]
+
+class FakeResponse:
+    """Minimal GenerateContentResponse: exposes .text"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+class FakeStream:
+    """Async iterator of response chunks, delivered over the call's latency"""
+
+    def __init__(self, text: str, latency: float, chunk_size: int = 64):
+        self._chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)] or [""]
+        self._delay = latency / len(self._chunks)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self._chunks:
+            await asyncio.sleep(self._delay)
+            yield FakeResponse(chunk)
+
+class FakeGenerativeModel:
+    """Drop-in replacement for genai.GenerativeModel with synthetic latency and failures"""
+
+    def __init__(self, model_name: str = "fake", system_instruction=None, answers: list = None,
+                 recordings: list = None, latency_ms: float = FAKE_MODEL_LATENCY_MS,
+                 latency_sigma: float = FAKE_MODEL_LATENCY_SIGMA, failure_rate: float = FAKE_MODEL_FAILURE_RATE,
+                 failure_status: int = FAKE_MODEL_FAILURE_STATUS, tail_rate: float = FAKE_MODEL_TAIL_RATE,
+                 tail_ms: float = FAKE_MODEL_TAIL_MS, seed: int = None):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        if recordings is None and FAKE_MODEL_RECORDINGS:
+            recordings = load_recordings(FAKE_MODEL_RECORDINGS)
+        self.recordings = recordings or [json.dumps(answers if answers is not None else DEFAULT_ANSWERS)]
+        self._replay = itertools.cycle(self.recordings)
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.failure_rate = failure_rate
+        self.failure_error = _FAILURES.get(failure_status, google_exceptions.ServiceUnavailable)
+        self.tail_rate = tail_rate
+        self.tail_ms = tail_ms
+        self.calls = 0
+        if seed is None and FAKE_MODEL_SEED:
+            seed = int(FAKE_MODEL_SEED)
+        self._random = random.Random(seed)
+
+    def sample_latency(self) -> float:
+        """One latency draw in seconds; latency_ms is the median outside the tail"""
+        if self.tail_rate and self._random.random() < self.tail_rate:
+            return self.tail_ms / 1000
+        return self.latency_ms / 1000 * math.exp(self._random.gauss(0, self.latency_sigma))
+
+    def _outcome(self):
+        self.calls += 1
+        latency = self.sample_latency()
+        failed = self._random.random() < self.failure_rate
+        return latency, failed, next(self._replay)
+
+    def _fail(self):
+        raise self.failure_error(f"Fake model injected HTTP {self.failure_error.code} error")
+
+    def generate_content(self, contents, generation_config=None, stream: bool = False):
+        latency, failed, text = self._outcome()
+        time.sleep(latency)
+        if failed:
+            self._fail()
+        return FakeResponse(text)
+
+    async def generate_content_async(self, contents, generation_config=None, stream: bool = False):
+        latency, failed, text = self._outcome()
+        if stream:
+            # Errors surface before the first chunk, like the real streaming call
+            await asyncio.sleep(min(latency, 0.05))
+            if failed:
+                self._fail()
+            return FakeStream(text, latency)
+        await asyncio.sleep(latency)
+        if failed:
+            self._fail()
+        return FakeResponse(text)
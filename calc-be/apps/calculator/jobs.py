@@ -0,0 +1,497 @@
+"""
+Background job queue for slow or bulk analyses.
+
+POST /calculate/jobs stores the request and returns a job id at once.
+Worker tasks in each server process claim queued jobs, highest priority
+first, run them through the normal analysis pipeline and keep the result
+for GET /calculate/jobs/{id} until it expires, optionally POSTing it to a
+webhook as well.
+
+Jobs live in SQLite. With JOBS_DB_PATH set, queued and interrupted work is
+picked up again after a restart and every worker on the node shares one
+queue; without it the queue is in memory. A poll can land on any worker, so
+with several workers the path defaults to a file in SERVER_STATE_DIR, and
+the job routes are disabled if no shared file can be opened. A claim is a
+lease, so a job whose process died is retried once the lease runs out.
+Store calls block on SQLite locks and always run in a worker thread.
+"""
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+from constants import (
+    JOBS_ENABLED,
+    JOBS_DB_PATH,
+    JOBS_WORKERS,
+    JOBS_MAX_QUEUED,
+    JOBS_RESULT_TTL_SECONDS,
+    JOBS_LEASE_SECONDS,
+    JOBS_MAX_ATTEMPTS,
+    JOBS_RETRY_SECONDS,
+    JOBS_POLL_SECONDS,
+    JOBS_WEBHOOK_TIMEOUT_SECONDS,
+    JOBS_WEBHOOK_ALLOWED_HOSTS,
+    SERVER_WORKER_COUNT,
+)
+
+logger = logging.getLogger(__name__)
+
+class JobQueueFullError(Exception):
+    """Raised when JOBS_MAX_QUEUED jobs are already waiting"""
+
+_COLUMNS = ("id", "status", "priority", "request", "result", "error", "webhook", "webhook_status",
+            "attempts", "created_at", "run_after", "started_at", "lease_until", "finished_at", "expires_at")
+
+class JobStore:
+    """Job rows in SQLite; every state change is a single short transaction"""
+
+    def __init__(self, path: str = ":memory:", max_queued: int = JOBS_MAX_QUEUED,
+                 ttl_seconds: float = JOBS_RESULT_TTL_SECONDS):
+        self.path = path
+        self.max_queued = max_queued
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5, isolation_level=None)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, priority INTEGER NOT NULL, request TEXT, "
+            "result TEXT, error TEXT, webhook TEXT, webhook_status TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+            "created_at REAL NOT NULL, run_after REAL NOT NULL, started_at REAL, lease_until REAL, "
+            "finished_at REAL, expires_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created_at)")
+
+    def _transaction(self, work):
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock up front so workers cannot claim the same job
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(self._conn)
+                self._conn.execute("COMMIT")
+                return result
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _read(self, work):
+        with self._lock:
+            # A deferred transaction only reads: one consistent snapshot, no write lock
+            self._conn.execute("BEGIN")
+            try:
+                return work(self._conn)
+            finally:
+                self._conn.execute("COMMIT")
+
+    def _row(self, conn, job_id: str):
+        row = conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(zip(_COLUMNS, row)) if row else None
+
+    def submit(self, request: dict, priority: int, webhook: str = None) -> dict:
+        """Queue a job; raises JobQueueFullError at capacity"""
+        job_id = uuid.uuid4().hex
+
+        def work(conn):
+            queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= self.max_queued:
+                raise JobQueueFullError(f"Job queue is full ({queued} jobs waiting), please retry later")
+            now = time.time()
+            conn.execute(
+                "INSERT INTO jobs (id, status, priority, request, webhook, created_at, run_after) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, priority, json.dumps(request, ensure_ascii=False), webhook, now, now),
+            )
+            return self._row(conn, job_id)
+
+        return self._transaction(work)
+
+    def claim(self, lease_seconds: float, max_attempts: int):
+        """Lease the next runnable job, or return None
+
+        Runnable means queued and due, or running with an expired lease
+        (its worker died). Jobs already tried max_attempts times fail.
+        """
+        def work(conn):
+            now = time.time()
+            while True:
+                row = conn.execute(
+                    "SELECT id, attempts FROM jobs "
+                    "WHERE (status = 'queued' AND run_after <= ?) OR (status = 'running' AND lease_until <= ?) "
+                    "ORDER BY priority DESC, created_at LIMIT 1",
+                    (now, now),
+                ).fetchone()
+                if row is None:
+                    return None
+                job_id, attempts = row
+                if attempts >= max_attempts:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', error = ?, request = NULL, finished_at = ?, "
+                        "expires_at = ? WHERE id = ?",
+                        (f"Job abandoned after {attempts} attempts", now, now + self.ttl_seconds, job_id),
+                    )
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, "
+                    "lease_until = ? WHERE id = ?",
+                    (now, now + lease_seconds, job_id),
+                )
+                return self._row(conn, job_id)
+
+        return self._transaction(work)
+
+    def finish(self, job_id: str, status: str, result: dict = None, error: str = None):
+        """Record the outcome and start the result TTL; the request payload is dropped"""
+        now = time.time()
+        self._transaction(lambda conn: conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, request = NULL, lease_until = NULL, "
+            "finished_at = ?, expires_at = ? WHERE id = ?",
+            (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error,
+             now, now + self.ttl_seconds, job_id),
+        ))
+
+    def requeue(self, job_id: str, delay_seconds: float = 0, error: str = None):
+        """Put a leased job back in the queue, runnable after delay_seconds"""
+        self._transaction(lambda conn: conn.execute(
+            "UPDATE jobs SET status = 'queued', lease_until = NULL, run_after = ?, error = ? WHERE id = ?",
+            (time.time() + delay_seconds, error, job_id),
+        ))
+
+    def set_webhook_status(self, job_id: str, webhook_status: str):
+        self._transaction(lambda conn: conn.execute(
+            "UPDATE jobs SET webhook_status = ? WHERE id = ?", (webhook_status, job_id)))
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job that has not started; returns False otherwise"""
+        now = time.time()
+        cursor = self._transaction(lambda conn: conn.execute(
+            "UPDATE jobs SET status = 'cancelled', request = NULL, finished_at = ?, expires_at = ? "
+            "WHERE id = ? AND status = 'queued'",
+            (now, now + self.ttl_seconds, job_id),
+        ))
+        return cursor.rowcount > 0
+
+    def get(self, job_id: str):
+        """The job with its queue position while queued, or None when unknown or expired
+
+        Expired rows are left for prune to delete, so a lookup never writes.
+        """
+        def work(conn):
+            job = self._row(conn, job_id)
+            if job is None:
+                return None
+            if job["expires_at"] is not None and job["expires_at"] <= time.time():
+                return None
+            if job["status"] == "queued":
+                job["position"] = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' "
+                    "AND (priority > ? OR (priority = ? AND created_at < ?))",
+                    (job["priority"], job["priority"], job["created_at"]),
+                ).fetchone()[0]
+            return job
+
+        return self._read(work)
+
+    def prune(self) -> int:
+        """Delete finished jobs whose results have expired"""
+        cursor = self._transaction(lambda conn: conn.execute(
+            "DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)))
+        return cursor.rowcount
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+def job_view(job: dict) -> dict:
+    """Public representation of a job row"""
+    view = {
+        "id": job["id"],
+        "status": job["status"],
+        "priority": job["priority"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+    if "position" in job:
+        view["position"] = job["position"]
+    if job["result"] is not None:
+        view["result"] = json.loads(job["result"])
+    if job["error"] is not None:
+        view["error"] = job["error"]
+    if job["webhook"]:
+        view["webhook_status"] = job["webhook_status"] or "pending"
+    return view
+
+def is_public_address(address: str) -> bool:
+    """Whether an IP address is publicly routable
+
+    Loopback, private, link-local (cloud metadata), shared, reserved and
+    multicast addresses are not, so webhooks cannot reach internal services.
+    """
+    address = ipaddress.ip_address(address.split("%")[0])
+    return address.is_global and not address.is_multicast
+
+def resolves_to_public_addresses(host: str, port: int) -> bool:
+    """Whether every address host resolves to is publicly routable
+
+    Blocks on DNS; call it off the event loop.
+    """
+    try:
+        infos = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError, ValueError):
+        return False
+    addresses = {info[4][0] for info in infos}
+    return bool(addresses) and all(is_public_address(address) for address in addresses)
+
+def webhook_allowed(url: str, allowed_hosts: str = JOBS_WEBHOOK_ALLOWED_HOSTS) -> bool:
+    """http(s) URLs to a host in JOBS_WEBHOOK_ALLOWED_HOSTS, or with no list, to public addresses only
+
+    Blocks on DNS; call it off the event loop.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return False
+    hosts = {host.strip().lower() for host in allowed_hosts.split(",") if host.strip()}
+    if hosts:
+        return parsed.hostname.lower() in hosts
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    except ValueError:
+        return False
+    return resolves_to_public_addresses(parsed.hostname, port)
+
+_public_only_adapter = None
+
+def public_only_adapter():
+    """requests transport adapter that refuses connections to non-public peers
+
+    The check runs on the connected socket, before TLS or any request bytes,
+    so a host that passed webhook_allowed and then re-resolves to an internal
+    address (DNS rebinding) is refused. Host and SNI stay the URL's host.
+    Built on first use so requests and urllib3 stay out of startup.
+    """
+    global _public_only_adapter
+    if _public_only_adapter is None:
+        from requests.adapters import HTTPAdapter
+        from urllib3.connection import HTTPConnection, HTTPSConnection
+        from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+        def checked(sock):
+            peer = sock.getpeername()[0]
+            if not is_public_address(peer):
+                sock.close()
+                raise ConnectionRefusedError(f"webhook host connected to non-public address {peer}")
+            return sock
+
+        class PublicHTTPConnection(HTTPConnection):
+            def _new_conn(self):
+                return checked(super()._new_conn())
+
+        class PublicHTTPSConnection(HTTPSConnection):
+            def _new_conn(self):
+                return checked(super()._new_conn())
+
+        class PublicHTTPConnectionPool(HTTPConnectionPool):
+            ConnectionCls = PublicHTTPConnection
+
+        class PublicHTTPSConnectionPool(HTTPSConnectionPool):
+            ConnectionCls = PublicHTTPSConnection
+
+        class PublicOnlyAdapter(HTTPAdapter):
+            def init_poolmanager(self, *args, **kwargs):
+                super().init_poolmanager(*args, **kwargs)
+                self.poolmanager.pool_classes_by_scheme = {
+                    "http": PublicHTTPConnectionPool,
+                    "https": PublicHTTPSConnectionPool,
+                }
+
+        _public_only_adapter = PublicOnlyAdapter
+    return _public_only_adapter()
+
+def _post_json(url: str, payload: dict, timeout: float) -> int:
+    import requests
+    # Checked again at delivery: DNS may have changed since the job was submitted
+    if not webhook_allowed(url):
+        raise ValueError("webhook host is not allowed")
+    with requests.Session() as session:
+        if not JOBS_WEBHOOK_ALLOWED_HOSTS:
+            # The connected peer is checked too, in case DNS changed after the check above.
+            # Proxies from the environment are ignored: the peer would be the proxy
+            session.trust_env = False
+            session.mount("http://", public_only_adapter())
+            session.mount("https://", public_only_adapter())
+        # A redirect could point anywhere, including internal hosts
+        return session.post(url, json=payload, timeout=timeout, allow_redirects=False).status_code
+
+class JobQueue:
+    """Worker tasks that drain a JobStore through a runner coroutine"""
+
+    def __init__(self, store: JobStore, workers: int = JOBS_WORKERS, lease_seconds: float = JOBS_LEASE_SECONDS,
+                 max_attempts: int = JOBS_MAX_ATTEMPTS, retry_seconds: float = JOBS_RETRY_SECONDS,
+                 poll_seconds: float = JOBS_POLL_SECONDS, webhook_timeout_seconds: float = JOBS_WEBHOOK_TIMEOUT_SECONDS):
+        self.store = store
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.poll_seconds = poll_seconds
+        self.webhook_timeout_seconds = webhook_timeout_seconds
+        self.runner = None
+        self._tasks = []
+        self._deliveries = set()
+        self._wakeup = None
+        self._last_prune = time.monotonic()
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+
+    def start(self, runner):
+        """Start the worker tasks; runner(request) returns a calculate-style result dict"""
+        self.runner = runner
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        logger.info(f"Started {self.workers} job workers")
+
+    async def stop(self):
+        """Stop the workers and pending webhook deliveries; jobs being run go back to the queue"""
+        tasks = self._tasks + list(self._deliveries)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._deliveries.clear()
+
+    async def submit(self, request: dict, priority: int, webhook: str = None) -> dict:
+        """Queue a job; raises JobQueueFullError at capacity"""
+        job = await asyncio.to_thread(self.store.submit, request, priority, webhook)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str):
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def cancel(self, job_id: str) -> bool:
+        return await asyncio.to_thread(self.store.cancel, job_id)
+
+    async def _next_job(self):
+        while True:
+            job = await asyncio.to_thread(self.store.claim, self.lease_seconds, self.max_attempts)
+            if job is not None:
+                return job
+            self._wakeup.clear()
+            # Polling also picks up jobs queued by other worker processes and retries coming due
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _work(self):
+        while True:
+            try:
+                await self._run_next()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # e.g. "database is locked" past the timeout; the lease brings the job back
+                logger.error(f"Job worker error, continuing: {str(e)}")
+                await asyncio.sleep(self.poll_seconds)
+
+    async def _run_next(self):
+        job = await self._next_job()
+        try:
+            result = await self.runner(json.loads(job["request"]))
+        except asyncio.CancelledError:
+            await asyncio.to_thread(self.store.requeue, job["id"])
+            raise
+        except Exception as e:
+            logger.error(f"Job {job['id']} crashed: {str(e)}")
+            result = {"message": "Failed to analyze image", "data": [], "status": "error"}
+
+        if result.get("retryable") and job["attempts"] < self.max_attempts:
+            self.retried += 1
+            delay = self.retry_seconds * 2 ** (job["attempts"] - 1) * random.uniform(0.5, 1.0)
+            logger.warning(f"Job {job['id']} will be retried in {delay:.1f}s: {result['message']}")
+            await asyncio.to_thread(self.store.requeue, job["id"], delay, result["message"])
+            return
+
+        status = "failed" if result.get("status") == "error" else "succeeded"
+        await asyncio.to_thread(self.store.finish, job["id"], status, result,
+                                result["message"] if status == "failed" else None)
+        if status == "failed":
+            self.failed += 1
+        else:
+            self.completed += 1
+        logger.info(f"Job {job['id']} {status} after {job['attempts']} attempts")
+        if job["webhook"]:
+            # Keep a reference so the task is not garbage collected mid-delivery
+            delivery = asyncio.ensure_future(self._deliver(job["id"]))
+            self._deliveries.add(delivery)
+            delivery.add_done_callback(self._deliveries.discard)
+
+        if time.monotonic() - self._last_prune > 60:
+            self._last_prune = time.monotonic()
+            pruned = await asyncio.to_thread(self.store.prune)
+            if pruned:
+                logger.info(f"Pruned {pruned} expired jobs")
+
+    async def _deliver(self, job_id: str, attempts: int = 3):
+        """POST the finished job to its webhook, retrying failed deliveries with backoff"""
+        job = await self.get(job_id)
+        if job is None:
+            return
+        payload = job_view(job)
+        for attempt in range(attempts):
+            try:
+                status_code = await asyncio.to_thread(_post_json, job["webhook"], payload,
+                                                      self.webhook_timeout_seconds)
+                if status_code < 300:
+                    await asyncio.to_thread(self.store.set_webhook_status, job_id, "delivered")
+                    return
+                reason = f"HTTP {status_code}"
+            except Exception as e:
+                reason = str(e)
+            logger.warning(f"Webhook delivery for job {job_id} failed (attempt {attempt + 1}): {reason}")
+            await asyncio.sleep(2 ** attempt)
+        await asyncio.to_thread(self.store.set_webhook_status, job_id, "failed")
+
+    def stats(self) -> dict:
+        """Queue counters; reads the store, so call it off the event loop"""
+        return {
+            "workers": len(self._tasks),
+            "jobs": self.store.counts(),
+            "max_queued": self.store.max_queued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "durable": self.store.path != ":memory:",
+        }
+
+def _build_queue():
+    if JOBS_DB_PATH:
+        try:
+            if os.path.dirname(JOBS_DB_PATH):
+                os.makedirs(os.path.dirname(JOBS_DB_PATH), exist_ok=True)
+            store = JobStore(JOBS_DB_PATH)
+            logger.info(f"Job queue persisting to {JOBS_DB_PATH}")
+            return JobQueue(store)
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Failed to open job database: {str(e)}")
+    if SERVER_WORKER_COUNT > 1:
+        # A per-process queue would answer 404 to polls that land on another worker
+        logger.error(f"Background jobs disabled: {SERVER_WORKER_COUNT} workers need a shared JOBS_DB_PATH")
+        return None
+    logger.info("Job queue kept in memory")
+    return JobQueue(JobStore())
+
+job_queue = _build_queue() if JOBS_ENABLED else None
@@ -0,0 +1,268 @@
+"""
+Local fast path for simple arithmetic.
+
+A safe AST-based evaluator answers plain arithmetic and variable
+assignments in the same shape the model path returns. Recognizers that turn
+a canvas into expression text are pluggable; when none of them is confident
+the caller falls back to the model.
+"""
+import ast
+import logging
+import math
+import operator
+import re
+from constants import LOCAL_EVAL_ENABLED, LOCAL_EVAL_MIN_CONFIDENCE, LOCAL_EVAL_TEMPLATES_DIR
+
+logger = logging.getLogger(__name__)
+
+_BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+
+_UNARY_OPERATORS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+_FUNCTIONS = {
+    "sqrt": math.sqrt,
+    "abs": abs,
+    "sin": math.sin,
+    "cos": math.cos,
+    "tan": math.tan,
+    "log": math.log,
+    "ln": math.log,
+    "exp": math.exp,
+}
+
+_CONSTANTS = {
+    "pi": math.pi,
+    "e": math.e,
+}
+
+_MAX_EXPONENT = 1000
+_MAX_MAGNITUDE = 1e300
+
+_NORMALIZATIONS = (
+    ("×", "*"), ("·", "*"), ("÷", "/"), ("−", "-"), ("^", "**"), ("π", "pi"), ("√", "sqrt"),
+)
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+class UnsupportedExpression(ValueError):
+    """Raised when an expression falls outside what the local evaluator handles"""
+
+def normalize_expression(expr: str) -> str:
+    """Map handwritten-style operators onto Python syntax"""
+    expr = expr.strip()
+    for source, target in _NORMALIZATIONS:
+        expr = expr.replace(source, target)
+    return expr
+
+def _to_number(value):
+    if isinstance(value, bool):
+        raise UnsupportedExpression("Booleans are not numbers")
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            try:
+                return float(value)
+            except ValueError:
+                raise UnsupportedExpression(f"Variable value {value!r} is not numeric")
+    raise UnsupportedExpression(f"Variable value {value!r} is not numeric")
+
+def _evaluate(node, variables: dict):
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body, variables)
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise UnsupportedExpression(f"Unsupported constant {node.value!r}")
+        return node.value
+    if isinstance(node, ast.Name):
+        if node.id in variables:
+            return _to_number(variables[node.id])
+        if node.id in _CONSTANTS:
+            return _CONSTANTS[node.id]
+        raise UnsupportedExpression(f"Unknown variable {node.id}")
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+        return _UNARY_OPERATORS[type(node.op)](_evaluate(node.operand, variables))
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+        left = _evaluate(node.left, variables)
+        right = _evaluate(node.right, variables)
+        if isinstance(node.op, ast.Pow) and abs(right) > _MAX_EXPONENT:
+            raise UnsupportedExpression("Exponent too large for local evaluation")
+        result = _BINARY_OPERATORS[type(node.op)](left, right)
+        if isinstance(result, complex) or abs(result) > _MAX_MAGNITUDE:
+            raise UnsupportedExpression("Result out of range for local evaluation")
+        return result
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+            and node.func.id in _FUNCTIONS and len(node.args) == 1 and not node.keywords):
+        return _FUNCTIONS[node.func.id](_evaluate(node.args[0], variables))
+    raise UnsupportedExpression(f"Unsupported syntax: {ast.dump(node)[:80]}")
+
+def expression_names(expr: str) -> set:
+    """Return the variable names an expression refers to (excluding constants and functions)"""
+    tree = ast.parse(normalize_expression(expr), mode="eval")
+    return {
+        node.id for node in ast.walk(tree)
+        if isinstance(node, ast.Name) and node.id not in _FUNCTIONS and node.id not in _CONSTANTS
+    }
+
+def is_assignable(name: str) -> bool:
+    """Whether name can be assigned as a variable"""
+    return bool(_IDENTIFIER.match(name)) and name not in _CONSTANTS and name not in _FUNCTIONS
+
+def assignment_parts(answer: dict):
+    """Return (target, right-hand side or None) for an assignment answer, or (None, None)
+
+    The model writes assignments as expr "y = x + 2" (latex "y = x + 2 = 7"),
+    evaluate_line as expr "y" with latex "y = 7"; the target is the left side
+    of whichever carries one, and must be a plain identifier.
+    """
+    target = None
+    for text in (str(answer.get("expr", "")), str(answer.get("latex", ""))):
+        parts = [part.strip() for part in text.split("=")]
+        if not is_assignable(parts[0]) or (target is not None and parts[0] != target):
+            continue
+        target = parts[0]
+        if len(parts) > 1 and parts[1]:
+            return target, parts[1]
+    return target, None
+
+def safe_eval(expr: str, dict_of_vars: dict = None):
+    """Evaluate an arithmetic expression without executing arbitrary code"""
+    try:
+        tree = ast.parse(normalize_expression(expr), mode="eval")
+    except SyntaxError as e:
+        raise UnsupportedExpression(f"Cannot parse expression: {e}")
+    try:
+        return _evaluate(tree, dict_of_vars or {})
+    except UnsupportedExpression:
+        raise
+    except (ArithmeticError, ValueError) as e:
+        # Division by zero, overflow and domain errors such as sqrt(-4) or log(0)
+        raise UnsupportedExpression(str(e))
+
+def format_number(value) -> str:
+    """Render a number with full precision, dropping a redundant .0"""
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e16:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+def to_latex(expr: str) -> str:
+    latex = normalize_expression(expr).replace("**", "^").replace("*", " \\times ").replace("/", " \\div ")
+    latex = re.sub(r"sqrt\(([^()]*)\)", r"\\sqrt{\1}", latex)
+    return latex.replace("pi", "\\pi")
+
+def evaluate_line(line: str, dict_of_vars: dict = None) -> dict:
+    """Evaluate one expression or assignment into the model answer shape"""
+    dict_of_vars = dict_of_vars or {}
+    line = line.strip()
+    target = None
+    expr = line
+    if line.count("=") == 1:
+        left, right = (part.strip() for part in line.split("="))
+        if is_assignable(left):
+            target, expr = left, right
+        elif not right:
+            # A trailing "=" just asks for the result
+            expr = left
+        else:
+            raise UnsupportedExpression("Equations are left to the model")
+    elif "=" in line:
+        raise UnsupportedExpression("Equations are left to the model")
+
+    value = safe_eval(expr, dict_of_vars)
+    result = format_number(value)
+    steps = []
+    names = expression_names(expr)
+    if names:
+        substituted = normalize_expression(expr)
+        for name in sorted(names, key=len, reverse=True):
+            substituted = re.sub(rf"\b{re.escape(name)}\b", str(dict_of_vars[name]), substituted)
+        steps.append({"type": "text", "content": "Substitute the known variable values"})
+        steps.append({"type": "math", "content": f"{expr} = {substituted}"})
+    steps.append({"type": "math", "content": f"{expr} = {result}"})
+
+    if target is not None:
+        return {
+            "expr": target,
+            "result": result,
+            "steps": steps,
+            "type": "variable_assignment",
+            "assign": True,
+            "latex": f"{target} = {result}",
+        }
+    return {
+        "expr": expr,
+        "result": result,
+        "steps": steps,
+        "type": "arithmetic",
+        "assign": False,
+        "latex": f"{to_latex(expr)} = {result}",
+    }
+
+class LocalEvaluator:
+    """Tries registered recognizers and evaluates confidently recognized expressions"""
+
+    def __init__(self, min_confidence: float = LOCAL_EVAL_MIN_CONFIDENCE):
+        self.min_confidence = min_confidence
+        self.recognizers = []
+        self.answered = 0
+        self.fallbacks = 0
+
+    def register(self, recognizer):
+        """Add a recognizer: any object with recognize(image) -> (text, confidence) or None"""
+        self.recognizers.append(recognizer)
+        return recognizer
+
+    @property
+    def active(self) -> bool:
+        return bool(self.recognizers)
+
+    def try_answer(self, image, dict_of_vars: dict):
+        """Return answers for the image, or None to fall back to the model"""
+        for recognizer in self.recognizers:
+            try:
+                recognized = recognizer.recognize(image)
+            except Exception as e:
+                logger.warning(f"Recognizer {recognizer.__class__.__name__} failed: {str(e)}")
+                continue
+            if not recognized:
+                continue
+            text, confidence = recognized
+            if confidence < self.min_confidence:
+                logger.debug(f"Recognized {text!r} with low confidence {confidence:.2f}")
+                continue
+            try:
+                answers = [evaluate_line(line, dict_of_vars) for line in text.splitlines() if line.strip()]
+            except UnsupportedExpression as e:
+                logger.debug(f"Recognized {text!r} but cannot evaluate locally: {str(e)}")
+                continue
+            if answers:
+                self.answered += 1
+                logger.info(f"Answered {text!r} locally (confidence {confidence:.2f})")
+                return answers
+        self.fallbacks += 1
+        return None
+
+def _build_local_evaluator():
+    evaluator = LocalEvaluator()
+    if LOCAL_EVAL_TEMPLATES_DIR:
+        from apps.calculator.recognizer import TemplateRecognizer
+        try:
+            evaluator.register(TemplateRecognizer.from_directory(LOCAL_EVAL_TEMPLATES_DIR))
+        except OSError as e:
+            logger.error(f"Failed to load glyph templates: {str(e)}")
+    return evaluator
+
+local_evaluator = _build_local_evaluator() if LOCAL_EVAL_ENABLED else None
@@ -0,0 +1,225 @@
+"""
+Prometheus-style metrics.
+
+A small dependency-free registry of counters, gauges and histograms
+rendered in the Prometheus text exposition format by GET /metrics.
+Histograms time each stage of a request (decode, image open, cache
+lookup, preprocessing, prompt build, model call, parsing and
+post-processing) so tail latency can be attributed. Values are per worker
+process; scrape each worker or aggregate with sum() in queries.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from starlette.routing import Match
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """Value that goes up and down, or is read from a callback at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        if self.function is not None:
+            self.set(self.function())
+        return super().render()
+
+class Histogram(_Metric):
+    """Cumulative-bucket distribution with sum and count"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket counts (last slot is +Inf), sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Registry:
+    """Ordered collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "calculator_stage_seconds", "Time spent in each request stage", ["stage"]))
+REQUEST_SECONDS = registry.register(Histogram(
+    "calculator_request_seconds", "End-to-end request latency", ["route"]))
+REQUESTS = registry.register(Counter(
+    "calculator_requests_total", "HTTP requests by route and status code", ["route", "status"]))
+REQUEST_BYTES = registry.register(Histogram(
+    "calculator_request_bytes", "Request body size", ["route"], buckets=BYTE_BUCKETS))
+RESPONSE_BYTES = registry.register(Histogram(
+    "calculator_response_bytes", "Response body size", ["route"], buckets=BYTE_BUCKETS))
+REQUESTS_IN_FLIGHT = registry.register(Gauge(
+    "calculator_requests_in_flight", "HTTP requests currently being served"))
+IMAGE_BYTES = registry.register(Histogram(
+    "calculator_image_bytes", "Image size as received and as uploaded to the model", ["kind"],
+    buckets=BYTE_BUCKETS))
+ANSWER_SOURCES = registry.register(Counter(
+    "calculator_answers_total", "Analyses by where the answer came from", ["source"]))
+CACHE_LOOKUPS = registry.register(Counter(
+    "calculator_cache_lookups_total", "Result cache lookups by outcome", ["result"]))
+PARSE_RESULTS = registry.register(Counter(
+    "calculator_parse_total", "Model responses by the parsing method that succeeded", ["method"]))
+MODEL_ATTEMPTS = registry.register(Counter(
+    "calculator_model_attempts_total", "Upstream model attempts by outcome", ["outcome"]))
+ERRORS = registry.register(Counter(
+    "calculator_errors_total", "Failed analyses by kind", ["kind"]))
+
+def observe_stage(stage: str):
+    """Context manager timing one request stage"""
+    return STAGE_SECONDS.time(stage=stage)
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency, status, body sizes and in-flight count per route"""
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def route_label(scope) -> str:
+        """The matching route's path template; unknown paths share one label to bound cardinality"""
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", "other")
+        return "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        route = self.route_label(scope)
+        start = time.perf_counter()
+        status = {"code": 500}
+        sizes = {"request": 0, "response": 0}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes["request"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            REQUEST_SECONDS.observe(time.perf_counter() - start, route=route)
+            REQUESTS.inc(route=route, status=str(status["code"]))
+            if scope["method"] in ("POST", "PUT"):
+                REQUEST_BYTES.observe(sizes["request"], route=route)
+            RESPONSE_BYTES.observe(sizes["response"], route=route)
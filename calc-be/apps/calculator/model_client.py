@@ -0,0 +1,266 @@
+"""
+Resilient calls to the model.
+
+Every model call goes through ModelClient.call, which applies a per-attempt
+deadline, retries transient upstream errors (429/5xx, timeouts) with
+exponential backoff and full jitter, optionally hedges a slow attempt with
+a second identical request once it passes the recent latency quantile, and
+trips a circuit breaker after repeated failures so a degraded upstream
+fails fast instead of tying up workers. Cached answers are looked up before
+the model is called, so they keep being served while the circuit is open.
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from apps.calculator.rate_limit import upstream_budget
+from apps.calculator.metrics import registry, Gauge, MODEL_ATTEMPTS
+from constants import (
+    MODEL_CALL_TIMEOUT_SECONDS,
+    MODEL_MAX_RETRIES,
+    MODEL_RETRY_BASE_SECONDS,
+    MODEL_RETRY_MAX_SECONDS,
+    MODEL_HEDGE_ENABLED,
+    MODEL_HEDGE_QUANTILE,
+    MODEL_HEDGE_MIN_SAMPLES,
+    MODEL_BREAKER_FAILURE_THRESHOLD,
+    MODEL_BREAKER_RESET_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+_retryable_errors = None
+
+def retryable_errors() -> tuple:
+    """Transient upstream errors worth retrying (429, 5xx, timeouts)
+
+    Resolved on first use because google.api_core loads grpc, which would
+    otherwise add to every cold start.
+    """
+    global _retryable_errors
+    if _retryable_errors is None:
+        from google.api_core import exceptions as google_exceptions
+        _retryable_errors = (
+            google_exceptions.TooManyRequests,
+            google_exceptions.InternalServerError,
+            google_exceptions.BadGateway,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.GatewayTimeout,
+            asyncio.TimeoutError,
+        )
+    return _retryable_errors
+
+class ModelUnavailableError(Exception):
+    """Raised when the model cannot be reached after retries, or the circuit is open"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class CircuitOpenError(ModelUnavailableError):
+    """Raised without calling the model while the circuit breaker is open"""
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open -> half-open (one trial call) -> closed"""
+
+    def __init__(self, failure_threshold: int = MODEL_BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds: float = MODEL_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go upstream now"""
+        if self.state == "closed":
+            return
+        remaining = self._opened_at + self.reset_seconds - time.monotonic()
+        if self.state == "open" and remaining <= 0:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            logger.info("Circuit half-open, sending a trial model call")
+            return
+        raise CircuitOpenError("AI model is temporarily unavailable, please retry shortly",
+                               retry_after=max(remaining, 1.0))
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info("Model call succeeded, closing circuit")
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or (
+                self.state == "closed" and self.consecutive_failures >= self.failure_threshold):
+            self.state = "open"
+            self.opened += 1
+            self._opened_at = time.monotonic()
+            logger.error(f"Opening circuit after {self.consecutive_failures} consecutive model failures")
+
+    def release_trial(self):
+        """Let another trial through after a half-open call ended without a verdict"""
+        self._trial_in_flight = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "opened": self.opened,
+        }
+
+class LatencyTracker:
+    """Sliding window of recent successful call latencies"""
+
+    def __init__(self, window: int = 512):
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def quantile(self, q: float, min_samples: int = 1):
+        """Return the q-quantile of the window, or None with fewer than min_samples"""
+        if len(self._samples) < max(min_samples, 1):
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+class ModelClient:
+    """Deadline, retry, hedging and circuit breaking around model calls"""
+
+    def __init__(self, timeout_seconds: float = MODEL_CALL_TIMEOUT_SECONDS, max_retries: int = MODEL_MAX_RETRIES,
+                 retry_base_seconds: float = MODEL_RETRY_BASE_SECONDS,
+                 retry_max_seconds: float = MODEL_RETRY_MAX_SECONDS, hedge: bool = MODEL_HEDGE_ENABLED,
+                 hedge_quantile: float = MODEL_HEDGE_QUANTILE, hedge_min_samples: int = MODEL_HEDGE_MIN_SAMPLES,
+                 breaker: CircuitBreaker = None):
+        self.timeout_seconds = timeout_seconds
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.calls = 0
+        self.retries = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failures = 0
+
+    def backoff_seconds(self, attempt: int) -> float:
+        """Full-jitter exponential backoff before retry number attempt (1-based)"""
+        ceiling = min(self.retry_max_seconds, self.retry_base_seconds * 2 ** (attempt - 1))
+        return random.uniform(0, ceiling)
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None when hedging does not apply"""
+        if not self.hedge or self.breaker.state != "closed":
+            return None
+        return self.latency.quantile(self.hedge_quantile, self.hedge_min_samples)
+
+    async def _attempt(self, coro_factory):
+        # Waiting for upstream budget does not count against the call deadline
+        await upstream_budget.acquire()
+        start = time.monotonic()
+        result = await asyncio.wait_for(coro_factory(), timeout=self.timeout_seconds)
+        self.latency.record(time.monotonic() - start)
+        return result
+
+    async def _hedged_attempt(self, coro_factory, hedge: bool):
+        delay = self.hedge_delay() if hedge else None
+        if delay is None:
+            return await self._attempt(coro_factory)
+
+        primary = asyncio.ensure_future(self._attempt(coro_factory))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.hedged += 1
+                MODEL_ATTEMPTS.inc(outcome="hedge")
+                logger.info(f"Model call slower than p{self.hedge_quantile * 100:.0f} ({delay:.2f}s), hedging")
+                tasks.add(asyncio.ensure_future(self._attempt(coro_factory)))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def call(self, coro_factory, hedge: bool = True):
+        """Await coro_factory() with deadline, retries, optional hedging and the circuit breaker
+
+        Non-retryable errors propagate unchanged; retryable ones raise
+        ModelUnavailableError once retries are exhausted.
+        """
+        self.calls += 1
+        attempt = 0
+        while True:
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                MODEL_ATTEMPTS.inc(outcome="circuit_open")
+                raise
+            try:
+                result = await self._hedged_attempt(coro_factory, hedge)
+            except retryable_errors() as e:
+                MODEL_ATTEMPTS.inc(outcome="timeout" if isinstance(e, asyncio.TimeoutError) else "retryable_error")
+                self.breaker.record_failure()
+                reason = "timed out" if isinstance(e, asyncio.TimeoutError) else str(e)
+                # No point backing off into a circuit that just opened
+                if attempt >= self.max_retries or self.breaker.state == "open":
+                    self.failures += 1
+                    logger.error(f"Model call failed after {attempt + 1} attempts: {reason}")
+                    raise ModelUnavailableError(f"AI model is unavailable: {reason}")
+                attempt += 1
+                self.retries += 1
+                delay = self.backoff_seconds(attempt)
+                logger.warning(f"Model call failed ({reason}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException as e:
+                # Cancellation, bad requests and the like say nothing about upstream health
+                if isinstance(e, Exception):
+                    MODEL_ATTEMPTS.inc(outcome="error")
+                self.breaker.release_trial()
+                raise
+            MODEL_ATTEMPTS.inc(outcome="success")
+            self.breaker.record_success()
+            return result
+
+    def stats(self) -> dict:
+        p50 = self.latency.quantile(0.5)
+        p95 = self.latency.quantile(0.95)
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "failures": self.failures,
+            "latency_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "latency_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "circuit": self.breaker.stats(),
+            "upstream_budget": upstream_budget.stats() if upstream_budget.enabled else None,
+        }
+
+model_client = ModelClient()
+
+_CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+registry.register(Gauge(
+    "calculator_model_circuit_state", "Model circuit breaker state (0 closed, 1 half-open, 2 open)",
+    function=lambda: _CIRCUIT_STATES[model_client.breaker.state]))
@@ -0,0 +1,194 @@
+"""
+Perceptual fingerprints for near-duplicate canvas detection.
+
+Canvas PNGs rarely repeat byte-for-byte, so exact hashes miss most
+resubmissions. A difference hash (dHash) over the cropped, downscaled ink
+survives anti-aliasing and stray pixels, and a multi-index hash table
+finds stored fingerprints within a Hamming radius without scanning.
+
+A 64-bit dHash cannot tell which digit was written ("3+4" and "8+4" are
+one bit apart), so the radius only selects candidates. A candidate is
+served only when its ink signature, an exact hash of the binarized and
+cropped ink, matches: the same strokes resubmitted with another colour,
+background, position or anti-aliasing resolve to the prior answer, and a
+different expression never does.
+"""
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from PIL import Image
+from constants import (
+    PHASH_ENABLED,
+    PHASH_HASH_SIZE,
+    PHASH_MAX_DISTANCE,
+    PHASH_INDEX_MAX_ENTRIES,
+    RESULT_CACHE_ENABLED,
+)
+
+# Chunk values shared by a large fraction of entries (typically the all-zero
+# chunk from blank canvas areas) are skipped on lookup; a miss only costs a
+# model call, while scanning them would make lookups linear.
+MAX_BUCKET_SCAN = 2048
+
+# Mask values above this count as ink when binarizing
+INK_THRESHOLD = 64
+
+def ink_channel(img: Image.Image) -> Image.Image:
+    """Return a full-size grayscale mask where 255 is ink and 0 is empty canvas"""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        return img.convert("RGBA").getchannel("A")
+    # Opaque images: treat whatever differs from the top-left pixel as ink
+    gray = img.convert("L")
+    background = gray.getpixel((0, 0))
+    return gray.point(lambda p: min(255, abs(p - background) * 4))
+
+def ink_mask(img: Image.Image):
+    """Return the grayscale ink mask cropped to its bounding box, or None for a blank canvas"""
+    mask = ink_channel(img)
+    bbox = mask.getbbox()
+    if not bbox:
+        return None
+    return mask.crop(bbox)
+
+def dhash(mask: Image.Image, hash_size: int = PHASH_HASH_SIZE) -> int:
+    """Compute a (hash_size ** 2)-bit difference hash of an ink mask"""
+    small = mask.resize((hash_size + 1, hash_size), Image.BOX)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+def ink_signature(mask: Image.Image) -> str:
+    """Exact hash of an ink mask binarized at INK_THRESHOLD and cropped to the result"""
+    bilevel = mask.point(lambda p: 255 if p > INK_THRESHOLD else 0)
+    bbox = bilevel.getbbox()
+    if bbox:
+        bilevel = bilevel.crop(bbox)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{bilevel.size[0]}x{bilevel.size[1]}".encode())
+    digest.update(bilevel.convert("1").tobytes())
+    return digest.hexdigest()
+
+def perceptual_fingerprint(img: Image.Image, hash_size: int = PHASH_HASH_SIZE):
+    """Return (aspect bucket, dHash, ink signature) for the ink in an image, or None for a blank canvas
+
+    The coarse log2 aspect ratio keeps differently shaped drawings, whose
+    squashed hashes could otherwise look alike, from ever being compared.
+    """
+    mask = ink_mask(img)
+    if mask is None:
+        return None
+    width, height = mask.size
+    return round(math.log2(width / height) * 2), dhash(mask, hash_size), ink_signature(mask)
+
+if hasattr(int, "bit_count"):
+    def hamming(a: int, b: int) -> int:
+        return (a ^ b).bit_count()
+else:
+    def hamming(a: int, b: int) -> int:
+        return bin(a ^ b).count("1")
+
+class MultiIndexHashIndex:
+    """Hamming-radius lookup over fixed-width hashes using multi-index hashing
+
+    The hash is split into max_distance + 1 chunks, each with its own table
+    of entry id lists. By the pigeonhole principle two hashes within the
+    radius agree exactly on at least one chunk, so a query is one dict
+    lookup per chunk followed by verifying the few candidates found.
+    """
+
+    def __init__(self, hash_bits: int = PHASH_HASH_SIZE ** 2, max_distance: int = PHASH_MAX_DISTANCE,
+                 max_entries: int = PHASH_INDEX_MAX_ENTRIES):
+        self.hash_bits = hash_bits
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.num_chunks = min(hash_bits, max_distance + 1)
+        widths = [hash_bits // self.num_chunks] * self.num_chunks
+        for i in range(hash_bits % self.num_chunks):
+            widths[i] += 1
+        self._chunk_spec = []  # (shift, mask) per chunk
+        shift = 0
+        for width in widths:
+            self._chunk_spec.append((shift, (1 << width) - 1))
+            shift += width
+        self._tables = [dict() for _ in range(self.num_chunks)]
+        self._entries = OrderedDict()  # entry id -> (namespace, hash, payload)
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _chunks(self, value: int):
+        return [(value >> shift) & mask for shift, mask in self._chunk_spec]
+
+    def add(self, namespace, value: int, payload):
+        """Index a hash under a namespace (e.g. the variables it was computed with)"""
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (namespace, value, payload)
+            for table, chunk in zip(self._tables, self._chunks(value)):
+                table.setdefault((namespace, chunk), []).append((value, entry_id))
+            while len(self._entries) > self.max_entries:
+                self._evict_oldest()
+            return entry_id
+
+    def find(self, namespace, value: int, accept=None):
+        """Return (payload, distance) for the nearest indexed hash within the radius, or None
+
+        With accept, only entries whose payload it returns true for are
+        considered, e.g. to confirm a candidate with an exact check.
+        """
+        max_distance = self.max_distance
+        best = None
+        with self._lock:
+            for table, chunk in zip(self._tables, self._chunks(value)):
+                bucket = table.get((namespace, chunk))
+                if not bucket or len(bucket) > MAX_BUCKET_SCAN:
+                    continue
+                # Buckets carry the full hash so candidates are verified
+                # without touching the entry table; an entry found through
+                # several chunks is simply compared again.
+                for candidate, entry_id in bucket:
+                    distance = hamming(value, candidate)
+                    if distance > max_distance or (best is not None and distance >= best[1]):
+                        continue
+                    if accept is None or accept(self._entries[entry_id][2]):
+                        best = (entry_id, distance)
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry_id, distance = best
+            return self._entries[entry_id][2], distance
+
+    def _evict_oldest(self):
+        entry_id, (namespace, value, _) = self._entries.popitem(last=False)
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            bucket = table.get((namespace, chunk))
+            if bucket is None:
+                continue
+            # Buckets are in insertion order, so the oldest id sits at the front
+            bucket.remove((value, entry_id))
+            if not bucket:
+                del table[(namespace, chunk)]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "max_distance": self.max_distance,
+                "hash_bits": self.hash_bits,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+near_duplicate_index = MultiIndexHashIndex() if PHASH_ENABLED and RESULT_CACHE_ENABLED else None
@@ -0,0 +1,265 @@
+"""
+Token-bucket rate limiting.
+
+RateLimitMiddleware gives every client (an API key listed in
+RATE_LIMIT_API_KEYS, otherwise the client IP) a bucket of RATE_LIMIT_BURST
+tokens refilled at RATE_LIMIT_RATE_PER_SECOND, charges one token per POST
+to /calculate and answers 429 with Retry-After when the bucket is empty.
+
+upstream_budget is a single service-wide bucket that every model call
+draws from, so traffic never exceeds the Gemini QPS allocation. Buckets
+live in process memory, or in a SQLite file shared by all workers on a
+node when RATE_LIMIT_DB_PATH is set; any object with the same take()
+method can stand in for a networked store. take() runs in a worker
+thread unless the store sets blocking = False, so waiting on a file lock
+or the network never stalls the event loop.
+"""
+import asyncio
+import json
+import logging
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from constants import (
+    RATE_LIMIT_RATE_PER_SECOND,
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_API_KEYS,
+    RATE_LIMIT_TRUST_FORWARDED,
+    RATE_LIMIT_DB_PATH,
+    UPSTREAM_QPS,
+    UPSTREAM_BURST,
+    UPSTREAM_MAX_WAIT_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+def refill(tokens: float, updated_at: float, now: float, rate: float, burst: float) -> float:
+    """Tokens in a bucket at now, given its level at updated_at"""
+    return min(burst, tokens + max(0.0, now - updated_at) * rate)
+
+def _take(tokens: float, rate: float, cost: float):
+    """Return (tokens left, allowed, seconds until cost tokens are available)"""
+    if tokens >= cost:
+        return tokens - cost, True, 0.0
+    return tokens, False, (cost - tokens) / rate if rate > 0 else math.inf
+
+class MemoryBucketStore:
+    """In-process buckets, bounded by dropping the least recently used keys"""
+
+    blocking = False
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: float, cost: float = 1.0):
+        """Charge cost tokens; returns (allowed, retry_after seconds, tokens left)"""
+        now = time.time()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (burst, now))
+            tokens, allowed, retry_after = _take(refill(tokens, updated_at, now, rate, burst), rate, cost)
+            self._buckets[key] = (tokens, now)
+            # A dropped bucket comes back full, so evicting idle keys only errs towards leniency
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, retry_after, tokens
+
+class SQLiteBucketStore:
+    """Buckets in a SQLite table, shared by every worker process that opens the same file"""
+
+    PRUNE_EVERY = 10000
+    # take() can wait up to the connection timeout for another worker's write lock
+    blocking = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._takes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def take(self, key: str, rate: float, burst: float, cost: float = 1.0):
+        """Charge cost tokens; returns (allowed, retry_after seconds, tokens left)"""
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock up front so workers cannot interleave
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._conn.execute(
+                    "SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens, updated_at = row if row else (burst, now)
+                tokens, allowed, retry_after = _take(refill(tokens, updated_at, now, rate, burst), rate, cost)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                    (key, tokens, now),
+                )
+                self._takes += 1
+                if self._takes % self.PRUNE_EVERY == 0:
+                    # Buckets idle for an hour have refilled and can be recreated on demand
+                    self._conn.execute("DELETE FROM buckets WHERE updated_at < ?", (now - 3600,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return allowed, retry_after, tokens
+
+async def take_tokens(store, key: str, rate: float, burst: float, cost: float = 1.0):
+    """store.take from a coroutine, in a worker thread when the store blocks"""
+    if getattr(store, "blocking", True):
+        return await asyncio.to_thread(store.take, key, rate, burst, cost)
+    return store.take(key, rate, burst, cost)
+
+class UpstreamBudgetExceeded(Exception):
+    """Raised when a model call cannot get upstream budget within the allowed wait"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class UpstreamBudget:
+    """Service-wide token bucket that model calls wait on before going upstream"""
+
+    def __init__(self, store, qps: float = UPSTREAM_QPS, burst: float = UPSTREAM_BURST,
+                 max_wait_seconds: float = UPSTREAM_MAX_WAIT_SECONDS):
+        self.store = store
+        self.qps = qps
+        self.burst = max(burst, 1.0)
+        self.max_wait_seconds = max_wait_seconds
+        self.granted = 0
+        self.waited = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.qps > 0
+
+    async def acquire(self):
+        """Take one token, sleeping for refills up to max_wait_seconds"""
+        if not self.enabled:
+            return
+        deadline = time.monotonic() + self.max_wait_seconds
+        waited = False
+        while True:
+            allowed, retry_after, _ = await take_tokens(self.store, "upstream", self.qps, self.burst)
+            if allowed:
+                self.granted += 1
+                self.waited += waited
+                return
+            remaining = deadline - time.monotonic()
+            if retry_after > remaining:
+                self.rejected += 1
+                logger.warning(f"Upstream budget of {self.qps} calls/s exhausted")
+                raise UpstreamBudgetExceeded("Service is at its AI model capacity, please retry shortly",
+                                             retry_after=retry_after)
+            waited = True
+            await asyncio.sleep(retry_after)
+
+    def stats(self) -> dict:
+        return {
+            "qps": self.qps,
+            "burst": self.burst,
+            "granted": self.granted,
+            "waited": self.waited,
+            "rejected": self.rejected,
+        }
+
+def parse_api_key_quotas(raw: str) -> dict:
+    """Parse RATE_LIMIT_API_KEYS into {api key: (rate per second, burst)}"""
+    try:
+        quotas = json.loads(raw or "{}")
+        return {str(key): (float(rate), float(burst)) for key, (rate, burst) in quotas.items()}
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Ignoring invalid RATE_LIMIT_API_KEYS: {str(e)}")
+        return {}
+
+class RateLimitMiddleware:
+    """ASGI middleware charging one token per POST under path_prefix
+
+    The charged bucket is left in the request state so routes that do more
+    than one analysis per request can charge the rest with charge_request.
+    """
+
+    def __init__(self, app, store=None, rate: float = RATE_LIMIT_RATE_PER_SECOND, burst: float = RATE_LIMIT_BURST,
+                 api_keys: dict = None, trust_forwarded: bool = RATE_LIMIT_TRUST_FORWARDED,
+                 path_prefix: str = "/calculate"):
+        self.app = app
+        self.store = store or bucket_store
+        self.rate = rate
+        self.burst = burst
+        self.api_keys = api_keys if api_keys is not None else parse_api_key_quotas(RATE_LIMIT_API_KEYS)
+        self.trust_forwarded = trust_forwarded
+        self.path_prefix = path_prefix
+
+    def client_quota(self, scope):
+        """Return (bucket key, rate, burst) for the caller"""
+        headers = dict(scope.get("headers") or [])
+        api_key = headers.get(b"x-api-key", b"").decode("latin-1")
+        if api_key in self.api_keys:
+            rate, burst = self.api_keys[api_key]
+            return f"key:{api_key}", rate, burst
+        forwarded = headers.get(b"x-forwarded-for", b"").decode("latin-1")
+        if self.trust_forwarded and forwarded:
+            ip = forwarded.split(",")[0].strip()
+        else:
+            ip = scope["client"][0] if scope.get("client") else "unknown"
+        return f"ip:{ip}", self.rate, self.burst
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["method"] != "POST"
+                or not scope["path"].startswith(self.path_prefix)):
+            return await self.app(scope, receive, send)
+
+        key, rate, burst = self.client_quota(scope)
+        allowed, retry_after, _ = await take_tokens(self.store, key, rate, burst)
+        if allowed:
+            scope.setdefault("state", {})["rate_limit_bucket"] = (self.store, key, rate, burst)
+            return await self.app(scope, receive, send)
+
+        logger.warning(f"Rate limited {key} on {scope['path']}")
+        body = json.dumps({"detail": "Rate limit exceeded, please slow down"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+async def charge_request(scope, cost: float):
+    """Charge cost more tokens to the bucket RateLimitMiddleware charged for this request
+
+    Returns (allowed, retry_after seconds). Requests that were not rate
+    limited are always allowed; a cost beyond the bucket's burst can never
+    be granted and returns math.inf.
+    """
+    bucket = scope.get("state", {}).get("rate_limit_bucket")
+    if bucket is None or cost <= 0:
+        return True, 0.0
+    store, key, rate, burst = bucket
+    # The middleware already took one token for the request itself
+    if cost + 1 > burst:
+        return False, math.inf
+    allowed, retry_after, _ = await take_tokens(store, key, rate, burst, cost)
+    return allowed, retry_after
+
+def _build_store():
+    if RATE_LIMIT_DB_PATH:
+        try:
+            return SQLiteBucketStore(RATE_LIMIT_DB_PATH)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to open rate limit database, using in-process buckets: {str(e)}")
+    return MemoryBucketStore()
+
+bucket_store = _build_store()
+upstream_budget = UpstreamBudget(bucket_store)
@@ -0,0 +1,151 @@
+"""
+Offline glyph recognizer for clean digit, operator and letter strokes.
+
+Splits a single line of ink into glyphs by column projection and labels
+each one by nearest-neighbour matching against a directory of labelled
+template images. Anything it is unsure about is left to the model.
+
+TEMPLATES_DIR ships a minimal typeset set (digits, operators and the
+variables a, b, c, x, y, z) that matches neatly printed glyphs; templates
+sampled from real handwriting recognize far more.
+"""
+import logging
+import os
+import string
+from PIL import Image
+from apps.calculator.phash import ink_channel, hamming
+
+logger = logging.getLogger(__name__)
+
+GLYPH_SIZE = 16
+_INK_THRESHOLD = 64
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "glyph_templates")
+
+# Template file names start with the label, e.g. "7_001.png", "plus_003.png" or "x_002.png"
+LABELS = {
+    **{str(digit): str(digit) for digit in range(10)},
+    # Lowercase only, so names cannot collide on case-insensitive file systems
+    **{letter: letter for letter in string.ascii_lowercase},
+    "plus": "+",
+    "minus": "-",
+    "times": "*",
+    "divide": "/",
+    "equals": "=",
+    "lparen": "(",
+    "rparen": ")",
+    "dot": ".",
+}
+
+def binary_ink(img: Image.Image) -> Image.Image:
+    """Full-size ink mask thresholded to 0/255
+
+    Templates and drawn glyphs both go through this, so a glyph drawn like
+    its template normalizes to the same bits.
+    """
+    return ink_channel(img).point(lambda p: 255 if p > _INK_THRESHOLD else 0)
+
+def glyph_bits(mask: Image.Image) -> int:
+    """Normalize a cropped glyph mask to a GLYPH_SIZE x GLYPH_SIZE bitmap packed into an int
+
+    The glyph is centred in a square canvas first so thin strokes such as
+    '-' and '1' keep their aspect ratio.
+    """
+    side = max(mask.size)
+    square = Image.new("L", (side, side), 0)
+    square.paste(mask, ((side - mask.width) // 2, (side - mask.height) // 2))
+    small = square.resize((GLYPH_SIZE, GLYPH_SIZE), Image.BOX)
+    value = 0
+    for pixel in small.getdata():
+        value = (value << 1) | (pixel > _INK_THRESHOLD)
+    return value
+
+def segment_glyphs(img: Image.Image):
+    """Split a single line of ink into glyph masks, left to right
+
+    Returns None when the ink spans several lines, which is beyond what
+    this recognizer handles.
+    """
+    mask = binary_ink(img)
+    bbox = mask.getbbox()
+    if not bbox:
+        return None
+    mask = mask.crop(bbox)
+    width, height = mask.size
+
+    # Box-filtering down to a single row/column gives ink coverage per line
+    rows = [value > 0 for value in mask.resize((1, height), Image.BOX).getdata()]
+    columns = [value > 0 for value in mask.resize((width, 1), Image.BOX).getdata()]
+
+    # '=' and '÷' leave short vertical gaps; a gap taller than a third of the
+    # ink means several lines of writing
+    gap = longest_gap = 0
+    for has_ink in rows:
+        gap = 0 if has_ink else gap + 1
+        longest_gap = max(longest_gap, gap)
+    if longest_gap > height // 3:
+        return None
+
+    glyphs = []
+    start = None
+    for x, has_ink in enumerate(columns + [False]):
+        if has_ink and start is None:
+            start = x
+        elif not has_ink and start is not None:
+            glyph = mask.crop((start, 0, x, height))
+            glyphs.append(glyph.crop(glyph.getbbox()))
+            start = None
+    return glyphs
+
+class TemplateRecognizer:
+    """Nearest-neighbour glyph classifier over labelled template bitmaps"""
+
+    def __init__(self, templates=None):
+        self.templates = list(templates or [])  # (label, bits)
+
+    @classmethod
+    def from_directory(cls, path: str):
+        templates = []
+        for name in sorted(os.listdir(path)):
+            stem, ext = os.path.splitext(name)
+            label = LABELS.get(stem.split("_")[0])
+            if label is None or ext.lower() not in (".png", ".webp", ".bmp"):
+                continue
+            with Image.open(os.path.join(path, name)) as template:
+                mask = binary_ink(template)
+                bbox = mask.getbbox()
+                if bbox:
+                    templates.append((label, glyph_bits(mask.crop(bbox))))
+        logger.info(f"Loaded {len(templates)} glyph templates from {path}")
+        return cls(templates)
+
+    def classify(self, glyph: Image.Image):
+        """Return (label, confidence) for one glyph mask"""
+        bits = glyph_bits(glyph)
+        best = {}
+        for label, template in self.templates:
+            distance = hamming(bits, template)
+            if label not in best or distance < best[label]:
+                best[label] = distance
+        ranked = sorted(best.items(), key=lambda item: item[1])
+        label, distance = ranked[0]
+        similarity = 1 - distance / (GLYPH_SIZE * GLYPH_SIZE)
+        if len(ranked) == 1 or ranked[1][1] == 0:
+            return label, similarity
+        # A glyph sitting almost as close to a different label is ambiguous
+        separation = 1 - distance / ranked[1][1]
+        return label, min(similarity, separation)
+
+    def recognize(self, image):
+        if not self.templates:
+            return None
+        glyphs = segment_glyphs(image)
+        if not glyphs:
+            return None
+        text = []
+        confidence = 1.0
+        for glyph in glyphs:
+            label, glyph_confidence = self.classify(glyph)
+            text.append(label)
+            confidence = min(confidence, glyph_confidence)
+        return "".join(text), confidence
@@ -0,0 +1,91 @@
+"""
+Canvas segmentation into independent expression regions.
+
+A canvas holding several expressions is split along blank bands of the
+ink projection (a recursive XY cut): into lines separated by at least
+REGION_MIN_ROW_GAP empty pixel rows, each line into blocks separated by
+at least REGION_MIN_COLUMN_GAP empty columns, and so on until no band is
+wide enough. The gaps are far wider than those inside a written
+expression (between glyphs, or around a fraction bar), so each region is
+one expression. Regions are solved separately, which lets unchanged ones
+come from the cache and only new or edited ones reach the model.
+"""
+import logging
+from PIL import Image
+from apps.calculator.phash import ink_channel
+from constants import (
+    REGION_MIN_ROW_GAP,
+    REGION_MIN_COLUMN_GAP,
+    REGION_MIN_SIZE,
+    REGION_MAX_REGIONS,
+    REGION_PADDING,
+)
+
+logger = logging.getLogger(__name__)
+
+_INK_THRESHOLD = 64
+
+def ink_runs(projection: list, min_gap: int) -> list:
+    """(start, end) spans of ink in a projection, bridging gaps narrower than min_gap"""
+    runs = []
+    start = end = None
+    for index, has_ink in enumerate(projection):
+        if not has_ink:
+            continue
+        if start is None:
+            start = index
+        elif index - end > min_gap:
+            runs.append((start, end))
+            start = index
+        end = index + 1
+    if start is not None:
+        runs.append((start, end))
+    return runs
+
+def _cut(mask: Image.Image, box: tuple, min_row_gap: int, min_column_gap: int, boxes: list):
+    left, top, right, bottom = box
+    region = mask.crop(box)
+    columns, rows = region.getprojection()
+    for projection, min_gap, horizontal in ((rows, min_row_gap, True), (columns, min_column_gap, False)):
+        runs = ink_runs(projection, min_gap)
+        if len(runs) > 1:
+            for start, end in runs:
+                part = (left, top + start, right, top + end) if horizontal else (left + start, top, left + end, bottom)
+                inner = mask.crop(part).getbbox()
+                if inner:
+                    _cut(mask, (part[0] + inner[0], part[1] + inner[1], part[0] + inner[2], part[1] + inner[3]),
+                         min_row_gap, min_column_gap, boxes)
+            return
+    boxes.append(box)
+
+def find_regions(img: Image.Image, min_row_gap: int = REGION_MIN_ROW_GAP,
+                 min_column_gap: int = REGION_MIN_COLUMN_GAP, min_size: int = REGION_MIN_SIZE) -> list:
+    """Ink bounding boxes of the separate expressions on a canvas, in reading order
+
+    Specks smaller than min_size pixels on both sides are dropped.
+    """
+    mask = ink_channel(img).point(lambda p: 255 if p > _INK_THRESHOLD else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return []
+    boxes = []
+    _cut(mask, bbox, min_row_gap, min_column_gap, boxes)
+    return [box for box in boxes if max(box[2] - box[0], box[3] - box[1]) >= min_size]
+
+def split_regions(img: Image.Image, max_regions: int = REGION_MAX_REGIONS, padding: int = REGION_PADDING) -> list:
+    """Crop each expression region out of the canvas; a single-element list means no split
+
+    Canvases with more than max_regions regions (scribbles, dense notes)
+    are left whole rather than fanned out into many model calls.
+    """
+    boxes = find_regions(img)
+    if len(boxes) <= 1 or len(boxes) > max_regions:
+        return [img]
+    width, height = img.size
+    regions = [
+        img.crop((max(0, left - padding), max(0, top - padding),
+                  min(width, right + padding), min(height, bottom + padding)))
+        for left, top, right, bottom in boxes
+    ]
+    logger.info(f"Canvas split into {len(regions)} expression regions")
+    return regions
@@ -0,0 +1,317 @@
+"""
+Tolerant parsing of model responses.
+
+parse_answers handles well-formed JSON with a single C decoder pass and
+otherwise recovers in one linear pass from the usual model quirks:
+markdown fences and prose around the list, Python literals (single quotes,
+True/False/None), trailing commas, // comments, invalid escapes such as
+LaTeX backslashes, and output truncated mid-answer.
+
+IncrementalAnswerParser consumes a streamed response chunk by chunk and
+emits every answer object (and every object in an answer's "steps" array)
+as soon as its closing brace arrives.
+"""
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"(?:\s+|//[^\n]*)*")
+_STRING_BODY = {
+    '"': re.compile(r'(?:[^"\\]|\\.)*"', re.DOTALL),
+    "'": re.compile(r"(?:[^'\\]|\\.)*'", re.DOTALL),
+}
+_AFTER_STRING = re.compile(r"\s*(?:[,:}\]]|//|$)")
+_NUMBER = re.compile(r"-?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?")
+_BARE_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_ESCAPE = re.compile(r"\\(u[0-9a-fA-F]{4}|.)", re.DOTALL)
+_FENCE = re.compile(r"```[A-Za-z]*")
+
+# Built once: json.loads with keyword arguments constructs a new decoder per call
+_DECODER = json.JSONDecoder(strict=False)
+
+_ESCAPES = {'"': '"', "'": "'", "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_LITERALS = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+
+class _Truncated(Exception):
+    """The input ended inside a value"""
+
+def _unescape(match):
+    code = match.group(1)
+    if code[0] == "u" and len(code) == 5:
+        return chr(int(code[1:], 16))
+    # Unknown escapes (typically LaTeX such as \int) keep their backslash
+    return _ESCAPES.get(code, "\\" + code)
+
+class _TolerantParser:
+    """Recursive-descent reader for JSON and Python-literal style values"""
+
+    def __init__(self, text: str, pos: int = 0):
+        self.text = text
+        self.pos = pos
+        self.truncated = False
+
+    def _skip(self):
+        self.pos = _WHITESPACE.match(self.text, self.pos).end()
+
+    def value(self):
+        self._skip()
+        if self.pos >= len(self.text):
+            raise _Truncated()
+        char = self.text[self.pos]
+        if char == "{":
+            return self._object()
+        if char == "[":
+            return self._array()
+        if char in "\"'":
+            return self._string()
+        match = _NUMBER.match(self.text, self.pos)
+        if match:
+            self.pos = match.end()
+            number = match.group()
+            return float(number) if any(c in number for c in ".eE") else int(number)
+        match = _BARE_WORD.match(self.text, self.pos)
+        if match:
+            self.pos = match.end()
+            return _LITERALS.get(match.group(), match.group())
+        raise ValueError(f"Unexpected character {char!r} at offset {self.pos}")
+
+    def _string(self):
+        quote = self.text[self.pos]
+        body = _STRING_BODY[quote]
+        start = self.pos + 1
+        scan = start
+        while True:
+            match = body.match(self.text, scan)
+            if not match:
+                raise _Truncated()
+            end = match.end()
+            # An unescaped quote that is not followed by a delimiter is part of
+            # the text (e.g. the apostrophe in 'it's'), so keep scanning
+            if _AFTER_STRING.match(self.text, end):
+                break
+            scan = end
+        self.pos = end
+        content = self.text[start:end - 1]
+        return _ESCAPE.sub(_unescape, content) if "\\" in content else content
+
+    def _key(self):
+        char = self.text[self.pos]
+        if char in "\"'":
+            return self._string()
+        match = _BARE_WORD.match(self.text, self.pos)
+        if not match:
+            raise ValueError(f"Expected a key at offset {self.pos}")
+        self.pos = match.end()
+        return match.group()
+
+    def _object(self):
+        self.pos += 1
+        result = {}
+        while True:
+            self._skip()
+            if self.pos >= len(self.text):
+                raise _Truncated()
+            char = self.text[self.pos]
+            if char == "}":
+                self.pos += 1
+                return result
+            if char == ",":
+                self.pos += 1
+                continue
+            key = self._key()
+            self._skip()
+            if self.pos >= len(self.text):
+                raise _Truncated()
+            if self.text[self.pos] != ":":
+                raise ValueError(f"Expected ':' at offset {self.pos}")
+            self.pos += 1
+            result[key] = self.value()
+
+    def _array(self):
+        self.pos += 1
+        result = []
+        while True:
+            self._skip()
+            if self.pos >= len(self.text):
+                raise _Truncated()
+            char = self.text[self.pos]
+            if char == "]":
+                self.pos += 1
+                return result
+            if char == ",":
+                self.pos += 1
+                continue
+            result.append(self.value())
+
+    def answers(self):
+        """Parse the top-level value, keeping complete answers if the input is cut off"""
+        self._skip()
+        if self.text.startswith("[", self.pos):
+            self.pos += 1
+            answers = []
+            while True:
+                self._skip()
+                if self.pos >= len(self.text):
+                    self.truncated = True
+                    return answers
+                char = self.text[self.pos]
+                if char == "]":
+                    return answers
+                if char == ",":
+                    self.pos += 1
+                    continue
+                try:
+                    answers.append(self.value())
+                except _Truncated:
+                    self.truncated = True
+                    return answers
+        try:
+            return [self.value()]
+        except _Truncated:
+            self.truncated = True
+            return []
+
+def _payload_start(text: str) -> int:
+    """Offset of the first '[' or '{' after any prose or markdown fence"""
+    starts = [i for i in (text.find("["), text.find("{")) if i >= 0]
+    return min(starts) if starts else -1
+
+def parse_answers(text: str):
+    """Parse a model response into a list of values
+
+    Returns (values, method) where method is "json" when the payload was
+    valid JSON, "tolerant" when it needed recovery, or "failed".
+    """
+    # Bare JSON, the norm with response_mime_type=json: one C-speed pass
+    # without scanning or slicing the text first
+    try:
+        parsed = _DECODER.decode(text)
+        if isinstance(parsed, (list, dict)):
+            return (parsed if isinstance(parsed, list) else [parsed]), "json"
+    except json.JSONDecodeError:
+        pass
+
+    start = _payload_start(text)
+    if start < 0:
+        return [], "failed"
+    end = max(text.rfind("]"), text.rfind("}")) + 1
+    if end > start:
+        # Well-formed JSON inside prose or a fence
+        try:
+            parsed = _DECODER.decode(text[start:end])
+            return (parsed if isinstance(parsed, list) else [parsed]), "json"
+        except json.JSONDecodeError:
+            pass
+
+    # Drop markdown fences so a closing ``` cannot be mistaken for content
+    payload = _FENCE.sub("", text[start:]) if "```" in text else text[start:]
+    parser = _TolerantParser(payload)
+    try:
+        values = parser.answers()
+    except ValueError as e:
+        logger.warning(f"Tolerant parsing failed: {str(e)}")
+        return [], "failed"
+    if parser.truncated:
+        logger.warning(f"Model response was truncated; recovered {len(values)} complete answers")
+    return values, "tolerant"
+
+def load_object(text: str):
+    """Parse one complete object, tolerating Python-literal style output"""
+    try:
+        return _DECODER.decode(text)
+    except json.JSONDecodeError:
+        pass
+    try:
+        return _TolerantParser(text).value()
+    except (ValueError, _Truncated):
+        return None
+
+class IncrementalAnswerParser:
+    """Feed text chunks in; get ("step", answer_index, step) and ("answer", index, answer) events out"""
+
+    def __init__(self):
+        self._pos = 0           # absolute offset of the next character to scan
+        self._base = 0          # absolute offset of self._text[0]
+        self._text = ""
+        self._stack = []        # [opening char, absolute start offset, key of this container in its parent]
+        self._in_string = None  # active quote character
+        self._escaped = False
+        self._string_start = None
+        self._last_string = None
+        self._pending_key = None
+        self._answers = 0
+
+    def feed(self, chunk: str):
+        """Consume a chunk and return the events it completed"""
+        self._text += chunk
+        events = []
+        text = self._text
+        base = self._base
+        for i in range(self._pos - base, len(text)):
+            char = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == self._in_string:
+                    self._in_string = None
+                    self._last_string = text[self._string_start + 1:i]
+                continue
+
+            if char in "\"'" and self._stack:
+                self._in_string = char
+                self._string_start = i
+            elif char == ":" and self._stack and self._stack[-1][0] == "{":
+                self._pending_key = self._last_string
+            elif char in "[{":
+                key = self._pending_key if self._stack and self._stack[-1][0] == "{" else None
+                self._stack.append([char, base + i, key])
+                self._pending_key = None
+            elif char in "]}" and self._stack:
+                opening, start, _ = self._stack.pop()
+                if char == "}" and opening == "{":
+                    events.extend(self._object_closed(text[start - base:i + 1]))
+            elif char == "," and self._stack and self._stack[-1][0] == "{":
+                self._pending_key = None
+
+        self._pos = base + len(text)
+        self._compact()
+        return events
+
+    def _object_closed(self, raw: str):
+        depth = len(self._stack)
+        parent = self._stack[-1] if self._stack else None
+        # Answers are objects directly inside the top-level list, or a bare top-level object
+        if depth == 0 or (depth == 1 and parent[0] == "["):
+            answer = load_object(raw)
+            if isinstance(answer, dict):
+                index = self._answers
+                self._answers += 1
+                return [("answer", index, answer)]
+            logger.warning(f"Could not parse streamed answer: {raw[:200]}")
+            return []
+        # Steps are objects inside an array keyed "steps" within an answer
+        if depth == 3 and parent[0] == "[" and parent[2] == "steps":
+            step = load_object(raw)
+            if isinstance(step, dict):
+                return [("step", self._answers, step)]
+        return []
+
+    def _compact(self):
+        # Drop text that no open container can still refer to
+        keep_from = self._stack[0][1] if self._stack else self._pos
+        if self._in_string and not self._stack:
+            keep_from = self._base + self._string_start
+        drop = keep_from - self._base
+        if drop > 0:
+            self._text = self._text[drop:]
+            self._base = keep_from
+            if self._string_start is not None:
+                self._string_start -= drop
+
+    @property
+    def answers_emitted(self) -> int:
+        return self._answers
@@ -1,8 +1,32 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Header, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from typing import Optional
+import asyncio
 import base64
+import hashlib
+import json
+import math
+import time
 from io import BytesIO
-from apps.calculator.utils import analyze_image
-from schema import ImageData
+from apps.calculator.utils import analyze_image_async, stream_analysis_async, normalize_answer, validate_response_item
+from apps.calculator.response_parser import IncrementalAnswerParser
+from apps.calculator.concurrency import analysis_limiter, QueueFullError
+from apps.calculator.model_client import ModelUnavailableError
+from apps.calculator.rate_limit import UpstreamBudgetExceeded, charge_request
+from apps.calculator.cache import result_cache, image_fingerprint, make_cache_key, canonicalize_vars
+from apps.calculator.phash import near_duplicate_index, perceptual_fingerprint
+from apps.calculator.expression_cache import expression_cache
+from apps.calculator.sessions import session_store, SESSION_ID_PATTERN
+from apps.calculator.preprocess import preprocess_image, should_preprocess
+from apps.calculator.local_eval import local_evaluator
+from apps.calculator.regions import split_regions
+from apps.calculator.encoding import encode_result
+from apps.calculator.jobs import job_queue, job_view, webhook_allowed, JobQueueFullError
+from apps.calculator.metrics import observe_stage, IMAGE_BYTES, ANSWER_SOURCES, CACHE_LOOKUPS, ERRORS
+from schema import ImageData, BatchImageData, JobRequest
+from constants import BATCH_MAX_IMAGES, BATCH_MAX_PARALLELISM, UPLOAD_MAX_BYTES, REGIONS_ENABLED
 from PIL import Image
 import logging
 
@@ -12,65 +36,337 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-@router.post('')
-async def run(data: ImageData):
+async def canvas_fingerprint(image: Image.Image) -> Optional[str]:
+    """Exact fingerprint of a canvas, hashed in the threadpool; None when caching is disabled
+
+    Computed once per request and shared by the session and cache lookups.
+    """
+    if result_cache is None:
+        return None
+    with observe_stage("fingerprint"):
+        return await run_in_threadpool(image_fingerprint, image)
+
+async def lookup_cached_answers(image: Image.Image, dict_of_vars: dict, drawing: str = None):
+    """Look up prior answers for this canvas: exact match, near-duplicates, then per-expression reuse
+
+    The lookup and the returned store callback run in the threadpool, as
+    they hash the image and may read and commit to the SQLite tier.
+    Returns (answers or None, a coroutine function that stores fresh answers).
+    """
+    if result_cache is None:
+        return None, _store_nothing
+    with observe_stage("cache_lookup"):
+        answers, store = await run_in_threadpool(_lookup_cached_answers, image, dict_of_vars, drawing)
+    if answers is not None:
+        ANSWER_SOURCES.inc(source="cache")
+
+    async def store_answers(answers):
+        if answers:
+            await run_in_threadpool(store, answers)
+
+    return answers, store_answers
+
+async def _store_nothing(answers):
+    pass
+
+def _lookup_cached_answers(image: Image.Image, dict_of_vars: dict, drawing: str = None):
+    if drawing is None:
+        drawing = image_fingerprint(image)
+    cache_key = make_cache_key(drawing, dict_of_vars)
+    answers = result_cache.get(cache_key)
+    if answers is not None:
+        logger.info("Serving analysis from result cache")
+        CACHE_LOOKUPS.inc(result="hit")
+        return answers, lambda answers: None
+
+    namespace = None
+    phash = None
+    if near_duplicate_index is not None:
+        fingerprint = perceptual_fingerprint(image)
+        if fingerprint is not None:
+            aspect, phash, signature = fingerprint
+            namespace = (aspect, canonicalize_vars(dict_of_vars))
+            # The dHash only finds candidates; the ink signature confirms the same strokes
+            match = near_duplicate_index.find(namespace, phash, accept=lambda payload: payload[1] == signature)
+            if match is not None:
+                (prior_key, _), distance = match
+                answers = result_cache.get(prior_key)
+                if answers is not None:
+                    logger.info(f"Serving analysis from near-duplicate canvas (distance {distance})")
+                    CACHE_LOOKUPS.inc(result="near_duplicate_hit")
+                    result_cache.set(cache_key, answers)
+                    return answers, lambda answers: None
+
+    # Same drawing, different variables: reuse or locally re-evaluate each expression
+    if expression_cache is not None:
+        answers = expression_cache.resolve(drawing, dict_of_vars)
+        if answers is not None:
+            logger.info("Serving analysis from expression cache")
+            CACHE_LOOKUPS.inc(result="expression_hit")
+            result_cache.set(cache_key, answers)
+            return answers, lambda answers: None
+    CACHE_LOOKUPS.inc(result="miss")
+
+    def store(answers):
+        if not answers:
+            return
+        result_cache.set(cache_key, answers)
+        if phash is not None:
+            near_duplicate_index.add(namespace, phash, (cache_key, signature))
+        if expression_cache is not None:
+            expression_cache.record(drawing, answers, dict_of_vars)
+
+    return None, store
+
+NO_EXPRESSIONS_MESSAGE = "No mathematical expressions were detected in the image"
+PARSING_ISSUE_MESSAGE = "The AI model detected mathematics but had trouble parsing the results. Please try again with clearer handwriting or a simpler expression."
+
+def decode_image(image_url: str):
+    """Decode a base64 data URL into a PIL image; returns (image, encoded byte count)"""
     try:
-        # Validate input data
-        if not data.image:
-            raise ValueError("No image data provided")
-            
-        try:
-            # Decode and process image
-            image_data = base64.b64decode(data.image.split(",")[1])
+        with observe_stage("decode_base64"):
+            image_data = base64.b64decode(image_url.split(",")[1])
+        IMAGE_BYTES.observe(len(image_data), kind="received")
+        with observe_stage("image_open"):
             image_bytes = BytesIO(image_data)
             image = Image.open(image_bytes)
-        except base64.binascii.Error as e:
-            logger.error(f"Invalid base64 image data: {str(e)}")
-            raise HTTPException(status_code=400, detail="Invalid image data format")
-        except Exception as e:
-            logger.error(f"Error processing image: {str(e)}")
-            raise HTTPException(status_code=400, detail="Failed to process image data")
-        
+            # Decode now so the stage timing (and any corrupt-data error) lands here
+            image.load()
+        return image, len(image_data)
+    except base64.binascii.Error as e:
+        logger.error(f"Invalid base64 image data: {str(e)}")
+        raise HTTPException(status_code=400, detail="Invalid image data format")
+    except Exception as e:
+        logger.error(f"Error processing image: {str(e)}")
+        raise HTTPException(status_code=400, detail="Failed to process image data")
+
+def load_image(source) -> Image.Image:
+    """Decode an encoded image from a binary file object straight into PIL
+
+    Pixels are loaded eagerly so the source (a request body buffer or a
+    spooled multipart file) can be released as soon as this returns.
+    """
+    try:
+        with observe_stage("image_open"):
+            image = Image.open(source)
+            image.load()
+        return image
+    except Exception as e:
+        logger.error(f"Error processing uploaded image: {str(e)}")
+        raise HTTPException(status_code=400, detail="Failed to process image data")
+
+async def prepare_upload(image: Image.Image, original_bytes: int, override: str = None):
+    """Run the preprocessing stage off the event loop, falling back to the raw image on failure
+
+    Returns (upload, report); report is None when the original image is sent.
+    """
+    if not should_preprocess(override):
+        return image, None
+    try:
+        with observe_stage("preprocess"):
+            upload, report = await run_in_threadpool(preprocess_image, image, original_bytes)
+        IMAGE_BYTES.observe(report["processed_bytes"], kind="uploaded")
+        return upload, report
+    except Exception as e:
+        logger.warning(f"Image preprocessing failed, sending original image: {str(e)}")
+        return image, None
+
+async def try_local_answer(image: Image.Image, dict_of_vars: dict):
+    """Answer from the local fast path, or None to fall back to the model"""
+    if local_evaluator is None or not local_evaluator.active:
+        return None
+    with observe_stage("local_eval"):
+        answers = await run_in_threadpool(local_evaluator.try_answer, image, dict_of_vars)
+    if answers is not None:
+        ANSWER_SOURCES.inc(source="local")
+    return answers
+
+def is_parse_failure(error: Exception) -> bool:
+    """Whether the model answered but no valid answers could be parsed from it"""
+    return isinstance(error, ValueError) and "No valid answers found in AI response" in str(error)
+
+async def solve_regions(regions: list, dict_of_vars: dict, preprocess_override: str = None):
+    """Solve expression regions concurrently and merge their answers in reading order
+
+    Each region goes through the full cache / local / model pipeline, so
+    unchanged regions of an edited canvas are answered from the cache.
+    A region whose answer cannot be parsed (often a stray speck) is
+    dropped; any other failure cancels the remaining regions and is
+    raised. Returns (answers, whether every region was answered).
+    """
+    async def solve_region(region):
         try:
-            # Get responses from analysis
-            responses = analyze_image(image, dict_of_vars=data.dict_of_vars)
-            
-            # Validate responses
-            if not responses or len(responses) == 0:
-                logger.warning("No valid responses returned from analysis")
-                return {
-                    "message": "No mathematical expressions were detected in the image", 
-                    "data": [], 
-                    "status": "warning"
-                }
-            
-            data = []
-            
-            # Process all responses
-            for response in responses:
-                data.append(response)
-                
-            # Log successful processing
-            logger.info(f"Successfully processed image with {len(data)} responses")
-            
+            answers, _ = await solve_image(region, dict_of_vars, None, preprocess_override, split=False)
+            return answers
+        except ValueError as ve:
+            if not is_parse_failure(ve):
+                raise
+            ERRORS.inc(kind=error_kind(ve))
+            logger.warning(f"Dropping canvas region without parseable answers: {str(ve)}")
+            return ve
+
+    tasks = [asyncio.ensure_future(solve_region(region)) for region in regions]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    failures = [result for result in results if isinstance(result, Exception)]
+    answers = [answer for result in results if not isinstance(result, Exception) for answer in result]
+    if failures and not answers:
+        raise failures[0]
+    return answers, not failures
+
+async def solve_image(image: Image.Image, dict_of_vars: dict, original_bytes: int, preprocess_override: str = None,
+                      split: bool = True, drawing: str = None):
+    """Answer one decoded image from the caches, the local fast path or the model
+
+    drawing is the canvas_fingerprint when the caller already has it.
+    Returns (answers, preprocessing report or None).
+    """
+    # Serve repeated submissions of the same canvas from the cache
+    answers, store_answers = await lookup_cached_answers(image, dict_of_vars, drawing)
+    if answers is not None:
+        return answers, None
+
+    # Confidently recognized simple arithmetic is answered locally
+    answers = await try_local_answer(image, dict_of_vars)
+    if answers is not None:
+        await store_answers(answers)
+        return answers, None
+
+    # Several separate expressions: only new or edited regions reach the model
+    if split and REGIONS_ENABLED:
+        with observe_stage("segment"):
+            regions = await run_in_threadpool(split_regions, image)
+        if len(regions) > 1:
+            answers, complete = await solve_regions(regions, dict_of_vars, preprocess_override)
+            # A partial answer is not cached for the canvas, so a resubmission retries the dropped regions
+            if complete:
+                await store_answers(answers)
+            return answers, None
+
+    upload, report = await prepare_upload(image, original_bytes, preprocess_override)
+    # Get answers from analysis without blocking the event loop
+    answers = await analysis_limiter.run(
+        lambda: analyze_image_async(upload, dict_of_vars=dict_of_vars)
+    )
+    ANSWER_SOURCES.inc(source="model")
+    await store_answers(answers)
+    return answers, report
+
+async def session_prompt_vars(session_id: Optional[str], drawing: Optional[str], dict_of_vars: dict) -> dict:
+    """Merge request variables into the session and return the ones the drawing could reference
+
+    drawing is the request's canvas_fingerprint. Without a session id the
+    request's dict_of_vars is used as is.
+    """
+    if session_id is None or session_store is None:
+        return dict_of_vars
+    if not SESSION_ID_PATTERN.match(session_id):
+        raise HTTPException(status_code=400, detail="X-Session-Id must be 8-128 letters, digits, '-' or '_'")
+    referenced = None
+    if expression_cache is not None and drawing is not None:
+        referenced = expression_cache.referenced_names(drawing)
+    # The session backend may be a SQLite file
+    return await run_in_threadpool(session_store.prompt_vars, session_id, dict_of_vars, referenced)
+
+async def capture_assignments(session_id: Optional[str], answers: list):
+    """Remember variables assigned by the answers in the session"""
+    if session_id is not None and session_store is not None and answers:
+        assigned = await run_in_threadpool(session_store.capture, session_id, answers)
+        if assigned:
+            logger.info(f"Captured {len(assigned)} assignments into session")
+
+def error_kind(error: Exception) -> str:
+    """Label for calculator_errors_total"""
+    if isinstance(error, QueueFullError):
+        return "queue_full"
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(error, ModelUnavailableError):
+        return "model_unavailable"
+    if isinstance(error, UpstreamBudgetExceeded):
+        return "upstream_budget"
+    if is_parse_failure(error):
+        return "parse"
+    return "analysis"
+
+def build_result(answers: list) -> dict:
+    """Wrap answers in the response envelope returned by the calculate routes"""
+    if not answers:
+        logger.warning("No valid responses returned from analysis")
+        return {"message": NO_EXPRESSIONS_MESSAGE, "data": [], "status": "warning"}
+    logger.info(f"Successfully processed image with {len(answers)} responses")
+    return {"message": "Image processed successfully", "data": list(answers), "status": "success"}
+
+async def answer_image(image: Image.Image, dict_of_vars: dict, original_bytes: int, response: Response,
+                       preprocess_override: str = None, session_id: str = None) -> dict:
+    """Solve one decoded image for the single-image routes, mapping failures to HTTP errors"""
+    drawing = await canvas_fingerprint(image)
+    dict_of_vars = await session_prompt_vars(session_id, drawing, dict_of_vars)
+    try:
+        responses, report = await solve_image(image, dict_of_vars, original_bytes, preprocess_override,
+                                              drawing=drawing)
+        await capture_assignments(session_id, responses)
+        if report is not None:
+            response.headers["X-Image-Bytes-Original"] = str(report["original_bytes"])
+            response.headers["X-Image-Bytes-Uploaded"] = str(report["processed_bytes"])
+        return build_result(responses)
+    except QueueFullError as qe:
+        ERRORS.inc(kind=error_kind(qe))
+        raise HTTPException(status_code=429, detail=str(qe), headers={"Retry-After": "1"})
+    except asyncio.TimeoutError as te:
+        ERRORS.inc(kind=error_kind(te))
+        raise HTTPException(status_code=504, detail="Image analysis timed out")
+    except ModelUnavailableError as me:
+        ERRORS.inc(kind=error_kind(me))
+        raise HTTPException(status_code=503, detail=str(me),
+                            headers={"Retry-After": str(math.ceil(me.retry_after))})
+    except UpstreamBudgetExceeded as be:
+        ERRORS.inc(kind=error_kind(be))
+        raise HTTPException(status_code=429, detail=str(be),
+                            headers={"Retry-After": str(max(1, math.ceil(be.retry_after)))})
+    except ValueError as ve:
+        ERRORS.inc(kind=error_kind(ve))
+        if "No valid answers found in AI response" in str(ve):
+            logger.warning(f"Parsing issue: {str(ve)}")
             return {
-                "message": "Image processed successfully", 
-                "data": data, 
-                "status": "success"
+                "message": PARSING_ISSUE_MESSAGE, 
+                "data": [], 
+                "status": "warning"
             }
-        except ValueError as ve:
-            if "No valid answers found in AI response" in str(ve):
-                logger.warning(f"Parsing issue: {str(ve)}")
-                return {
-                    "message": "The AI model detected mathematics but had trouble parsing the results. Please try again with clearer handwriting or a simpler expression.", 
-                    "data": [], 
-                    "status": "warning"
-                }
-            logger.error(f"Error in image analysis: {str(ve)}")
-            raise HTTPException(status_code=500, detail=str(ve))
-        except Exception as e:
-            logger.error(f"Error in image analysis: {str(e)}")
-            raise HTTPException(status_code=500, detail="Failed to analyze image")
+        logger.error(f"Error in image analysis: {str(ve)}")
+        raise HTTPException(status_code=500, detail=str(ve))
+    except Exception as e:
+        ERRORS.inc(kind=error_kind(e))
+        logger.error(f"Error in image analysis: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to analyze image")
+
+def encoded_response(result: dict, accept: Optional[str], response: Response) -> Response:
+    """Serialize a result for the client's Accept header, keeping the headers set on response
+
+    Returning the bytes directly also skips FastAPI's jsonable_encoder pass
+    over every answer and step.
+    """
+    body, media_type = encode_result(result, accept)
+    headers = {name: value for name, value in response.headers.items() if name != "content-length"}
+    headers["Vary"] = "Accept"
+    return Response(body, media_type=media_type, headers=headers)
+
+@router.post('')
+async def run(data: ImageData, response: Response, x_preprocess: Optional[str] = Header(None),
+              x_session_id: Optional[str] = Header(None), accept: Optional[str] = Header(None)):
+    try:
+        # Validate input data
+        if not data.image:
+            raise ValueError("No image data provided")
+            
+        # Decode and process image
+        image, original_bytes = decode_image(data.image)
+        result = await answer_image(image, data.dict_of_vars, original_bytes, response, x_preprocess, x_session_id)
+        return encoded_response(result, accept, response)
             
     except HTTPException as he:
         # Re-raise HTTP exceptions
@@ -83,3 +379,302 @@ async def run(data: ImageData):
         # Handle unexpected errors
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
+
+UPLOAD_CONTENT_TYPES = ("image/png", "image/webp", "image/jpeg")
+
+def parse_vars(value) -> dict:
+    """Parse the JSON variable dictionary sent in a header or form field"""
+    if not value:
+        return {}
+    try:
+        dict_of_vars = json.loads(value)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="dict_of_vars must be a JSON object")
+    if not isinstance(dict_of_vars, dict):
+        raise HTTPException(status_code=400, detail="dict_of_vars must be a JSON object")
+    return dict_of_vars
+
+async def read_body(request: Request, limit: int) -> bytes:
+    """Read a raw request body, refusing it as soon as it exceeds limit bytes"""
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(status_code=413, detail=f"Image exceeds {limit} bytes")
+        chunks.append(chunk)
+    return chunks[0] if len(chunks) == 1 else b"".join(chunks)
+
+@router.post('/upload')
+async def run_upload(request: Request, response: Response, x_preprocess: Optional[str] = Header(None),
+                     x_dict_of_vars: Optional[str] = Header(None), x_session_id: Optional[str] = Header(None),
+                     accept: Optional[str] = Header(None)):
+    """Binary variant of run: a raw image/png, image/webp or image/jpeg body, or multipart/form-data
+
+    Variables come from the X-Dict-Of-Vars header (JSON) or a multipart
+    dict_of_vars field. The encoded bytes are handed to PIL without the
+    base64 text, split and decode copies of the JSON route.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image exceeds {UPLOAD_MAX_BYTES} bytes")
+
+    if content_type == "multipart/form-data":
+        async with request.form(max_files=1, max_fields=8) as form:
+            upload = form.get("image")
+            if not isinstance(upload, UploadFile):
+                raise HTTPException(status_code=400, detail="Missing 'image' file field")
+            if upload.size is not None and upload.size > UPLOAD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"Image exceeds {UPLOAD_MAX_BYTES} bytes")
+            dict_of_vars = parse_vars(form.get("dict_of_vars") or x_dict_of_vars)
+            original_bytes = upload.size
+            # PIL reads the spooled upload file directly
+            image = await run_in_threadpool(load_image, upload.file)
+    elif content_type in UPLOAD_CONTENT_TYPES:
+        dict_of_vars = parse_vars(x_dict_of_vars)
+        body = await read_body(request, UPLOAD_MAX_BYTES)
+        if not body:
+            raise HTTPException(status_code=400, detail="No image data provided")
+        original_bytes = len(body)
+        # BytesIO shares the bytes buffer until written to, so this is not a copy
+        image = await run_in_threadpool(load_image, BytesIO(body))
+    else:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Expected multipart/form-data or one of {', '.join(UPLOAD_CONTENT_TYPES)}",
+        )
+
+    result = await answer_image(image, dict_of_vars, original_bytes, response, x_preprocess, x_session_id)
+    return encoded_response(result, accept, response)
+
+def sse_event(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+async def stream_answers(image: Image.Image, dict_of_vars: dict, original_bytes: int, preprocess_override: str = None,
+                         session_id: str = None, drawing: str = None):
+    """Yield SSE events for one image: each step and answer as soon as the model produces it"""
+    answers, store_answers = await lookup_cached_answers(image, dict_of_vars, drawing)
+    if answers is None:
+        answers = await try_local_answer(image, dict_of_vars)
+        if answers is not None:
+            await store_answers(answers)
+    if answers is not None:
+        await capture_assignments(session_id, answers)
+        for index, answer in enumerate(answers):
+            yield sse_event("answer", {"index": index, "answer": answer})
+        yield sse_event("done", build_result(answers))
+        return
+
+    upload, _ = await prepare_upload(image, original_bytes, preprocess_override)
+    parser = IncrementalAnswerParser()
+    answers = []
+    try:
+        async with analysis_limiter.slot():
+            deadline = time.monotonic() + analysis_limiter.timeout_seconds
+            chunks = stream_analysis_async(upload, dict_of_vars).__aiter__()
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=remaining)
+                except StopAsyncIteration:
+                    break
+                # Indexes count emitted answers; the parser also counts answers that fail validation
+                for kind, _, item in parser.feed(chunk):
+                    if kind == "step":
+                        yield sse_event("step", {"answer_index": len(answers), "step": item})
+                    elif validate_response_item(item):
+                        answer = normalize_answer(item)
+                        answers.append(answer)
+                        yield sse_event("answer", {"index": len(answers) - 1, "answer": answer})
+    except (QueueFullError, ModelUnavailableError, UpstreamBudgetExceeded) as e:
+        ERRORS.inc(kind=error_kind(e))
+        yield sse_event("error", {"message": str(e), "retryable": True})
+        return
+    except asyncio.TimeoutError as te:
+        ERRORS.inc(kind=error_kind(te))
+        logger.error("Streaming analysis timed out")
+        yield sse_event("error", {"message": "Image analysis timed out", "retryable": True})
+        return
+    except ValueError as ve:
+        ERRORS.inc(kind=error_kind(ve))
+        yield sse_event("error", {"message": str(ve), "retryable": False})
+        return
+
+    if not answers and parser.answers_emitted:
+        yield sse_event("done", {"message": PARSING_ISSUE_MESSAGE, "data": [], "status": "warning"})
+        return
+    ANSWER_SOURCES.inc(source="model")
+    await store_answers(answers)
+    await capture_assignments(session_id, answers)
+    yield sse_event("done", build_result(answers))
+
+@router.post('/stream')
+async def run_stream(data: ImageData, x_preprocess: Optional[str] = Header(None),
+                     x_session_id: Optional[str] = Header(None)):
+    """Server-sent events variant of run: 'step' and 'answer' events as they arrive, then 'done'"""
+    if not data.image:
+        raise HTTPException(status_code=400, detail="No image data provided")
+    image, original_bytes = decode_image(data.image)
+    drawing = await canvas_fingerprint(image)
+    dict_of_vars = await session_prompt_vars(x_session_id, drawing, data.dict_of_vars)
+    return StreamingResponse(
+        stream_answers(image, dict_of_vars, original_bytes, x_preprocess, x_session_id, drawing),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def solve_batch_item(image_url: str, dict_of_vars: dict, preprocess_override: str = None) -> dict:
+    """Analyze one batch entry, turning failures into a per-item result instead of an HTTP error"""
+    try:
+        image, original_bytes = decode_image(image_url)
+        answers, _ = await solve_image(image, dict_of_vars, original_bytes, preprocess_override)
+        return build_result(answers)
+    except HTTPException as he:
+        return {"message": he.detail, "data": [], "status": "error"}
+    except (QueueFullError, ModelUnavailableError, UpstreamBudgetExceeded) as e:
+        ERRORS.inc(kind=error_kind(e))
+        return {"message": str(e), "data": [], "status": "error", "retryable": True}
+    except asyncio.TimeoutError as te:
+        ERRORS.inc(kind=error_kind(te))
+        return {"message": "Image analysis timed out", "data": [], "status": "error", "retryable": True}
+    except ValueError as ve:
+        ERRORS.inc(kind=error_kind(ve))
+        if "No valid answers found in AI response" in str(ve):
+            return {"message": PARSING_ISSUE_MESSAGE, "data": [], "status": "warning"}
+        logger.error(f"Error in batch image analysis: {str(ve)}")
+        return {"message": str(ve), "data": [], "status": "error"}
+    except Exception as e:
+        ERRORS.inc(kind=error_kind(e))
+        logger.error(f"Error in batch image analysis: {str(e)}")
+        return {"message": "Failed to analyze image", "data": [], "status": "error"}
+
+@router.post('/batch')
+async def run_batch(batch: BatchImageData, request: Request, x_preprocess: Optional[str] = Header(None)):
+    """Analyze many images in one request, streaming NDJSON lines as each finishes
+
+    Identical entries (same image and variables) are analyzed once, and at
+    most BATCH_MAX_PARALLELISM analyses from the batch run at a time. The
+    client's rate limit is charged one token per unique image.
+    """
+    if not batch.images:
+        raise HTTPException(status_code=400, detail="No images provided")
+    if len(batch.images) > BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=413, detail=f"A batch may contain at most {BATCH_MAX_IMAGES} images")
+    # Group entries by content so duplicates share one analysis
+    groups = {}
+    for index, item in enumerate(batch.images):
+        dict_of_vars = item.dict_of_vars if item.dict_of_vars is not None else batch.dict_of_vars
+        digest = hashlib.blake2b(item.image.encode(), digest_size=16)
+        digest.update(canonicalize_vars(dict_of_vars).encode())
+        group = groups.setdefault(digest.hexdigest(), {"image": item.image, "dict_of_vars": dict_of_vars, "entries": []})
+        group["entries"].append((index, item.id))
+    logger.info(f"Batch of {len(batch.images)} images ({len(groups)} unique)")
+
+    # Duplicates never reach the model, so only unique entries are charged
+    allowed, retry_after = await charge_request(request.scope, len(groups) - 1)
+    if not allowed:
+        if math.isinf(retry_after):
+            raise HTTPException(status_code=413, detail="Batch has more unique images than this client's rate "
+                                                        "limit burst; use an API key with a larger quota")
+        raise HTTPException(status_code=429, detail="Rate limit exceeded, please slow down",
+                            headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+    semaphore = asyncio.Semaphore(BATCH_MAX_PARALLELISM)
+
+    async def solve_group(group):
+        async with semaphore:
+            result = await solve_batch_item(group["image"], group["dict_of_vars"], x_preprocess)
+        return group, result
+
+    async def stream():
+        tasks = [asyncio.ensure_future(solve_group(group)) for group in groups.values()]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                group, result = await finished
+                for index, item_id in group["entries"]:
+                    yield json.dumps({"index": index, "id": item_id, **result}, ensure_ascii=False) + "\n"
+        finally:
+            # Stop outstanding work if the client disconnects mid-stream
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@router.get('/cache/stats')
+async def cache_stats():
+    """Expose result cache hit/miss counters for sizing"""
+    if result_cache is None:
+        return {"enabled": False}
+    stats = {"enabled": True, **result_cache.stats()}
+    if near_duplicate_index is not None:
+        stats["near_duplicates"] = near_duplicate_index.stats()
+    if expression_cache is not None:
+        stats["expressions"] = expression_cache.stats()
+    return stats
+
+def require_sessions(session_id: str):
+    if session_store is None:
+        raise HTTPException(status_code=404, detail="Sessions are disabled")
+    if not SESSION_ID_PATTERN.match(session_id):
+        raise HTTPException(status_code=400, detail="Session ids are 8-128 letters, digits, '-' or '_'")
+
+@router.get('/session/{session_id}')
+async def get_session(session_id: str):
+    """Variables stored for a session, oldest assignment first"""
+    require_sessions(session_id)
+    return {"session_id": session_id, "dict_of_vars": session_store.get(session_id)}
+
+@router.delete('/session/{session_id}')
+async def delete_session(session_id: str):
+    """Forget a session's variables, e.g. when the canvas is reset"""
+    require_sessions(session_id)
+    session_store.delete(session_id)
+    return {"session_id": session_id, "deleted": True}
+
+async def run_job(request: dict) -> dict:
+    """Job queue runner: one stored request through the batch item pipeline"""
+    return await solve_batch_item(request["image"], request["dict_of_vars"], request.get("preprocess"))
+
+def require_jobs():
+    if job_queue is None:
+        raise HTTPException(status_code=404, detail="Background jobs are disabled")
+
+@router.post('/jobs', status_code=202)
+async def submit_job(data: JobRequest, x_preprocess: Optional[str] = Header(None)):
+    """Queue an analysis and return its job id at once; poll GET /calculate/jobs/{id} or pass a webhook"""
+    require_jobs()
+    if not data.image:
+        raise HTTPException(status_code=400, detail="No image data provided")
+    # Resolving the webhook host blocks on DNS
+    if data.webhook and not await run_in_threadpool(webhook_allowed, data.webhook):
+        raise HTTPException(status_code=400, detail="Webhook must be an http(s) URL on an allowed, public host")
+    request = {"image": data.image, "dict_of_vars": data.dict_of_vars, "preprocess": x_preprocess}
+    try:
+        job = await job_queue.submit(request, data.priority, data.webhook)
+    except JobQueueFullError as qe:
+        raise HTTPException(status_code=429, detail=str(qe), headers={"Retry-After": "5"})
+    logger.info(f"Queued job {job['id']} with priority {data.priority}")
+    return job_view(job)
+
+@router.get('/jobs/{job_id}')
+async def get_job(job_id: str):
+    """Status of a job, with its result once it has finished"""
+    require_jobs()
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return job_view(job)
+
+@router.delete('/jobs/{job_id}')
+async def cancel_job(job_id: str):
+    """Cancel a job that has not started yet"""
+    require_jobs()
+    if not await job_queue.cancel(job_id):
+        job = await job_queue.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired job")
+        raise HTTPException(status_code=409, detail=f"Job is already {job['status']}")
+    return job_view(await job_queue.get(job_id))
@@ -0,0 +1,239 @@
+"""
+Server-side session variables.
+
+Clients that send an X-Session-Id header no longer need to resend every
+assigned variable: assignments (answers with assign: true) are captured
+into the session automatically, and dict_of_vars in the request only has
+to carry new or overridden values. Only the variables the drawing could
+reference go into the prompt, so prompt size stays flat as a session grows.
+
+Sessions expire after SESSION_TTL_SECONDS without use. They live in
+process memory, or in a SQLite file shared by all workers when
+SESSION_DB_PATH is set; any object with the same get/set/delete methods
+can stand in for another backend. With several workers the path defaults
+to a file in SERVER_STATE_DIR: a request can land on any worker, and a
+worker missing the session would silently prompt without its variables.
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from apps.calculator.local_eval import assignment_parts
+from constants import (
+    SESSION_ENABLED,
+    SESSION_TTL_SECONDS,
+    SESSION_MAX_SESSIONS,
+    SESSION_MAX_VARS,
+    SESSION_PROMPT_MAX_VARS,
+    SESSION_DB_PATH,
+    SERVER_WORKER_COUNT,
+)
+
+logger = logging.getLogger(__name__)
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,128}$")
+
+class MemorySessionBackend:
+    """In-process sessions, bounded by dropping the least recently used"""
+
+    def __init__(self, max_sessions: int = SESSION_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # session id -> (expires_at, variables)
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str):
+        """Return (variables, expires_at), or None"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            self._sessions.move_to_end(session_id)
+            expires_at, variables = entry
+            return dict(variables), expires_at
+
+    def set(self, session_id: str, variables: dict, expires_at: float):
+        with self._lock:
+            self._sessions[session_id] = (expires_at, dict(variables))
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+class SQLiteSessionBackend:
+    """Sessions in a SQLite table, shared by every worker process that opens the same file"""
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path: str):
+        self.path = path
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY, variables TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, session_id: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT variables, expires_at FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        variables, expires_at = row
+        # json keeps insertion order, which records assignment recency
+        return json.loads(variables), expires_at
+
+    def set(self, session_id: str, variables: dict, expires_at: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, variables, expires_at) VALUES (?, ?, ?)",
+                (session_id, json.dumps(variables, ensure_ascii=False, default=str), expires_at),
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+            self._conn.commit()
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+def select_prompt_vars(variables: dict, referenced, limit: int = SESSION_PROMPT_MAX_VARS) -> dict:
+    """Variables worth sending with a drawing
+
+    With the names the drawing references known, exactly those; otherwise
+    the limit most recently assigned, which are the likeliest to be used.
+    """
+    if referenced is not None:
+        return {name: value for name, value in variables.items() if name in referenced}
+    if len(variables) <= limit:
+        return dict(variables)
+    return dict(list(variables.items())[-limit:]) if limit > 0 else {}
+
+class SessionStore:
+    """Sliding-TTL variable dictionaries per session id"""
+
+    def __init__(self, backend=None, ttl_seconds: float = SESSION_TTL_SECONDS, max_vars: int = SESSION_MAX_VARS):
+        # Not "backend or ...": a backend with no sessions yet has len() 0
+        self.backend = backend if backend is not None else MemorySessionBackend()
+        self.ttl_seconds = ttl_seconds
+        self.max_vars = max_vars
+        self.captured = 0
+        self.prompt_vars_sent = 0
+        self.prompt_vars_omitted = 0
+        self.prompt_vars_truncated = 0
+
+    def get(self, session_id: str) -> dict:
+        """The session's variables, oldest assignment first; empty for unknown or expired sessions"""
+        try:
+            entry = self.backend.get(session_id)
+        except sqlite3.Error as e:
+            logger.warning(f"Session lookup failed: {str(e)}")
+            return {}
+        if entry is None:
+            return {}
+        variables, expires_at = entry
+        if expires_at <= time.time():
+            self.delete(session_id)
+            return {}
+        return variables
+
+    def update(self, session_id: str, changes: dict) -> dict:
+        """Merge changes into the session, most recent last, and refresh its TTL"""
+        variables = self.get(session_id)
+        for name, value in changes.items():
+            # Re-inserting moves the name to the end, keeping recency order
+            variables.pop(name, None)
+            variables[name] = value
+        while len(variables) > self.max_vars:
+            variables.pop(next(iter(variables)))
+        try:
+            self.backend.set(session_id, variables, time.time() + self.ttl_seconds)
+        except sqlite3.Error as e:
+            logger.warning(f"Session write failed: {str(e)}")
+        return variables
+
+    def delete(self, session_id: str):
+        try:
+            self.backend.delete(session_id)
+        except sqlite3.Error as e:
+            logger.warning(f"Session delete failed: {str(e)}")
+
+    def prompt_vars(self, session_id: str, request_vars: dict, referenced=None) -> dict:
+        """Merge request variables into the session and return the subset the prompt needs"""
+        variables = self.update(session_id, request_vars or {})
+        selected = select_prompt_vars(variables, referenced)
+        self.prompt_vars_sent += len(selected)
+        self.prompt_vars_omitted += len(variables) - len(selected)
+        if referenced is None and len(selected) < len(variables):
+            # The drawing is new, so the dropped variables may be ones it uses
+            self.prompt_vars_truncated += 1
+            dropped = [name for name in variables if name not in selected]
+            logger.warning(f"Drawing not seen before: sending the {len(selected)} most recent of {len(variables)} "
+                           f"session variables (SESSION_PROMPT_MAX_VARS), omitting {', '.join(dropped[:10])}"
+                           f"{', ...' if len(dropped) > 10 else ''}")
+        return selected
+
+    def capture(self, session_id: str, answers: list):
+        """Store the values assigned by answers with assign: true
+
+        Answers whose target is not a plain identifier are skipped.
+        """
+        assigned = {}
+        for answer in answers or []:
+            if not answer.get("assign") or "result" not in answer:
+                continue
+            target, _ = assignment_parts(answer)
+            if target is not None:
+                assigned[target] = answer["result"]
+        if assigned:
+            self.update(session_id, assigned)
+            self.captured += len(assigned)
+        return assigned
+
+    def stats(self) -> dict:
+        """Session counters; counting SQLite rows blocks, so call it off the event loop"""
+        return {
+            "sessions": len(self.backend),
+            "ttl_seconds": self.ttl_seconds,
+            "captured": self.captured,
+            "prompt_vars_sent": self.prompt_vars_sent,
+            "prompt_vars_omitted": self.prompt_vars_omitted,
+            "prompt_vars_truncated": self.prompt_vars_truncated,
+        }
+
+def _build_backend():
+    if SESSION_DB_PATH:
+        try:
+            if os.path.dirname(SESSION_DB_PATH):
+                os.makedirs(os.path.dirname(SESSION_DB_PATH), exist_ok=True)
+            backend = SQLiteSessionBackend(SESSION_DB_PATH)
+            logger.info(f"Sessions persisting to {SESSION_DB_PATH}")
+            return backend
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Failed to open session database, keeping sessions in memory: {str(e)}")
+    if SERVER_WORKER_COUNT > 1:
+        logger.warning(f"Sessions are per process across {SERVER_WORKER_COUNT} workers; variables captured "
+                       f"on one worker are missing on the others. Set SESSION_DB_PATH to a shared SQLite file")
+    return MemorySessionBackend()
+
+session_store = SessionStore(_build_backend()) if SESSION_ENABLED else None
@@ -1,277 +1,347 @@
-import google.generativeai as genai
-import ast
+import asyncio
 import json
-import re
+import threading
+import time
 from PIL import Image
-from constants import GEMINI_API_KEY
+from apps.calculator.response_parser import parse_answers
+from apps.calculator.model_client import model_client, ModelUnavailableError
+from apps.calculator.rate_limit import UpstreamBudgetExceeded
+from apps.calculator.metrics import observe_stage, STAGE_SECONDS, PARSE_RESULTS
+from constants import GEMINI_API_KEY, GEMINI_MODEL_NAME, GEMINI_SYSTEM_INSTRUCTION, FAKE_MODEL_ENABLED
 import logging
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
-# Validate API key
-if not GEMINI_API_KEY:
+# Validate API key (the offline fake model does not need one)
+if not GEMINI_API_KEY and not FAKE_MODEL_ENABLED:
     raise ValueError("GEMINI_API_KEY is not set in environment variables")
 
-try:
-    genai.configure(api_key=GEMINI_API_KEY)
-    logger.info("Successfully configured Gemini API")
-except Exception as e:
-    logger.error(f"Failed to configure Gemini API: {str(e)}")
-    raise
-
-def clean_gemini_response(response_text: str) -> str:
-    """Clean the Gemini response by removing markdown code blocks and other artifacts"""
-    logger.debug(f"Original response before cleaning: {response_text[:500]}...")
-    
-    # Check if the response is wrapped in markdown code blocks
-    if response_text.startswith("```") and "```" in response_text[3:]:
-        # Extract content between the first set of triple backticks
-        try:
-            # Find the start of the content (after the first line with ```)
-            start_idx = response_text.find("\n", response_text.find("```")) + 1
-            
-            # Find the end of the content (before the closing ```)
-            end_idx = response_text.rfind("```")
-            
-            # Extract the content between these markers
-            if start_idx > 0 and end_idx > start_idx:
-                response_text = response_text[start_idx:end_idx].strip()
-                logger.debug(f"Extracted content from markdown block: {response_text[:500]}...")
-        except Exception as e:
-            logger.warning(f"Error extracting content from markdown blocks: {e}")
-    
-    # If the above method fails or isn't applicable, use the regex approach as a fallback
-    # Remove markdown code block markers with any language specifier
-    response_text = re.sub(r'```(?:json|python|)?\s*', '', response_text)
-    response_text = re.sub(r'```\s*', '', response_text)
-    
-    # Remove any leading/trailing whitespace
-    response_text = response_text.strip()
-    
-    # Debug logging to see the cleaned response
-    logger.debug(f"Cleaned response: {response_text[:500]}...")
-    
-    return response_text
+_genai = None
+_genai_lock = threading.Lock()
+
+def load_genai():
+    """Import and configure google.generativeai on first use
+
+    The SDK and its gRPC/protobuf stack are most of the app's import time,
+    so they load when the first model is built (or during warm_up) rather
+    than when the server process starts.
+    """
+    global _genai
+    if _genai is None:
+        with _genai_lock:
+            if _genai is None:
+                start = time.perf_counter()
+                import google.generativeai as genai
+                try:
+                    genai.configure(api_key=GEMINI_API_KEY)
+                    logger.info(f"Successfully configured Gemini API ({(time.perf_counter() - start) * 1000:.0f} ms)")
+                except Exception as e:
+                    logger.error(f"Failed to configure Gemini API: {str(e)}")
+                    raise
+                _genai = genai
+    return _genai
 
 def validate_response_item(item: dict) -> bool:
     """Validate that a response item has the required fields"""
     required_fields = {'expr', 'result'}
-    return all(field in item for field in required_fields)
+    return isinstance(item, dict) and all(field in item for field in required_fields)
 
 def parse_gemini_response(response_text: str) -> list:
     """Safely parse the Gemini response into a list of dictionaries"""
     logger.debug(f"Attempting to parse response: {response_text[:100]}...")
-    
-    try:
-        # Clean the response first
-        cleaned_response = clean_gemini_response(response_text)
-        
-        # First try with json.loads (preferred for JSON data)
-        try:
-            parsed = json.loads(cleaned_response)
-            logger.info("Successfully parsed response with json.loads")
-            if not isinstance(parsed, list):
-                parsed = [parsed]
-            return [item for item in parsed if validate_response_item(item)]
-        except json.JSONDecodeError as je:
-            logger.warning(f"json.loads failed: {je}, trying ast.literal_eval")
-            
-            # If json.loads fails, try with ast.literal_eval
-            try:
-                parsed = ast.literal_eval(cleaned_response)
-                logger.info("Successfully parsed response with ast.literal_eval")
-                if not isinstance(parsed, list):
-                    parsed = [parsed]
-                return [item for item in parsed if validate_response_item(item)]
-            except (SyntaxError, ValueError) as se:
-                logger.warning(f"ast.literal_eval failed: {se}, trying manual parsing")
-                
-                # Last resort: Try to manually convert Python-style code to valid JSON
-                # Replace single quotes with double quotes for JSON
-                json_fixed = cleaned_response.replace("'", '"')
-                # Fix boolean values
-                json_fixed = json_fixed.replace("True", "true").replace("False", "false")
-                
-                try:
-                    parsed = json.loads(json_fixed)
-                    logger.info("Successfully parsed response with manual fixing")
-                    if not isinstance(parsed, list):
-                        parsed = [parsed]
-                    return [item for item in parsed if validate_response_item(item)]
-                except Exception as e:
-                    logger.error(f"All parsing methods failed, last error: {e}")
-                    raise
-    except Exception as e:
-        logger.error(f"Error processing response: {e}")
-        logger.error(f"Original response was: {response_text}")
+
+    parsed, method = parse_answers(response_text)
+    PARSE_RESULTS.inc(method=method)
+    if method == "failed":
+        logger.warning(f"Could not parse response, first 200 chars: {response_text[:200]}")
         return []
+    logger.info(f"Successfully parsed response ({method})")
+    return [item for item in parsed if validate_response_item(item)]
+
+# The prompt is split around the variable dictionary so it is assembled once
+# at import time; only the variables are spliced in per request.
+_PROMPT_INTRO = (
+    "You are a specialized mathematical expression analyzer. Your task is to analyze the handwritten mathematical content in the image and provide precise calculations. "
+    "IMPORTANT RULES:\n"
+    "1. ALWAYS follow PEMDAS (Parentheses, Exponents, Multiplication/Division left-to-right, Addition/Subtraction left-to-right)\n"
+    "2. Show step-by-step calculations in the 'steps' field\n"
+    "3. Return ALL numbers with full precision\n"
+)
+
+_PROMPT_BODY = (
+    "5. Keep text explanations concise and clear\n"
+    "6. Break long mathematical expressions into smaller steps\n"
+    "7. For complex problems, explain each major concept before calculations\n"
+    "8. Handle dimensional analysis and unit conversions explicitly\n\n"
 
-def analyze_image(img: Image, dict_of_vars: dict):
+    "RESPONSE FORMAT:\n"
+    "Return a LIST of objects, where each object MUST follow this structure:\n"
+    "{\n"
+    "  'expr': 'original expression',\n"
+    "  'result': 'final calculated result',\n"
+    "  'steps': [  // Array of step objects\n"
+    "    {\n"
+    "      'type': 'text',  // For explanations\n"
+    "      'content': 'Brief, clear explanation of the next step'\n"
+    "    },\n"
+    "    {\n"
+    "      'type': 'math',  // For equations\n"
+    "      'content': 'Mathematical expression with proper spacing'\n"
+    "    }\n"
+    "  ],\n"
+    "  'type': 'arithmetic|equation|variable_assignment|function',\n"
+    "  'assign': boolean,\n"
+    "  'latex': 'LaTeX formatted expression'\n"
+    "}\n\n"
+
+    "STEP FORMATTING RULES:\n"
+    "1. Text steps:\n"
+    "   - Keep explanations under 100 characters\n"
+    "   - Use clear, simple language\n"
+    "   - For complex concepts, add a brief explanation first\n"
+    "   - Example: {'type': 'text', 'content': 'Using integration by parts where u = x and dv = e^x dx'}\n\n"
+
+    "2. Math steps:\n"
+    "   - Include proper spacing around operators\n"
+    "   - Break long expressions into multiple lines\n"
+    "   - Show intermediate steps for complex calculations\n"
+    "   - Example: {'type': 'math', 'content': '\\\\int x e^x dx = x e^x - \\\\int e^x dx'}\n\n"
+
+    "COMPLEX PROBLEM HANDLING:\n"
+    "1. Calculus:\n"
+    "   - Show derivative/integral rules being applied\n"
+    "   - Break down chain rule steps\n"
+    "   - Example: d/dx(sin(x^2)) → 2x * cos(x^2)\n\n"
+
+    "2. Linear Algebra:\n"
+    "   - Show matrix operations step by step\n"
+    "   - Explain row operations in text steps\n"
+    "   - Include determinant calculations\n\n"
+
+    "3. Geometry:\n"
+    "   - State relevant theorems/formulas first\n"
+    "   - Break down 3D problems into components\n"
+    "   - Include units in each step\n\n"
+
+    "4. Physics/Engineering:\n"
+    "   - Show unit analysis in each step\n"
+    "   - Convert units when necessary\n"
+    "   - State assumptions in text steps\n\n"
+
+    "SPECIAL FORMATTING:\n"
+    "- Units: Always add space between number and unit (e.g., '5 m' not '5m')\n"
+    "- Exponents: Use proper formatting (e.g., 'm^3' for cubic meters)\n"
+    "- Fractions: Show both forms (e.g., '0.3333... (1/3)')\n"
+    "- Scientific notation: Use proper LaTeX (e.g., '3 \\\\times 10^8')\n"
+    "- Vectors/Matrices: Use proper notation (e.g., '\\\\vec{v}', '\\\\begin{matrix}')\n"
+    "- Greek letters: Use LaTeX commands (e.g., '\\\\alpha', '\\\\beta')\n"
+    "- Long expressions: Break into multiple steps\n"
+    "- Equations: Show each transformation step\n\n"
+
+    "CRITICAL RESPONSE INSTRUCTIONS:\n"
+    "1. DO NOT USE MARKDOWN CODE BLOCKS (```). NEVER wrap your response in ```python, ```json or any other code block markers.\n"
+    "2. Return the raw Python list of objects without any additional text or formatting.\n"
+    "3. Make sure all values are properly formatted for direct parsing (use double quotes for JSON).\n"
+    "4. The response should start with [ and end with ], with no other text before or after.\n"
+    "5. ENSURE ALL STRINGS ARE PROPERLY QUOTED FOR Python's ast.literal_eval.\n"
+    "6. Boolean values should be 'true' or 'false' for JSON compatibility.\n"
+
+    "DO NOT INCLUDE BACKTICKS (```) OR CODE BLOCK FORMATTING IN YOUR RESPONSE."
+)
+
+SYSTEM_INSTRUCTION = (
+    _PROMPT_INTRO
+    + "4. For variables, use values from the variable dictionary sent with the image\n"
+    + _PROMPT_BODY
+)
+
+_INLINE_PROMPT_HEAD = _PROMPT_INTRO + "4. For variables, use values from this dictionary: "
+_INLINE_PROMPT_TAIL = "\n" + _PROMPT_BODY
+
+def build_prompt(dict_of_vars: dict) -> str:
+    """Render the full analysis prompt for the given variables"""
+    dict_of_vars_str = json.dumps(dict_of_vars, ensure_ascii=False)
+    return _INLINE_PROMPT_HEAD + dict_of_vars_str + _INLINE_PROMPT_TAIL
+
+def build_request_text(dict_of_vars: dict) -> str:
+    """Render the per-request text sent alongside the image"""
+    if not GEMINI_SYSTEM_INSTRUCTION:
+        return build_prompt(dict_of_vars)
+    return "Variable dictionary: " + json.dumps(dict_of_vars, ensure_ascii=False)
+
+def create_model():
+    """Create the Gemini model used for image analysis"""
+    if FAKE_MODEL_ENABLED:
+        from apps.calculator.fake_model import FakeGenerativeModel
+        logger.warning("Using the offline fake model; answers are synthetic")
+        return FakeGenerativeModel(model_name=GEMINI_MODEL_NAME)
     try:
-        # Initialize model with error handling
-        try:
-            model = genai.GenerativeModel(model_name="gemini-2.0-flash")
-            logger.info("Successfully initialized Gemini model")
-        except Exception as e:
-            logger.error(f"Failed to initialize Gemini model: {str(e)}")
-            raise ValueError("Failed to initialize AI model")
-
-        dict_of_vars_str = json.dumps(dict_of_vars, ensure_ascii=False)
-        prompt = (
-            f"You are a specialized mathematical expression analyzer. Your task is to analyze the handwritten mathematical content in the image and provide precise calculations. "
-            f"IMPORTANT RULES:\n"
-            f"1. ALWAYS follow PEMDAS (Parentheses, Exponents, Multiplication/Division left-to-right, Addition/Subtraction left-to-right)\n"
-            f"2. Show step-by-step calculations in the 'steps' field\n"
-            f"3. Return ALL numbers with full precision\n"
-            f"4. For variables, use values from this dictionary: {dict_of_vars_str}\n"
-            f"5. Keep text explanations concise and clear\n"
-            f"6. Break long mathematical expressions into smaller steps\n"
-            f"7. For complex problems, explain each major concept before calculations\n"
-            f"8. Handle dimensional analysis and unit conversions explicitly\n\n"
-            
-            f"RESPONSE FORMAT:\n"
-            f"Return a LIST of objects, where each object MUST follow this structure:\n"
-            f"{{\n"
-            f"  'expr': 'original expression',\n"
-            f"  'result': 'final calculated result',\n"
-            f"  'steps': [  // Array of step objects\n"
-            f"    {{\n"
-            f"      'type': 'text',  // For explanations\n"
-            f"      'content': 'Brief, clear explanation of the next step'\n"
-            f"    }},\n"
-            f"    {{\n"
-            f"      'type': 'math',  // For equations\n"
-            f"      'content': 'Mathematical expression with proper spacing'\n"
-            f"    }}\n"
-            f"  ],\n"
-            f"  'type': 'arithmetic|equation|variable_assignment|function',\n"
-            f"  'assign': boolean,\n"
-            f"  'latex': 'LaTeX formatted expression'\n"
-            f"}}\n\n"
-            
-            f"STEP FORMATTING RULES:\n"
-            f"1. Text steps:\n"
-            f"   - Keep explanations under 100 characters\n"
-            f"   - Use clear, simple language\n"
-            f"   - For complex concepts, add a brief explanation first\n"
-            f"   - Example: {{'type': 'text', 'content': 'Using integration by parts where u = x and dv = e^x dx'}}\n\n"
-            
-            f"2. Math steps:\n"
-            f"   - Include proper spacing around operators\n"
-            f"   - Break long expressions into multiple lines\n"
-            f"   - Show intermediate steps for complex calculations\n"
-            f"   - Example: {{'type': 'math', 'content': '\\\\int x e^x dx = x e^x - \\\\int e^x dx'}}\n\n"
-            
-            f"COMPLEX PROBLEM HANDLING:\n"
-            f"1. Calculus:\n"
-            f"   - Show derivative/integral rules being applied\n"
-            f"   - Break down chain rule steps\n"
-            f"   - Example: d/dx(sin(x^2)) → 2x * cos(x^2)\n\n"
-            
-            f"2. Linear Algebra:\n"
-            f"   - Show matrix operations step by step\n"
-            f"   - Explain row operations in text steps\n"
-            f"   - Include determinant calculations\n\n"
-            
-            f"3. Geometry:\n"
-            f"   - State relevant theorems/formulas first\n"
-            f"   - Break down 3D problems into components\n"
-            f"   - Include units in each step\n\n"
-            
-            f"4. Physics/Engineering:\n"
-            f"   - Show unit analysis in each step\n"
-            f"   - Convert units when necessary\n"
-            f"   - State assumptions in text steps\n\n"
-            
-            f"SPECIAL FORMATTING:\n"
-            f"- Units: Always add space between number and unit (e.g., '5 m' not '5m')\n"
-            f"- Exponents: Use proper formatting (e.g., 'm^3' for cubic meters)\n"
-            f"- Fractions: Show both forms (e.g., '0.3333... (1/3)')\n"
-            f"- Scientific notation: Use proper LaTeX (e.g., '3 \\\\times 10^8')\n"
-            f"- Vectors/Matrices: Use proper notation (e.g., '\\\\vec{{v}}', '\\\\begin{{matrix}}')\n"
-            f"- Greek letters: Use LaTeX commands (e.g., '\\\\alpha', '\\\\beta')\n"
-            f"- Long expressions: Break into multiple steps\n"
-            f"- Equations: Show each transformation step\n\n"
-            
-            f"CRITICAL RESPONSE INSTRUCTIONS:\n"
-            f"1. DO NOT USE MARKDOWN CODE BLOCKS (```). NEVER wrap your response in ```python, ```json or any other code block markers.\n"
-            f"2. Return the raw Python list of objects without any additional text or formatting.\n"
-            f"3. Make sure all values are properly formatted for direct parsing (use double quotes for JSON).\n"
-            f"4. The response should start with [ and end with ], with no other text before or after.\n"
-            f"5. ENSURE ALL STRINGS ARE PROPERLY QUOTED FOR Python's ast.literal_eval.\n"
-            f"6. Boolean values should be 'true' or 'false' for JSON compatibility.\n"
-            
-            f"DO NOT INCLUDE BACKTICKS (```) OR CODE BLOCK FORMATTING IN YOUR RESPONSE."
+        model = load_genai().GenerativeModel(
+            model_name=GEMINI_MODEL_NAME,
+            system_instruction=SYSTEM_INSTRUCTION if GEMINI_SYSTEM_INSTRUCTION else None,
         )
+        logger.info("Successfully initialized Gemini model")
+        return model
+    except Exception as e:
+        logger.error(f"Failed to initialize Gemini model: {str(e)}")
+        raise ValueError("Failed to initialize AI model")
+
+_model = None
+_model_lock = threading.Lock()
+
+def get_model():
+    """Return the shared Gemini model, creating it on first use"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = create_model()
+    return _model
+
+async def get_model_async():
+    """get_model for coroutines: the first build runs in a thread so the SDK import never blocks the event loop"""
+    if _model is not None:
+        return _model
+    return await asyncio.to_thread(get_model)
+
+def warm_up():
+    """Load everything the first analysis would otherwise pay for: the SDK, the shared model and PIL's codecs"""
+    start = time.perf_counter()
+    get_model()
+    Image.init()
+    logger.info(f"Model client warmed up in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+# A plain dict is accepted wherever GenerationConfig is and needs no SDK import
+_JSON_GENERATION_CONFIG = {"response_mime_type": "application/json"}
+
+# Cancellation and upstream availability errors keep their type so routes can map them to 429/503
+_PASSTHROUGH_ERRORS = (asyncio.CancelledError, ModelUnavailableError, UpstreamBudgetExceeded)
+
+def normalize_answer(answer: dict) -> dict:
+    """Fill in missing answer fields and convert legacy string steps in place"""
+    if 'steps' not in answer:
+        answer['steps'] = []
+    elif isinstance(answer['steps'], list) and all(isinstance(step, str) for step in answer['steps']):
+        # Convert old string steps to new format
+        answer['steps'] = [
+            {'type': 'math' if any(c in step for c in '=+-*/^') else 'text',
+             'content': step}
+            for step in answer['steps']
+        ]
+
+    if 'assign' not in answer:
+        answer['assign'] = False
+    if 'type' not in answer:
+        answer['type'] = 'arithmetic'
+    if 'latex' not in answer:
+        answer['latex'] = f"{answer['expr']} = {answer['result']}"
+    return answer
+
+def process_model_response(response) -> list:
+    """Parse a Gemini response into answers and fill in any missing fields"""
+    logger.info("Successfully received response from Gemini")
+
+    if not response or not response.text:
+        logger.error("Empty response received from Gemini")
+        raise ValueError("Empty response from AI model")
+
+    logger.debug(f"Raw response from Gemini: {response.text[:500]}...")
+
+    # Add additional retry logic if the response has markdown formatting
+    if "```" in response.text:
+        logger.warning("Response contains markdown code blocks despite instructions. Attempting to clean...")
+
+    with observe_stage("parse"):
+        answers = parse_gemini_response(response.text)
+
+    if not answers:
+        logger.warning("No valid answers parsed from Gemini response")
+        # Detailed error for debugging
+        logger.error(f"Failed to parse response. First 1000 chars: {response.text[:1000]}")
+        raise ValueError("No valid answers found in AI response")
+
+    # Add missing fields and ensure proper step formatting
+    with observe_stage("postprocess"):
+        for answer in answers:
+            normalize_answer(answer)
+
+    logger.info(f"Successfully processed {len(answers)} answers")
+    return answers
+
+async def analyze_image_async(img: Image, dict_of_vars: dict):
+    """Analyze a canvas image with the SDK's async generation API
+
+    Calls go through model_client (deadline, retries, hedging, circuit
+    breaker); ModelUnavailableError propagates when the upstream is down.
+    """
+    try:
+        model = await get_model_async()
+        with observe_stage("prompt_build"):
+            prompt = build_request_text(dict_of_vars)
 
-        # Generate content with error handling
         try:
-            logger.info("Sending request to Gemini API...")
-            
-            # Try to use JSON response mode if available in the API version
-            try:
-                generation_config = genai.GenerationConfig(
-                    response_mime_type="application/json"
-                )
-                response = model.generate_content(
-                    [prompt, img],
-                    generation_config=generation_config
-                )
-                logger.info("Using response_mime_type='application/json' for Gemini API")
-            except Exception as e:
-                logger.warning(f"Could not use JSON mode, falling back to standard mode: {e}")
-                response = model.generate_content([prompt, img])
-            
-            logger.info("Successfully received response from Gemini")
-            
-            if not response or not response.text:
-                logger.error("Empty response received from Gemini")
-                raise ValueError("Empty response from AI model")
-                
-            logger.debug(f"Raw response from Gemini: {response.text[:500]}...")
-            
-            # Add additional retry logic if the response has markdown formatting
-            if "```" in response.text:
-                logger.warning("Response contains markdown code blocks despite instructions. Attempting to clean...")
-            
-            answers = parse_gemini_response(response.text)
-            
-            if not answers:
-                logger.warning("No valid answers parsed from Gemini response")
-                # Detailed error for debugging
-                logger.error(f"Failed to parse response. First 1000 chars: {response.text[:1000]}")
-                raise ValueError("No valid answers found in AI response")
-            
-            # Add missing fields and ensure proper step formatting
-            for answer in answers:
-                if 'steps' not in answer:
-                    answer['steps'] = []
-                elif isinstance(answer['steps'], list) and all(isinstance(step, str) for step in answer['steps']):
-                    # Convert old string steps to new format
-                    answer['steps'] = [
-                        {'type': 'math' if any(c in step for c in '=+-*/^') else 'text',
-                         'content': step}
-                        for step in answer['steps']
-                    ]
-                
-                if 'assign' not in answer:
-                    answer['assign'] = False
-                if 'type' not in answer:
-                    answer['type'] = 'arithmetic'
-                if 'latex' not in answer:
-                    answer['latex'] = f"{answer['expr']} = {answer['result']}"
-            
-            logger.info(f"Successfully processed {len(answers)} answers")
-            return answers
-            
+            logger.info("Sending async request to Gemini API...")
+
+            with observe_stage("model_call"):
+                try:
+                    response = await model_client.call(lambda: model.generate_content_async(
+                        [prompt, img],
+                        generation_config=_JSON_GENERATION_CONFIG
+                    ))
+                    logger.info("Using response_mime_type='application/json' for Gemini API")
+                except _PASSTHROUGH_ERRORS:
+                    raise
+                except Exception as e:
+                    logger.warning(f"Could not use JSON mode, falling back to standard mode: {e}")
+                    response = await model_client.call(lambda: model.generate_content_async([prompt, img]))
+
+            return process_model_response(response)
+
+        except _PASSTHROUGH_ERRORS:
+            raise
         except Exception as e:
             logger.error(f"Error during Gemini API call: {str(e)}")
             raise ValueError(f"Failed to process image with AI: {str(e)}")
-            
+
     except ValueError as ve:
-        logger.error(f"Validation error in analyze_image: {str(ve)}")
+        logger.error(f"Validation error in analyze_image_async: {str(ve)}")
+        raise
+    except _PASSTHROUGH_ERRORS:
+        raise
+    except Exception as e:
+        logger.error(f"Unexpected error in analyze_image_async: {str(e)}")
+        raise ValueError(f"Unexpected error during image analysis: {str(e)}")
+
+async def stream_analysis_async(img: Image, dict_of_vars: dict):
+    """Yield the model's response text chunk by chunk as it is generated"""
+    model = await get_model_async()
+    with observe_stage("prompt_build"):
+        prompt = build_request_text(dict_of_vars)
+    logger.info("Sending streaming request to Gemini API...")
+    start = time.perf_counter()
+    first_chunk = True
+    try:
+        # Retries and the breaker cover the initial request; chunks are never replayed
+        response = await model_client.call(lambda: model.generate_content_async(
+            [prompt, img],
+            generation_config=_JSON_GENERATION_CONFIG,
+            stream=True
+        ), hedge=False)
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. the final usage chunk)
+                continue
+            if text:
+                if first_chunk:
+                    STAGE_SECONDS.observe(time.perf_counter() - start, stage="model_first_chunk")
+                    first_chunk = False
+                yield text
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage="model_stream")
+    except _PASSTHROUGH_ERRORS:
         raise
     except Exception as e:
-        logger.error(f"Unexpected error in analyze_image: {str(e)}")
-        raise ValueError(f"Unexpected error during image analysis: {str(e)}")
\ No newline at end of file
+        logger.error(f"Error during streaming Gemini API call: {str(e)}")
+        raise ValueError(f"Failed to process image with AI: {str(e)}")
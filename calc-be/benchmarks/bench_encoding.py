@@ -0,0 +1,84 @@
+"""
+Serialization time and bytes on the wire for calculate responses.
+
+Builds response envelopes from the recorded model responses (one typical
+single-expression canvas, and a canvas carrying every recorded answer)
+and compares FastAPI's default path (jsonable_encoder + JSONResponse),
+compact stdlib JSON, orjson and MessagePack, each uncompressed and with
+gzip and brotli at the levels CompressionMiddleware uses. Encoders whose
+package is not installed are skipped.
+
+Usage: python benchmarks/bench_encoding.py [iterations]
+"""
+import gzip
+import json
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from apps.calculator.encoding import brotli, msgpack, orjson
+from apps.calculator.fake_model import load_recordings
+from apps.calculator.route import build_result
+from apps.calculator.utils import parse_gemini_response
+from constants import COMPRESSION_GZIP_LEVEL, COMPRESSION_BROTLI_QUALITY
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def encoders() -> list:
+    found = [
+        ("fastapi default", lambda payload: JSONResponse(jsonable_encoder(payload)).body),
+        ("json compact", lambda payload: json.dumps(payload, ensure_ascii=False,
+                                                     separators=(",", ":")).encode("utf-8")),
+    ]
+    if orjson is not None:
+        found.append(("orjson", orjson.dumps))
+    if msgpack is not None:
+        found.append(("msgpack", lambda payload: msgpack.packb(payload, use_bin_type=True)))
+    return found
+
+def compressors() -> list:
+    found = [
+        ("identity", lambda body: body),
+        (f"gzip-{COMPRESSION_GZIP_LEVEL}", lambda body: gzip.compress(body, COMPRESSION_GZIP_LEVEL, mtime=0)),
+    ]
+    if brotli is not None:
+        found.append((f"br-{COMPRESSION_BROTLI_QUALITY}",
+                      lambda body: brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)))
+    return found
+
+def per_call_us(func, payload, iterations: int) -> float:
+    return min(timeit.repeat(lambda: func(payload), number=iterations, repeat=3)) / iterations * 1e6
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    logging.disable(logging.WARNING)
+    answers = [parse_gemini_response(text)
+               for text in load_recordings(os.path.join(BENCHMARK_DIR, "recorded_responses.json"))]
+    payloads = (
+        ("single expression", build_result(answers[0])),
+        (f"{sum(map(len, answers))} expressions", build_result([answer for group in answers for answer in group])),
+    )
+    skipped = [name for name, module in (("orjson", orjson), ("msgpack", msgpack), ("brotli", brotli))
+               if module is None]
+    if skipped:
+        print(f"not installed, skipped: {', '.join(skipped)}")
+    for label, payload in payloads:
+        print(f"{label}:")
+        print(f"  {'encoding':<16} {'serialize':>10} " + " ".join(f"{name:>18}" for name, _ in compressors()))
+        for name, encode in encoders():
+            body = encode(payload)
+            cells = []
+            for _, compress in compressors():
+                sent = compress(body)
+                compress_us = per_call_us(compress, body, max(iterations // 10, 1))
+                cells.append(f"{len(sent):6d} B {compress_us:6.1f} us")
+            print(f"  {name:<16} {per_call_us(encode, payload, iterations):7.1f} us " + " ".join(cells))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Micro-benchmarks for the CPU-bound steps of a request.
+
+Times parse_gemini_response, with the original clean-and-parse chain
+(kept in bench_parser.py) as the baseline, over the recorded responses
+and the parser corpus, and image decoding for the JSON data URL
+path (decode_image) and the raw upload path (load_image) on a sparse and a
+dense canvas. Complements load_test.py, which measures the whole server.
+
+Usage: python benchmarks/bench_hot_paths.py [iterations]
+"""
+import base64
+import logging
+import os
+import random
+import sys
+import timeit
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+from PIL import Image, ImageDraw
+from apps.calculator.fake_model import load_recordings
+from apps.calculator.route import decode_image, load_image
+from apps.calculator.utils import parse_gemini_response
+from bench_parser import legacy_parse
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def canvas_png(strokes: int, seed: int = 1) -> bytes:
+    rng = random.Random(seed)
+    image = Image.new("RGBA", (1920, 1080))
+    draw = ImageDraw.Draw(image)
+    for _ in range(strokes):
+        x, y = rng.randint(0, 1800), rng.randint(0, 1000)
+        draw.line((x, y, x + rng.randint(20, 200), y + rng.randint(-80, 80)), fill="white", width=6)
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def per_call_us(func, items: list, iterations: int) -> float:
+    def run():
+        for item in items:
+            func(item)
+    return min(timeit.repeat(run, number=iterations, repeat=3)) / (iterations * len(items)) * 1e6
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    # Malformed corpus entries log a warning each time they are parsed
+    logging.disable(logging.WARNING)
+
+    recordings = load_recordings(os.path.join(BENCHMARK_DIR, "recorded_responses.json"))
+    corpus = load_recordings(os.path.join(BENCHMARK_DIR, "parser_corpus.json"))
+    for label, texts in (("recorded responses", recordings), ("parser corpus", corpus)):
+        print(f"{label} ({len(texts)} texts):")
+        for name, func in (("legacy parse", legacy_parse),
+                           ("parse_gemini_response", parse_gemini_response)):
+            print(f"  {name:<24} {per_call_us(func, texts, iterations):8.1f} us/call")
+
+    image_iterations = max(iterations // 10, 1)
+    for label, strokes in (("sparse 1920x1080 canvas", 10), ("dense 1920x1080 canvas", 400)):
+        png = canvas_png(strokes)
+        data_url = "data:image/png;base64," + base64.b64encode(png).decode()
+        print(f"{label} ({len(png) / 1024:.0f} KiB PNG, {len(data_url) / 1024:.0f} KiB data URL):")
+        print(f"  {'decode_image (data URL)':<24} {per_call_us(decode_image, [data_url], image_iterations):8.1f} us/call")
+        print(f"  {'load_image (raw bytes)':<24} "
+              f"{per_call_us(lambda body: load_image(BytesIO(body)), [png], image_iterations):8.1f} us/call")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Micro-benchmark for per-request model setup.
+
+Compares the original per-request setup (construct a GenerativeModel and
+render the full prompt) with the shared model plus the per-request text
+that is sent when the static prompt lives in the system instruction.
+No network calls are made.
+
+Usage: python benchmarks/bench_model_setup.py [iterations]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+import google.generativeai as genai
+from apps.calculator import utils
+
+DICT_OF_VARS = {"x": 5, "y": 10, "speed": "3 m/s"}
+
+def per_request_setup():
+    model = genai.GenerativeModel(model_name=utils.GEMINI_MODEL_NAME)
+    prompt = utils.build_prompt(DICT_OF_VARS)
+    generation_config = genai.GenerationConfig(response_mime_type="application/json")
+    return model, prompt, generation_config
+
+def shared_setup():
+    model = utils.get_model()
+    prompt = utils.build_request_text(DICT_OF_VARS)
+    return model, prompt, utils._JSON_GENERATION_CONFIG
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    utils.get_model()
+    for label, func in (("per-request model + full prompt", per_request_setup),
+                        ("shared model + variables only", shared_setup)):
+        seconds = min(timeit.repeat(func, number=iterations, repeat=3))
+        _, prompt, _ = func()
+        print(f"{label:>32}: {seconds / iterations * 1e6:7.2f} us/request, "
+              f"{len(prompt.encode()):5d} prompt bytes per request")
+    print(f"{'system instruction (prebuilt)':>32}: {len(utils.SYSTEM_INSTRUCTION.encode()):5d} bytes")
+
+if __name__ == "__main__":
+    main()
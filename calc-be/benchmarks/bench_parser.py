@@ -0,0 +1,103 @@
+"""
+Parser benchmark over a corpus of real-world style model outputs.
+
+Compares the original clean + json.loads / ast.literal_eval / quote-swap
+chain against parse_gemini_response on recovery rate (answers recovered
+versus expected) and parse time per response (best of several repeats).
+Well-formed cases are also timed with a bare json.loads, the floor for
+the fast path.
+
+Usage: python benchmarks/bench_parser.py [iterations]
+"""
+import ast
+import json
+import logging
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+from apps.calculator.utils import parse_gemini_response, validate_response_item
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parser_corpus.json")
+
+def legacy_clean(response_text: str) -> str:
+    """The original clean_gemini_response"""
+    if response_text.startswith("```") and "```" in response_text[3:]:
+        start_idx = response_text.find("\n", response_text.find("```")) + 1
+        end_idx = response_text.rfind("```")
+        if start_idx > 0 and end_idx > start_idx:
+            response_text = response_text[start_idx:end_idx].strip()
+    response_text = re.sub(r'```(?:json|python|)?\s*', '', response_text)
+    response_text = re.sub(r'```\s*', '', response_text)
+    return response_text.strip()
+
+def legacy_parse(response_text: str) -> list:
+    """The original parse_gemini_response fallback chain"""
+    try:
+        cleaned = legacy_clean(response_text)
+        try:
+            parsed = json.loads(cleaned)
+        except json.JSONDecodeError:
+            try:
+                parsed = ast.literal_eval(cleaned)
+            except (SyntaxError, ValueError):
+                json_fixed = cleaned.replace("'", '"').replace("True", "true").replace("False", "false")
+                parsed = json.loads(json_fixed)
+        if not isinstance(parsed, list):
+            parsed = [parsed]
+        return [item for item in parsed if validate_response_item(item)]
+    except Exception:
+        return []
+
+def per_call_us(func, text: str, iterations: int) -> float:
+    return min(timeit.repeat(lambda: func(text), number=iterations, repeat=5)) / iterations * 1e6
+
+def is_json(text: str) -> bool:
+    try:
+        json.loads(text)
+        return True
+    except json.JSONDecodeError:
+        return False
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    logging.disable(logging.CRITICAL)
+    with open(CORPUS_PATH) as f:
+        corpus = json.load(f)
+
+    totals = {}
+    well_formed = {"json.loads": 0.0, "legacy": 0.0, "new": 0.0}
+    print(f"{'case':<28} {'expected':>8} {'legacy':>7} {'new':>5} {'legacy us':>10} {'new us':>8}")
+    for case in corpus:
+        row = []
+        for label, parse in (("legacy", legacy_parse), ("new", parse_gemini_response)):
+            recovered = len(parse(case["text"]))
+            micros = per_call_us(parse, case["text"], iterations)
+            ok = recovered == case["expected_answers"]
+            total = totals.setdefault(label, {"ok": 0, "us": 0.0})
+            total["ok"] += ok
+            total["us"] += micros
+            row.append((recovered, micros))
+        if is_json(case["text"]):
+            well_formed["json.loads"] += per_call_us(json.loads, case["text"], iterations)
+            well_formed["legacy"] += row[0][1]
+            well_formed["new"] += row[1][1]
+            well_formed.setdefault("cases", 0)
+            well_formed["cases"] += 1
+        print(f"{case['name']:<28} {case['expected_answers']:>8} {row[0][0]:>7} {row[1][0]:>5} "
+              f"{row[0][1]:>10.1f} {row[1][1]:>8.1f}")
+
+    for label, total in totals.items():
+        print(f"{label:>6}: recovered {total['ok']}/{len(corpus)} cases, "
+              f"{total['us'] / len(corpus):.1f} us mean per response")
+    cases = well_formed.pop("cases", 0)
+    if cases:
+        print(f"well-formed JSON ({cases} cases), mean us: " +
+              ", ".join(f"{label} {micros / cases:.1f}" for label, micros in well_formed.items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Micro-benchmark for the near-duplicate index.
+
+Fills a MultiIndexHashIndex with random 64-bit hashes and times lookups of
+perturbed copies (hits) and fresh random hashes (misses).
+
+Usage: python benchmarks/bench_phash_index.py [num_entries]
+"""
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+from apps.calculator.phash import MultiIndexHashIndex
+
+def flip_bits(value: int, count: int, bits: int) -> int:
+    for bit in random.sample(range(bits), count):
+        value ^= 1 << bit
+    return value
+
+def main():
+    num_entries = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    bits = 64
+    index = MultiIndexHashIndex(hash_bits=bits, max_distance=4, max_entries=num_entries)
+    namespace = (0, "{}")
+    random.seed(1234)
+    hashes = [random.getrandbits(bits) for _ in range(num_entries)]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for i, value in enumerate(hashes):
+        index.add(namespace, value, i)
+    build_seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"Indexed {num_entries:,} hashes in {build_seconds:.1f}s (peak {peak / 1e6:.0f} MB)")
+
+    queries = 10_000
+    hit_queries = [flip_bits(random.choice(hashes), random.randint(0, 4), bits) for _ in range(queries)]
+    miss_queries = [random.getrandbits(bits) for _ in range(queries)]
+    for label, batch in (("near-duplicate", hit_queries), ("random", miss_queries)):
+        found = 0
+        start = time.perf_counter()
+        for value in batch:
+            if index.find(namespace, value) is not None:
+                found += 1
+        elapsed = time.perf_counter() - start
+        print(f"{label:>15} lookups: {elapsed / queries * 1e6:.1f} us/lookup, {found}/{queries} found")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Whole-canvas versus per-region analysis of a multi-expression canvas.
+
+Draws a 1920x1080 canvas with several separate handwritten-style
+expressions, solves it, then edits one expression and solves it again,
+with REGIONS_ENABLED off and on. Reports model calls, image bytes sent to
+the model and wall time per run against the offline fake model (fixed
+FAKE_MODEL_LATENCY_MS), so no network or API key is needed.
+
+Usage: python benchmarks/bench_regions.py [expressions]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("FAKE_MODEL_ENABLED", "true")
+os.environ.setdefault("FAKE_MODEL_LATENCY_MS", "800")
+os.environ.setdefault("FAKE_MODEL_LATENCY_SIGMA", "0")
+os.environ.setdefault("PHASH_ENABLED", "false")
+os.environ.setdefault("LOCAL_EVAL_ENABLED", "false")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+from PIL import Image, ImageDraw
+from apps.calculator import route
+from apps.calculator.cache import result_cache
+from apps.calculator.expression_cache import expression_cache
+from apps.calculator.regions import find_regions
+from apps.calculator.utils import get_model
+
+def draw_expression(draw: ImageDraw.ImageDraw, x: int, y: int, seed: int):
+    """A line of glyph-sized stroke clusters standing in for one written expression"""
+    rng = random.Random(seed)
+    for glyph in range(rng.randint(4, 7)):
+        gx = x + glyph * 55
+        for _ in range(2):
+            draw.line((gx + rng.randint(0, 30), y + rng.randint(0, 60),
+                       gx + rng.randint(0, 30), y + rng.randint(0, 60)), fill="white", width=3)
+
+def make_canvas(count: int, edited: int = None) -> Image.Image:
+    image = Image.new("RGBA", (1920, 1080))
+    draw = ImageDraw.Draw(image)
+    columns = 2
+    for index in range(count):
+        x = 120 + (index % columns) * 900
+        y = 80 + (index // columns) * 160
+        draw_expression(draw, x, y, seed=index + (1000 if index == edited else 0))
+    return image
+
+class CountingModel:
+    """Wraps the shared model to count calls and uploaded image bytes"""
+
+    def __init__(self, model):
+        self.model = model
+        self.calls = 0
+        self.bytes = 0
+
+    async def generate_content_async(self, contents, **kwargs):
+        self.calls += 1
+        part = contents[1]
+        self.bytes += len(part["data"]) if isinstance(part, dict) else len(part.tobytes())
+        return await self.model.generate_content_async(contents, **kwargs)
+
+async def solve(canvas: Image.Image, counter: CountingModel):
+    calls, sent = counter.calls, counter.bytes
+    start = time.perf_counter()
+    answers, _ = await route.solve_image(canvas, {}, None)
+    return time.perf_counter() - start, counter.calls - calls, counter.bytes - sent, len(answers)
+
+async def run(count: int):
+    from apps.calculator import utils
+    counter = CountingModel(get_model())
+    utils._model = counter
+    original, edited = make_canvas(count), make_canvas(count, edited=count - 1)
+    print(f"canvas with {count} expressions, {len(find_regions(original))} regions found, "
+          f"fake model latency {os.environ['FAKE_MODEL_LATENCY_MS']} ms")
+    for label, enabled in (("whole canvas", False), ("per region", True)):
+        route.REGIONS_ENABLED = enabled
+        result_cache.clear()
+        if expression_cache is not None:
+            expression_cache.clear()
+        for run_label, canvas in (("first submission", original), ("one expression edited", edited)):
+            seconds, calls, sent, answers = await solve(canvas, counter)
+            print(f"  {label:<13} {run_label:<22} {seconds * 1000:7.0f} ms  {calls:2d} model calls  "
+                  f"{sent / 1024:7.1f} KiB sent  {answers} answers")
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    asyncio.run(run(count))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Cold start benchmark: import-time profile and time to first 200 on GET /.
+
+Prints where `import main` spends its time, grouped by top-level package
+(from python -X importtime), then launches main.py repeatedly and measures
+the wall time from process start until GET / first answers 200, with
+FAST_START_ENABLED off and on. A dummy API key is used and the health
+probe is off, so no network is needed.
+
+Usage: python benchmarks/bench_startup.py [runs]
+"""
+import http.client
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PORT = 8978
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def server_env(**overrides) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "GEMINI_API_KEY": env.get("GEMINI_API_KEY") or "benchmark",
+        "HEALTH_PROBE_ENABLED": "false",
+        "SERVER_URL": "127.0.0.1",
+        "PORT": str(PORT),
+        "SERVER_WORKERS": "1",
+        "SERVER_ACCESS_LOG": "false",
+    })
+    env.update(overrides)
+    return env
+
+def import_profile(top: int = 12):
+    """Print total `import main` time and self time per top-level package"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=BACKEND_DIR,
+                            env=server_env(), capture_output=True, text=True)
+    by_package = defaultdict(int)
+    total = 0
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        by_package[module.split(".")[0]] += int(self_us)
+        if indent == " " and module == "main":
+            total = int(cumulative_us)
+    print(f"import main: {total / 1000:.0f} ms")
+    for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {package:<28} {self_us / 1000:7.1f} ms")
+
+def time_to_first_200(env: dict, timeout: float = 60) -> float:
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "main.py"], cwd=BACKEND_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                connection = http.client.HTTPConnection("127.0.0.1", PORT, timeout=1)
+                connection.request("GET", "/")
+                if connection.getresponse().status == 200:
+                    return time.perf_counter() - start
+            except OSError:
+                pass
+            time.sleep(0.005)
+        raise RuntimeError("Server did not answer GET / in time")
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    import_profile()
+    for label, fast_start in (("standard startup", "false"), ("fast start", "true")):
+        env = server_env(FAST_START_ENABLED=fast_start)
+        times = sorted(time_to_first_200(env) for _ in range(runs))
+        print(f"{label:<18} time to first 200 on /: median {statistics.median(times) * 1000:.0f} ms, "
+              f"min {times[0] * 1000:.0f} ms over {runs} runs")
+
+if __name__ == "__main__":
+    main()
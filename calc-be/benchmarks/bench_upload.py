@@ -0,0 +1,118 @@
+"""
+Memory/latency comparison of the JSON data URL and binary upload paths.
+
+Feeds the same canvas PNG through each request path up to a loaded PIL
+image: JSON body -> ImageData -> decode_image, a raw image/png body ->
+load_image, and a multipart/form-data body -> load_image. Reports wire
+size, mean latency and peak Python heap allocated by the path (the
+decoded pixels themselves are excluded). No server or model is involved.
+
+Usage: python benchmarks/bench_upload.py [iterations]
+"""
+import asyncio
+import base64
+import json
+import os
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+from PIL import Image, ImageDraw
+from starlette.requests import Request
+from apps.calculator.route import decode_image, load_image
+from schema import ImageData
+
+BOUNDARY = "----calcbenchboundary"
+
+def make_canvas(dense: bool = False) -> bytes:
+    """A full-screen transparent canvas with a few handwritten-style strokes
+
+    The dense variant fills the canvas with noise, standing in for a
+    photographed or heavily drawn-over board that barely compresses.
+    """
+    image = Image.effect_noise((1920, 1080), 64).convert("RGBA") if dense else Image.new("RGBA", (1920, 1080))
+    draw = ImageDraw.Draw(image)
+    for offset in range(0, 900, 120):
+        draw.line((200 + offset, 400, 260 + offset, 560), fill="white", width=6)
+        draw.arc((300 + offset, 600, 380 + offset, 700), 0, 300, fill="white", width=6)
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def make_request(body: bytes, content_type: str) -> Request:
+    scope = {"type": "http", "method": "POST", "path": "/", "headers": [
+        (b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode()),
+    ]}
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return Request(scope, receive)
+
+async def json_path(body: bytes):
+    request = make_request(body, "application/json")
+    data = ImageData.model_validate_json(await request.body())
+    image, _ = decode_image(data.image)
+    image.load()
+    return image
+
+async def raw_path(body: bytes):
+    request = make_request(body, "image/png")
+    return load_image(BytesIO(await request.body()))
+
+async def multipart_path(body: bytes):
+    request = make_request(body, f"multipart/form-data; boundary={BOUNDARY}")
+    async with request.form() as form:
+        return load_image(form["image"].file)
+
+def multipart_body(png: bytes) -> bytes:
+    return (
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"dict_of_vars\"\r\n\r\n{{\"x\": 5}}\r\n"
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"image\"; filename=\"canvas.png\"\r\n"
+        f"Content-Type: image/png\r\n\r\n"
+    ).encode() + png + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+def measure(path, body: bytes, iterations: int):
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(path(body))
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        loop.run_until_complete(path(body))
+    elapsed = (time.perf_counter() - start) / iterations
+
+    tracemalloc.start()
+    loop.run_until_complete(path(body))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    loop.close()
+    return elapsed, peak
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    for canvas, dense in (("sparse", False), ("dense", True)):
+        png = make_canvas(dense)
+        data_url = "data:image/png;base64," + base64.b64encode(png).decode()
+        bodies = {
+            "JSON data URL": (json_path, json.dumps({"image": data_url, "dict_of_vars": {"x": 5}}).encode()),
+            "raw image/png": (raw_path, png),
+            "multipart/form-data": (multipart_path, multipart_body(png)),
+        }
+        print(f"{canvas} canvas: 1920x1080 RGBA, {len(png)} PNG bytes")
+        for label, (path, body) in bodies.items():
+            elapsed, peak = measure(path, body, iterations)
+            # PIL allocates pixel storage outside the Python heap, so the peak is the path's own copies
+            print(f"{label:>20}: {len(body):8d} wire bytes, {elapsed * 1000:7.2f} ms, "
+                  f"peak {peak / 1024:8.1f} KiB ({peak / len(png):.1f}x the PNG)")
+
+if __name__ == "__main__":
+    main()
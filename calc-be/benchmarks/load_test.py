@@ -0,0 +1,208 @@
+"""
+Load test against a local server backed by the offline fake model.
+
+Starts main.py in a subprocess with FAKE_MODEL_ENABLED, replaying
+benchmarks/recorded_responses.json with the chosen latency and failure
+distribution, drives POST /calculate at a fixed concurrency, and reports
+throughput, latency percentiles, server CPU time per request and the
+server's memory high-water mark. No network access or API key is needed.
+
+Usage: python benchmarks/load_test.py [--concurrency 32] [--duration 20] [--help for more]
+"""
+import argparse
+import asyncio
+import base64
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from io import BytesIO
+
+import httpx
+from PIL import Image, ImageDraw
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RECORDINGS_PATH = os.path.join(BACKEND_DIR, "benchmarks", "recorded_responses.json")
+
+def make_canvases(count: int, seed: int) -> list:
+    """Distinct canvas data URLs with a few random strokes each"""
+    rng = random.Random(seed)
+    canvases = []
+    for _ in range(count):
+        image = Image.new("RGBA", (1280, 720))
+        draw = ImageDraw.Draw(image)
+        for _ in range(rng.randint(3, 8)):
+            x, y = rng.randint(100, 1100), rng.randint(100, 600)
+            draw.line((x, y, x + rng.randint(20, 120), y + rng.randint(-60, 60)), fill="white", width=6)
+        buffer = BytesIO()
+        image.save(buffer, format="PNG")
+        canvases.append("data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode())
+    return canvases
+
+def percentile(ordered: list, q: float) -> float:
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else float("nan")
+
+def _proc_tree(pid: int) -> list:
+    """pid and all descendants (Linux /proc)"""
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+    tree, frontier = [pid], [pid]
+    while frontier:
+        children = [child for child, parent in parents.items() if parent in frontier]
+        tree.extend(children)
+        frontier = children
+    return tree
+
+def server_cpu_seconds(pid: int):
+    """User + system CPU seconds of the server and its workers, or None off Linux"""
+    if not os.path.isdir("/proc"):
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    total = 0
+    for process in _proc_tree(pid):
+        try:
+            with open(f"/proc/{process}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+        except (OSError, IndexError, ValueError):
+            continue
+    return total / ticks
+
+def server_memory_hwm_mb(pid: int):
+    """(largest single-process, summed) peak resident set size in MiB, or None off Linux"""
+    if not os.path.isdir("/proc"):
+        return None
+    peaks = []
+    for process in _proc_tree(pid):
+        try:
+            with open(f"/proc/{process}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        peaks.append(int(line.split()[1]) / 1024)
+        except OSError:
+            continue
+    return (max(peaks), sum(peaks)) if peaks else None
+
+def start_server(args) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.pop("GEMINI_API_KEY", None)
+    env.update({
+        "FAKE_MODEL_ENABLED": "true",
+        "FAKE_MODEL_RECORDINGS": RECORDINGS_PATH,
+        "FAKE_MODEL_LATENCY_MS": str(args.latency_ms),
+        "FAKE_MODEL_LATENCY_SIGMA": str(args.latency_sigma),
+        "FAKE_MODEL_FAILURE_RATE": str(args.failure_rate),
+        "FAKE_MODEL_FAILURE_STATUS": str(args.failure_status),
+        "FAKE_MODEL_TAIL_RATE": str(args.tail_rate),
+        "FAKE_MODEL_TAIL_MS": str(args.tail_ms),
+        "FAKE_MODEL_SEED": str(args.seed),
+        "RESULT_CACHE_ENABLED": str(args.cache).lower(),
+        "PHASH_ENABLED": str(args.cache).lower(),
+        "RATE_LIMIT_ENABLED": "false",
+        "HEALTH_PROBE_ENABLED": "false",
+        "ENV": "production",
+        "SERVER_WORKERS": str(args.workers),
+        "SERVER_ACCESS_LOG": "false",
+        "SERVER_URL": "127.0.0.1",
+        "PORT": str(args.port),
+    })
+    log = tempfile.NamedTemporaryFile(prefix="calc-load-test-", suffix=".log", delete=False)
+    print(f"server log: {log.name}")
+    return subprocess.Popen([sys.executable, "main.py"], cwd=BACKEND_DIR, env=env, stdout=log, stderr=log)
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/health/live")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Server did not become ready")
+
+async def drive(client: httpx.AsyncClient, canvases: list, concurrency: int, duration: float):
+    """Closed-loop load: each of concurrency clients sends its next request as soon as the last returns"""
+    latencies = []
+    statuses = Counter()
+    end = time.monotonic() + duration
+    counter = iter(range(10 ** 12))
+
+    async def user():
+        while time.monotonic() < end:
+            body = {"image": canvases[next(counter) % len(canvases)], "dict_of_vars": {"x": 5}}
+            start = time.perf_counter()
+            try:
+                response = await client.post("/calculate", json=body)
+                statuses[response.status_code] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - started
+
+async def run(args):
+    canvases = make_canvases(args.canvases, args.seed)
+    server = start_server(args)
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits,
+                                     timeout=120) as client:
+            await wait_ready(client)
+            if args.warmup:
+                await drive(client, canvases, args.concurrency, args.warmup)
+            cpu_before = server_cpu_seconds(server.pid)
+            latencies, statuses, elapsed = await drive(client, canvases, args.concurrency, args.duration)
+            cpu_after = server_cpu_seconds(server.pid)
+            memory = server_memory_hwm_mb(server.pid)
+    finally:
+        server.terminate()
+        server.wait(timeout=90)
+
+    latencies.sort()
+    completed = sum(count for status, count in statuses.items() if status == 200)
+    print(f"concurrency {args.concurrency}, {elapsed:.1f}s, fake latency {args.latency_ms} ms "
+          f"(sigma {args.latency_sigma}, tail {args.tail_rate} @ {args.tail_ms} ms), "
+          f"failure rate {args.failure_rate}, cache {'on' if args.cache else 'off'}, workers {args.workers}")
+    print(f"requests: {len(latencies)} ({dict(statuses)}), {len(latencies) / elapsed:.1f} RPS, "
+          f"{completed / elapsed:.1f} successful RPS")
+    print(f"latency ms: p50 {percentile(latencies, 0.5) * 1000:.1f}  p95 {percentile(latencies, 0.95) * 1000:.1f}  "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f}  max {latencies[-1] * 1000 if latencies else float('nan'):.1f}")
+    if cpu_before is not None and latencies:
+        print(f"server CPU: {(cpu_after - cpu_before) / len(latencies) * 1000:.2f} ms per request "
+              f"({(cpu_after - cpu_before) / elapsed * 100:.0f}% of one core)")
+    if memory is not None:
+        print(f"server memory high-water: {memory[0]:.1f} MiB largest process, {memory[1]:.1f} MiB total")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="unmeasured seconds before the run")
+    parser.add_argument("--canvases", type=int, default=200, help="distinct canvases cycled through")
+    parser.add_argument("--cache", action="store_true", help="enable the result cache and near-duplicate index")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8977)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=800, help="median fake model latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="lognormal spread")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="fraction of calls taking --tail-ms")
+    parser.add_argument("--tail-ms", type=float, default=5000)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--failure-status", type=int, default=503, choices=(429, 500, 503))
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,207 @@
 from dotenv import load_dotenv
 import os
+import tempfile
 load_dotenv()
 
-SERVER_URL = 'localhost'
-PORT = '8900'
-ENV = 'dev'
+def _env_bool(name, default):
+    """Read a boolean flag from the environment"""
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
\ No newline at end of file
+SERVER_URL = os.getenv("SERVER_URL", 'localhost')
+PORT = os.getenv("PORT", '8900')
+ENV = os.getenv("ENV", 'dev')
+
+# Production server mode (ENV=production, see main.py)
+# 0 runs one worker process per CPU in production and a single process in dev
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "0"))
+SERVER_LOOP = os.getenv("SERVER_LOOP", "auto")  # auto picks uvloop when installed
+SERVER_HTTP = os.getenv("SERVER_HTTP", "auto")  # auto picks httptools when installed
+SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", "2048"))
+SERVER_KEEPALIVE_SECONDS = int(os.getenv("SERVER_KEEPALIVE_SECONDS", "5"))
+# Connections per worker beyond which new requests get a 503; 0 = unlimited
+SERVER_LIMIT_CONCURRENCY = int(os.getenv("SERVER_LIMIT_CONCURRENCY", "0"))
+# Recycle a worker after this many requests; 0 = never
+SERVER_MAX_REQUESTS = int(os.getenv("SERVER_MAX_REQUESTS", "0"))
+# How long shutdown waits for in-flight requests and analyses to finish
+SERVER_GRACEFUL_TIMEOUT_SECONDS = int(os.getenv("SERVER_GRACEFUL_TIMEOUT_SECONDS", "65"))
+SERVER_ACCESS_LOG = _env_bool("SERVER_ACCESS_LOG", True)
+# Worker processes main.py starts; stores that must agree across workers
+# default to SQLite files in SERVER_STATE_DIR when there is more than one
+SERVER_WORKER_COUNT = SERVER_WORKERS or ((os.cpu_count() or 1) if ENV in ("prod", "production") else 1)
+SERVER_STATE_DIR = os.getenv("SERVER_STATE_DIR", os.path.join(tempfile.gettempdir(), f"calculator-api-{PORT}"))
+
+def _shared_db_path(name, filename):
+    """A configured SQLite path, else a file in SERVER_STATE_DIR with several workers, else "" (in memory)"""
+    default = os.path.join(SERVER_STATE_DIR, filename) if SERVER_WORKER_COUNT > 1 else ""
+    return os.getenv(name, default)
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-2.0-flash")
+# Send the static prompt as the model's system instruction instead of
+# inlining it into the user turn of every request
+GEMINI_SYSTEM_INSTRUCTION = _env_bool("GEMINI_SYSTEM_INSTRUCTION", True)
+
+# Cold start: the Gemini SDK loads on first use. By default startup waits
+# for it (and the shared model) before serving; FAST_START_ENABLED serves
+# immediately and warms up in the background, for scale-to-zero deployments
+FAST_START_ENABLED = _env_bool("FAST_START_ENABLED", False)
+
+# Resilient model client (see apps/calculator/model_client.py)
+MODEL_CALL_TIMEOUT_SECONDS = float(os.getenv("MODEL_CALL_TIMEOUT_SECONDS", "25"))
+MODEL_MAX_RETRIES = int(os.getenv("MODEL_MAX_RETRIES", "2"))
+MODEL_RETRY_BASE_SECONDS = float(os.getenv("MODEL_RETRY_BASE_SECONDS", "0.5"))
+MODEL_RETRY_MAX_SECONDS = float(os.getenv("MODEL_RETRY_MAX_SECONDS", "8"))
+# Send a second identical request when the first is slower than this latency quantile
+MODEL_HEDGE_ENABLED = _env_bool("MODEL_HEDGE_ENABLED", False)
+MODEL_HEDGE_QUANTILE = float(os.getenv("MODEL_HEDGE_QUANTILE", "0.95"))
+MODEL_HEDGE_MIN_SAMPLES = int(os.getenv("MODEL_HEDGE_MIN_SAMPLES", "20"))
+# Consecutive upstream failures that open the circuit, and how long it stays open
+MODEL_BREAKER_FAILURE_THRESHOLD = int(os.getenv("MODEL_BREAKER_FAILURE_THRESHOLD", "5"))
+MODEL_BREAKER_RESET_SECONDS = float(os.getenv("MODEL_BREAKER_RESET_SECONDS", "30"))
+
+# Offline fake model (see apps/calculator/fake_model.py); no API key or network needed
+FAKE_MODEL_ENABLED = _env_bool("FAKE_MODEL_ENABLED", False)
+FAKE_MODEL_LATENCY_MS = float(os.getenv("FAKE_MODEL_LATENCY_MS", "800"))  # median
+FAKE_MODEL_LATENCY_SIGMA = float(os.getenv("FAKE_MODEL_LATENCY_SIGMA", "0.5"))  # lognormal spread
+FAKE_MODEL_FAILURE_RATE = float(os.getenv("FAKE_MODEL_FAILURE_RATE", "0"))
+FAKE_MODEL_FAILURE_STATUS = int(os.getenv("FAKE_MODEL_FAILURE_STATUS", "503"))  # 429 | 500 | 503
+# A fraction of calls take FAKE_MODEL_TAIL_MS instead, modelling upstream stragglers
+FAKE_MODEL_TAIL_RATE = float(os.getenv("FAKE_MODEL_TAIL_RATE", "0"))
+FAKE_MODEL_TAIL_MS = float(os.getenv("FAKE_MODEL_TAIL_MS", "5000"))
+# JSON file of recorded response texts replayed in order; empty = one fixed answer
+FAKE_MODEL_RECORDINGS = os.getenv("FAKE_MODEL_RECORDINGS", "")
+# Fixed seed makes latency and failure sequences repeatable; empty = random
+FAKE_MODEL_SEED = os.getenv("FAKE_MODEL_SEED", "")
+
+# Result cache (see apps/calculator/cache.py)
+RESULT_CACHE_ENABLED = _env_bool("RESULT_CACHE_ENABLED", True)
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "3600"))
+# Leave empty to keep the cache in-process only
+RESULT_CACHE_DB_PATH = os.getenv("RESULT_CACHE_DB_PATH", "")
+RESULT_CACHE_DB_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_DB_MAX_ENTRIES", "100000"))
+
+# Expression-level cache (see apps/calculator/expression_cache.py): a known
+# drawing resubmitted with changed variables is re-evaluated locally
+EXPRESSION_CACHE_ENABLED = _env_bool("EXPRESSION_CACHE_ENABLED", True)
+EXPRESSION_CACHE_MAX_ENTRIES = int(os.getenv("EXPRESSION_CACHE_MAX_ENTRIES", "10000"))
+EXPRESSION_CACHE_TTL_SECONDS = float(os.getenv("EXPRESSION_CACHE_TTL_SECONDS", "3600"))
+
+# Perceptual near-duplicate lookup (see apps/calculator/phash.py)
+PHASH_ENABLED = _env_bool("PHASH_ENABLED", True)
+PHASH_HASH_SIZE = int(os.getenv("PHASH_HASH_SIZE", "8"))
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "4"))
+PHASH_INDEX_MAX_ENTRIES = int(os.getenv("PHASH_INDEX_MAX_ENTRIES", "100000"))
+
+# Model call admission control (see apps/calculator/concurrency.py)
+ANALYSIS_MAX_CONCURRENCY = int(os.getenv("ANALYSIS_MAX_CONCURRENCY", "32"))
+ANALYSIS_MAX_QUEUE = int(os.getenv("ANALYSIS_MAX_QUEUE", "64"))
+ANALYSIS_TIMEOUT_SECONDS = float(os.getenv("ANALYSIS_TIMEOUT_SECONDS", "60"))
+
+# Per-client rate limiting and upstream QPS budget (see apps/calculator/rate_limit.py)
+RATE_LIMIT_ENABLED = _env_bool("RATE_LIMIT_ENABLED", True)
+RATE_LIMIT_RATE_PER_SECOND = float(os.getenv("RATE_LIMIT_RATE_PER_SECOND", "1"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "20"))
+# JSON object of API key -> [rate per second, burst]; requests with a listed
+# X-API-Key header get that quota, everyone else is keyed by client IP
+RATE_LIMIT_API_KEYS = os.getenv("RATE_LIMIT_API_KEYS", "{}")
+# Key by the first X-Forwarded-For address (only behind a trusted proxy)
+RATE_LIMIT_TRUST_FORWARDED = _env_bool("RATE_LIMIT_TRUST_FORWARDED", False)
+# Leave empty for in-process buckets; a SQLite path shares buckets between workers
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH", "")
+# Gemini calls per second across the service; 0 = unlimited
+UPSTREAM_QPS = float(os.getenv("UPSTREAM_QPS", "0"))
+UPSTREAM_BURST = float(os.getenv("UPSTREAM_BURST", "10"))
+# How long a model call may wait for upstream budget before giving up with a 429
+UPSTREAM_MAX_WAIT_SECONDS = float(os.getenv("UPSTREAM_MAX_WAIT_SECONDS", "5"))
+
+# Prometheus-style metrics at GET /metrics (see apps/calculator/metrics.py)
+METRICS_ENABLED = _env_bool("METRICS_ENABLED", True)
+
+# Background model health probe (see health.py)
+HEALTH_PROBE_ENABLED = _env_bool("HEALTH_PROBE_ENABLED", True)
+HEALTH_PROBE_INTERVAL_SECONDS = float(os.getenv("HEALTH_PROBE_INTERVAL_SECONDS", "60"))
+HEALTH_PROBE_RETRY_SECONDS = float(os.getenv("HEALTH_PROBE_RETRY_SECONDS", "5"))
+HEALTH_PROBE_TIMEOUT_SECONDS = float(os.getenv("HEALTH_PROBE_TIMEOUT_SECONDS", "10"))
+# Consecutive failed probes before /health/ready answers 503; fewer report "degraded". 0 never fails readiness
+HEALTH_UNREADY_AFTER_FAILURES = int(os.getenv("HEALTH_UNREADY_AFTER_FAILURES", "5"))
+
+# Image preprocessing before upload (see apps/calculator/preprocess.py)
+PREPROCESS_ENABLED = _env_bool("PREPROCESS_ENABLED", True)
+PREPROCESS_MODE = os.getenv("PREPROCESS_MODE", "grayscale")  # grayscale | bilevel
+PREPROCESS_MAX_DIMENSION = int(os.getenv("PREPROCESS_MAX_DIMENSION", "1024"))
+PREPROCESS_PADDING = int(os.getenv("PREPROCESS_PADDING", "16"))
+PREPROCESS_FORMAT = os.getenv("PREPROCESS_FORMAT", "PNG")  # PNG | WEBP
+
+# Local fast path for simple arithmetic (see apps/calculator/local_eval.py)
+LOCAL_EVAL_ENABLED = _env_bool("LOCAL_EVAL_ENABLED", True)
+LOCAL_EVAL_MIN_CONFIDENCE = float(os.getenv("LOCAL_EVAL_MIN_CONFIDENCE", "0.9"))
+# Directory of labelled glyph images ("7_001.png", "plus_002.png", "x_001.png", ...);
+# without it no recognizer is registered and every request goes to the model.
+# apps/calculator/glyph_templates is a minimal typeset set to start from
+LOCAL_EVAL_TEMPLATES_DIR = os.getenv("LOCAL_EVAL_TEMPLATES_DIR", "")
+
+# Batch analysis endpoint; each unique image costs one rate-limit token, so
+# batches beyond RATE_LIMIT_BURST need an API key with a larger burst
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "1000"))
+BATCH_MAX_PARALLELISM = int(os.getenv("BATCH_MAX_PARALLELISM", "8"))
+
+# Binary/multipart upload endpoint (POST /calculate/upload)
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+
+# Server-side session variables (see apps/calculator/sessions.py), used when
+# a request carries an X-Session-Id header
+SESSION_ENABLED = _env_bool("SESSION_ENABLED", True)
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", str(2 * 3600)))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_MAX_VARS = int(os.getenv("SESSION_MAX_VARS", "256"))
+# Variables sent with a drawing whose referenced names are not known yet
+SESSION_PROMPT_MAX_VARS = int(os.getenv("SESSION_PROMPT_MAX_VARS", "20"))
+# A SQLite path shares sessions between workers; empty keeps them in process,
+# which is only the default with a single worker
+SESSION_DB_PATH = _shared_db_path("SESSION_DB_PATH", "sessions.sqlite3")
+
+# Per-region analysis of multi-expression canvases (see apps/calculator/regions.py).
+# Off by default: regions are solved independently, so a variable assigned
+# on one line of a canvas is not visible to the others in the same run
+REGIONS_ENABLED = _env_bool("REGIONS_ENABLED", False)
+# Blank pixel rows/columns that separate two expressions
+REGION_MIN_ROW_GAP = int(os.getenv("REGION_MIN_ROW_GAP", "48"))
+REGION_MIN_COLUMN_GAP = int(os.getenv("REGION_MIN_COLUMN_GAP", "120"))
+# Ink smaller than this on both sides is treated as a stray speck
+REGION_MIN_SIZE = int(os.getenv("REGION_MIN_SIZE", "8"))
+REGION_MAX_REGIONS = int(os.getenv("REGION_MAX_REGIONS", "12"))
+REGION_PADDING = int(os.getenv("REGION_PADDING", "16"))
+
+# Background job queue (see apps/calculator/jobs.py)
+JOBS_ENABLED = _env_bool("JOBS_ENABLED", True)
+# Worker tasks per server process; each runs one analysis at a time through
+# the same ANALYSIS_MAX_CONCURRENCY limit as interactive requests
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+# Waiting jobs beyond this answer 429
+JOBS_MAX_QUEUED = int(os.getenv("JOBS_MAX_QUEUED", "1000"))
+# Finished jobs stay readable for this long
+JOBS_RESULT_TTL_SECONDS = float(os.getenv("JOBS_RESULT_TTL_SECONDS", "3600"))
+# A running job whose worker has not finished it within the lease is retried
+JOBS_LEASE_SECONDS = float(os.getenv("JOBS_LEASE_SECONDS", "300"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+JOBS_RETRY_SECONDS = float(os.getenv("JOBS_RETRY_SECONDS", "5"))
+JOBS_POLL_SECONDS = float(os.getenv("JOBS_POLL_SECONDS", "1"))
+JOBS_WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("JOBS_WEBHOOK_TIMEOUT_SECONDS", "10"))
+# Comma-separated hosts webhooks may target; empty allows any http(s) URL whose
+# host resolves only to public addresses (no loopback, private or link-local)
+JOBS_WEBHOOK_ALLOWED_HOSTS = os.getenv("JOBS_WEBHOOK_ALLOWED_HOSTS", "")
+# A SQLite path keeps queued jobs across restarts and shares the queue between
+# workers; with several workers it defaults to a file in SERVER_STATE_DIR,
+# otherwise the queue is in-process
+JOBS_DB_PATH = _shared_db_path("JOBS_DB_PATH", "jobs.sqlite3")
+
+# Response compression (see apps/calculator/encoding.py); brotli is used
+# when the brotli package is installed, gzip otherwise
+COMPRESSION_ENABLED = _env_bool("COMPRESSION_ENABLED", True)
+# Smaller bodies are sent as they are
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+# Brotli's default of 11 is meant for static assets and is slow per request
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "5"))
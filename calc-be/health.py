@@ -0,0 +1,144 @@
+"""
+Background health monitoring for the Gemini API.
+
+The model is probed on a timer from a background task and the outcome is
+cached, so /health and the readiness probe answer from memory instead of
+spending model latency and quota on every load balancer check.
+
+Every instance shares the same upstream, so one failed probe only marks
+the model "degraded": taking instances out of rotation would drain the
+whole fleet during a short Gemini outage while cached and local answers
+still work. Readiness fails after HEALTH_UNREADY_AFTER_FAILURES
+consecutive failures.
+"""
+import asyncio
+import logging
+import random
+import time
+from apps.calculator.utils import load_genai
+from constants import (
+    GEMINI_API_KEY,
+    GEMINI_MODEL_NAME,
+    FAKE_MODEL_ENABLED,
+    HEALTH_PROBE_ENABLED,
+    HEALTH_PROBE_INTERVAL_SECONDS,
+    HEALTH_PROBE_RETRY_SECONDS,
+    HEALTH_PROBE_TIMEOUT_SECONDS,
+    HEALTH_UNREADY_AFTER_FAILURES,
+)
+
+logger = logging.getLogger("calculator-api")
+
+_probe_model = None
+
+async def probe_gemini_api():
+    """Verify Gemini API connection and configuration."""
+    global _probe_model
+    if not GEMINI_API_KEY and not FAKE_MODEL_ENABLED:
+        raise ValueError("GEMINI_API_KEY is not set in environment variables")
+
+    # Plain model without the analysis system instruction, built once
+    if _probe_model is None:
+        if FAKE_MODEL_ENABLED:
+            from apps.calculator.fake_model import FakeGenerativeModel
+            _probe_model = FakeGenerativeModel(model_name=GEMINI_MODEL_NAME, failure_rate=0)
+        else:
+            # The first build imports the SDK; keep that off the event loop
+            genai = await asyncio.to_thread(load_genai)
+            _probe_model = genai.GenerativeModel(model_name=GEMINI_MODEL_NAME)
+    response = await _probe_model.generate_content_async("Test connection")
+    if not response or not response.text:
+        raise ValueError("Empty response from Gemini API")
+
+class HealthMonitor:
+    """Periodically probes the model and caches the last result"""
+
+    def __init__(self, probe=probe_gemini_api, interval_seconds: float = HEALTH_PROBE_INTERVAL_SECONDS,
+                 retry_seconds: float = HEALTH_PROBE_RETRY_SECONDS,
+                 timeout_seconds: float = HEALTH_PROBE_TIMEOUT_SECONDS,
+                 unready_after_failures: int = HEALTH_UNREADY_AFTER_FAILURES):
+        self.probe = probe
+        self.interval_seconds = interval_seconds
+        self.retry_seconds = retry_seconds
+        self.timeout_seconds = timeout_seconds
+        self.unready_after_failures = unready_after_failures
+        self.healthy = None  # None until the first probe completes
+        self.last_error = None
+        self.consecutive_failures = 0
+        self._checked_at = None
+        self._task = None
+
+    def start(self):
+        """Start probing in the background; returns immediately"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def check_now(self):
+        """Run a single probe and record its outcome"""
+        try:
+            await asyncio.wait_for(self.probe(), timeout=self.timeout_seconds)
+            if self.healthy is not True:
+                logger.info("Gemini API connection verified successfully")
+            self.healthy = True
+            self.last_error = None
+            self.consecutive_failures = 0
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.healthy = False
+            self.last_error = str(e) or e.__class__.__name__
+            self.consecutive_failures += 1
+            logger.error(f"Gemini API health probe failed ({self.consecutive_failures} in a row): {self.last_error}")
+        finally:
+            self._checked_at = time.monotonic()
+        return self.healthy
+
+    def next_delay(self) -> float:
+        """Seconds until the next probe: jittered interval, or jittered backoff after failures"""
+        if self.consecutive_failures == 0:
+            return self.interval_seconds * random.uniform(0.9, 1.1)
+        backoff = self.retry_seconds * (2 ** (self.consecutive_failures - 1))
+        return min(self.interval_seconds, backoff) * random.uniform(0.5, 1.0)
+
+    async def _run(self):
+        while True:
+            await self.check_now()
+            await asyncio.sleep(self.next_delay())
+
+    def age_us(self):
+        if self._checked_at is None:
+            return None
+        return int((time.monotonic() - self._checked_at) * 1_000_000)
+
+    @property
+    def ready(self) -> bool:
+        """Probed at least once and not failing for unready_after_failures probes in a row"""
+        if self.healthy is None:
+            return False
+        return self.unready_after_failures <= 0 or self.consecutive_failures < self.unready_after_failures
+
+    def status(self) -> dict:
+        if self.healthy is None:
+            status = "starting"
+        elif self.healthy:
+            status = "healthy"
+        else:
+            status = "degraded" if self.ready else "unhealthy"
+        return {
+            "status": status,
+            "ready": self.ready,
+            "age_us": self.age_us(),
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+        }
+
+health_monitor = HealthMonitor() if HEALTH_PROBE_ENABLED else None
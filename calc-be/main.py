@@ -1,12 +1,41 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 import uvicorn
-import google.generativeai as genai
+import asyncio
+import importlib.util
 import logging
 import sys
 import os
-from apps.calculator.route import router as calculator_router
-from constants import SERVER_URL, PORT, ENV, GEMINI_API_KEY
+from apps.calculator.route import router as calculator_router, run_job
+from apps.calculator.concurrency import analysis_limiter
+from apps.calculator.model_client import model_client
+from apps.calculator.rate_limit import RateLimitMiddleware
+from apps.calculator.encoding import CompressionMiddleware
+from apps.calculator.metrics import MetricsMiddleware, registry as metrics_registry
+from apps.calculator.utils import warm_up
+from apps.calculator.sessions import session_store
+from apps.calculator.jobs import job_queue
+from constants import (
+    SERVER_URL,
+    PORT,
+    ENV,
+    SERVER_WORKER_COUNT,
+    SERVER_LOOP,
+    SERVER_HTTP,
+    SERVER_BACKLOG,
+    SERVER_KEEPALIVE_SECONDS,
+    SERVER_LIMIT_CONCURRENCY,
+    SERVER_MAX_REQUESTS,
+    SERVER_GRACEFUL_TIMEOUT_SECONDS,
+    SERVER_ACCESS_LOG,
+    RATE_LIMIT_ENABLED,
+    METRICS_ENABLED,
+    COMPRESSION_ENABLED,
+    FAST_START_ENABLED,
+)
+from health import health_monitor
 
 # Set up basic logging
 logging.basicConfig(
@@ -31,6 +60,10 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Per-client token buckets on /calculate; added before CORS so 429s still carry CORS headers
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -40,29 +73,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Utility function to check Gemini API
-def verify_gemini_api():
-    """Verify Gemini API connection and configuration."""
-    logger.info("Verifying Gemini API connection...")
-    
-    if not GEMINI_API_KEY:
-        logger.error("GEMINI_API_KEY is not set in environment variables")
-        return False
-    
+# Inside metrics, so response sizes are recorded as sent on the wire
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+
+# Outermost, so rate-limited and CORS-rejected requests are counted too
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+async def warm_up_in_background():
+    """Fast-start warm-up; on failure the first request that needs the model retries it"""
     try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        model = genai.GenerativeModel(model_name="gemini-2.0-flash")
-        response = model.generate_content("Test connection")
-        
-        if not response or not response.text:
-            logger.error("Empty response from Gemini API")
-            return False
-            
-        logger.info("Gemini API connection verified successfully")
-        return True
+        await asyncio.to_thread(warm_up)
     except Exception as e:
-        logger.error(f"Gemini API error: {str(e)}")
-        return False
+        logger.error(f"Background warm-up failed: {str(e)}")
 
 # Startup event
 @app.on_event("startup")
@@ -70,32 +94,86 @@ async def startup_event():
     """Run when the application starts."""
     logger.info("=" * 50)
     logger.info("Starting Calculator API Server")
-    logger.info(f"Environment: {ENV}")
+    logger.info(f"Environment: {ENV} (worker pid {os.getpid()})")
     logger.info(f"Server URL: http://{SERVER_URL}:{PORT}")
     logger.info(f"API Documentation: http://{SERVER_URL}:{PORT}/docs")
     logger.info("=" * 50)
+
+    # Load the Gemini SDK and shared model off the event loop; in fast-start
+    # mode uvicorn binds the socket and serves while this runs
+    if FAST_START_ENABLED:
+        app.state.warm_up = asyncio.ensure_future(warm_up_in_background())
+        logger.info("Fast start: warming up the model client in the background")
+    else:
+        await asyncio.to_thread(warm_up)
     
-    # Verify Gemini API
-    if not verify_gemini_api():
-        logger.warning("Starting server despite Gemini API verification failure")
+    # Probe the Gemini API in the background so startup never waits on the model
+    if health_monitor is not None:
+        health_monitor.start()
+        logger.info("Gemini API health monitor started")
     else:
-        logger.info("All systems go!")
+        logger.info("Gemini API health monitor disabled")
+
+    if job_queue is not None:
+        job_queue.start(run_job)
 
 # Shutdown event
 @app.on_event("shutdown")
-def shutdown_event():
+async def shutdown_event():
     """Run when the application is shutting down."""
     logger.info("Application shutting down")
+    # Jobs still running go back to the queue and resume after a restart
+    if job_queue is not None:
+        await job_queue.stop()
+    # Let analyses that outlived their connections (e.g. background work) finish
+    await analysis_limiter.drain(SERVER_GRACEFUL_TIMEOUT_SECONDS)
+    if health_monitor is not None:
+        await health_monitor.stop()
 
 # Health check endpoint
 @app.get('/health')
 async def health_check():
-    """Health check endpoint"""
-    logger.info("Health check accessed")
-    if verify_gemini_api():
-        return {"status": "healthy", "message": "Server and Gemini API are functioning correctly"}
+    """Health check endpoint reporting the cached Gemini API probe result"""
+    if health_monitor is None:
+        return {"status": "healthy", "message": "Gemini API health probing is disabled", "age_us": None,
+                "model_client": model_client.stats(),
+                "sessions": await run_in_threadpool(session_store.stats) if session_store is not None else None,
+                "jobs": await run_in_threadpool(job_queue.stats) if job_queue is not None else None}
+    health = health_monitor.status()
+    if health["status"] == "healthy":
+        health["message"] = "Server and Gemini API are functioning correctly"
+    elif health["status"] == "starting":
+        health["message"] = "Gemini API has not been probed yet"
+    elif health["status"] == "degraded":
+        health["message"] = "Gemini API probe failed; still serving requests"
     else:
-        return {"status": "unhealthy", "message": "Gemini API connection failed"}
+        health["message"] = "Gemini API connection failed"
+    health["model_client"] = model_client.stats()
+    health["sessions"] = await run_in_threadpool(session_store.stats) if session_store is not None else None
+    health["jobs"] = await run_in_threadpool(job_queue.stats) if job_queue is not None else None
+    return health
+
+# Liveness probe: the process is up and serving requests
+@app.get('/health/live')
+async def liveness_check():
+    """Liveness endpoint"""
+    return {"status": "alive"}
+
+# Readiness probe: the Gemini API has been probed and is not persistently failing
+@app.get('/health/ready')
+async def readiness_check():
+    """Readiness endpoint"""
+    if health_monitor is None or health_monitor.ready:
+        return {"status": "ready"}
+    return JSONResponse(status_code=503, content={"status": "not ready", **health_monitor.status()})
+
+# Prometheus scrape endpoint
+@app.get('/metrics')
+async def metrics():
+    """Metrics in the Prometheus text exposition format"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # Root endpoint
 @app.get('/')
@@ -111,10 +189,38 @@ async def root():
 # Include calculator routes
 app.include_router(calculator_router, prefix="/calculate", tags=["calculate"])
 
+def server_options() -> dict:
+    """uvicorn settings from the environment
+
+    Production runs one worker process per CPU unless SERVER_WORKERS says
+    otherwise; dev keeps a single process. With the default "auto" loop
+    and http settings uvicorn uses uvloop and httptools when installed.
+    """
+    return {
+        "host": SERVER_URL,
+        "port": int(PORT),
+        "log_level": "info",
+        "workers": SERVER_WORKER_COUNT,
+        "loop": SERVER_LOOP,
+        "http": SERVER_HTTP,
+        "backlog": SERVER_BACKLOG,
+        "timeout_keep_alive": SERVER_KEEPALIVE_SECONDS,
+        "limit_concurrency": SERVER_LIMIT_CONCURRENCY or None,
+        "limit_max_requests": SERVER_MAX_REQUESTS or None,
+        "timeout_graceful_shutdown": SERVER_GRACEFUL_TIMEOUT_SECONDS,
+        "access_log": SERVER_ACCESS_LOG,
+    }
+
+def _available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
 # Main function to run the app
 def main():
     """Main function to start the server."""
     logger.info("Starting server...")
+    options = server_options()
+    loop = SERVER_LOOP if SERVER_LOOP != "auto" else ("uvloop" if _available("uvloop") else "asyncio")
+    http = SERVER_HTTP if SERVER_HTTP != "auto" else ("httptools" if _available("httptools") else "h11")
     
     # Print startup banner to ensure it's visible
     print("\n" + "=" * 50)
@@ -122,16 +228,15 @@ def main():
     print(f"Environment: {ENV}")
     print(f"Server URL: http://{SERVER_URL}:{PORT}")
     print(f"API Documentation: http://{SERVER_URL}:{PORT}/docs")
+    print(f"Workers: {options['workers']} ({loop} loop, {http} HTTP parser)")
     print("=" * 50 + "\n")
     
     try:
-        # Start the server
-        uvicorn.run(
-            app,
-            host=SERVER_URL,
-            port=int(PORT),
-            log_level="info"
-        )
+        # Start the server; multiple workers need an import string so each process loads its own app
+        if options["workers"] > 1:
+            uvicorn.run("main:app", app_dir=os.path.dirname(os.path.abspath(__file__)), **options)
+        else:
+            uvicorn.run(app, **options)
     except Exception as e:
         logger.error(f"Failed to start server: {str(e)}")
         sys.exit(1)
@@ -1,5 +1,24 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import List, Optional
 
 class ImageData(BaseModel):
     image: str
     dict_of_vars: dict
+
+class BatchImageItem(BaseModel):
+    image: str
+    id: Optional[str] = None
+    # Falls back to the batch-level dict_of_vars when omitted
+    dict_of_vars: Optional[dict] = None
+
+class BatchImageData(BaseModel):
+    images: List[BatchImageItem]
+    dict_of_vars: dict = {}
+
+class JobRequest(BaseModel):
+    image: str
+    dict_of_vars: dict = {}
+    # Higher runs first
+    priority: int = Field(5, ge=0, le=9)
+    # Receives the finished job as a JSON POST
+    webhook: Optional[str] = None
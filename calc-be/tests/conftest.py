@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Modules import the backend as top-level packages, as main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Settings are read at import time; run offline with no background probing
+os.environ.setdefault("FAKE_MODEL_ENABLED", "true")
+os.environ.setdefault("HEALTH_PROBE_ENABLED", "false")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
@@ -0,0 +1,39 @@
+import json
+from fastapi.testclient import TestClient
+from apps.calculator import encoding, route
+from apps.calculator.cache import ResultCache
+from apps.calculator.encoding import encode_result
+
+BIG = 2 ** 100
+BIG_ANSWER = {"expr": "2^100", "result": BIG, "steps": [], "type": "arithmetic", "assign": False,
+              "latex": "2^{100}"}
+
+def test_integers_beyond_64_bits_fall_back_to_json():
+    body, media_type = encode_result({"data": [BIG_ANSWER]})
+    assert media_type == "application/json"
+    assert json.loads(body)["data"][0]["result"] == BIG
+
+def test_msgpack_overflow_falls_back_to_json(monkeypatch):
+    class OverflowingPacker:
+        @staticmethod
+        def packb(payload, use_bin_type=True):
+            raise OverflowError("Integer value out of range")
+    monkeypatch.setattr(encoding, "msgpack", OverflowingPacker)
+    body, media_type = encode_result({"data": [BIG_ANSWER]}, "application/msgpack")
+    assert media_type == "application/json"
+    assert json.loads(body)["data"][0]["result"] == BIG
+
+def test_calculate_answers_big_integer_results(monkeypatch):
+    import main
+
+    async def analyze(image, dict_of_vars):
+        return [dict(BIG_ANSWER)]
+    monkeypatch.setattr(route, "analyze_image_async", analyze)
+    monkeypatch.setattr(route, "result_cache", ResultCache())
+    image = "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+    with TestClient(main.app) as client:
+        # The second request is answered from the result cache
+        for _ in range(2):
+            response = client.post("/calculate", json={"image": image, "dict_of_vars": {}})
+            assert response.status_code == 200
+            assert response.json()["data"][0]["result"] == BIG
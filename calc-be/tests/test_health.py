@@ -0,0 +1,49 @@
+import asyncio
+from health import HealthMonitor
+
+def monitor_with(outcomes: list, unready_after_failures: int = 3) -> HealthMonitor:
+    async def probe():
+        if not outcomes.pop(0):
+            raise ConnectionError("upstream unavailable")
+    return HealthMonitor(probe=probe, timeout_seconds=1, unready_after_failures=unready_after_failures)
+
+def test_not_ready_before_the_first_probe():
+    monitor = monitor_with([True])
+    assert monitor.status()["status"] == "starting"
+    assert not monitor.ready
+
+def test_short_outage_is_degraded_but_ready():
+    monitor = monitor_with([True, False, False])
+
+    async def run():
+        for _ in range(3):
+            await monitor.check_now()
+
+    asyncio.run(run())
+    assert monitor.status()["status"] == "degraded"
+    assert monitor.ready
+
+def test_persistent_failures_fail_readiness_until_a_probe_succeeds():
+    monitor = monitor_with([False, False, False, True])
+
+    async def run():
+        for _ in range(3):
+            await monitor.check_now()
+        assert monitor.status()["status"] == "unhealthy"
+        assert not monitor.ready
+        await monitor.check_now()
+
+    asyncio.run(run())
+    assert monitor.status()["status"] == "healthy"
+    assert monitor.ready
+
+def test_zero_threshold_never_fails_readiness():
+    monitor = monitor_with([False] * 10, unready_after_failures=0)
+
+    async def run():
+        for _ in range(10):
+            await monitor.check_now()
+
+    asyncio.run(run())
+    assert monitor.status()["status"] == "degraded"
+    assert monitor.ready
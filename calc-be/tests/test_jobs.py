@@ -0,0 +1,113 @@
+import asyncio
+import http.server
+import sqlite3
+import threading
+import pytest
+import requests
+from apps.calculator import jobs
+from apps.calculator.jobs import JobQueue, JobStore, webhook_allowed
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1:8900/hook",
+    "http://localhost/hook",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://10.0.0.5/hook",
+    "http://192.168.1.1/hook",
+    "http://[::1]/hook",
+    "http://[::ffff:127.0.0.1]/hook",
+    "http://0.0.0.0/hook",
+    "file:///etc/passwd",
+    "ftp://93.184.216.34/hook",
+])
+def test_webhooks_to_internal_addresses_are_refused(url):
+    assert not webhook_allowed(url, allowed_hosts="")
+
+def test_webhooks_to_public_addresses_are_allowed():
+    assert webhook_allowed("https://93.184.216.34/hook", allowed_hosts="")
+
+def test_allowed_hosts_list_is_exclusive():
+    assert webhook_allowed("https://hooks.example.com/calculator", allowed_hosts="hooks.example.com")
+    assert not webhook_allowed("https://93.184.216.34/hook", allowed_hosts="hooks.example.com")
+
+def test_stop_cancels_pending_webhook_deliveries(monkeypatch):
+    def slow_post(url, payload, timeout):
+        import time
+        time.sleep(0.5)
+        return 204
+    monkeypatch.setattr(jobs, "_post_json", slow_post)
+
+    async def runner(request):
+        return {"message": "Image processed successfully", "data": [], "status": "success"}
+
+    async def run():
+        queue = JobQueue(JobStore(), workers=1, poll_seconds=0.01)
+        queue.start(runner)
+        job = await queue.submit({"image": "", "dict_of_vars": {}}, priority=5, webhook="https://93.184.216.34/hook")
+        while not queue._deliveries:
+            await asyncio.sleep(0.01)
+        delivery = next(iter(queue._deliveries))
+        await queue.stop()
+        assert delivery.cancelled()
+        assert not queue._deliveries
+        assert queue.store.get(job["id"])["status"] == "succeeded"
+
+    asyncio.run(run())
+
+def test_worker_survives_store_errors(monkeypatch, caplog):
+    async def runner(request):
+        return {"message": "Image processed successfully", "data": [], "status": "success"}
+
+    async def run():
+        queue = JobQueue(JobStore(), workers=1, poll_seconds=0.01, lease_seconds=0.05)
+        finish = queue.store.finish
+        calls = []
+
+        def flaky_finish(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise sqlite3.OperationalError("database is locked")
+            return finish(*args)
+        monkeypatch.setattr(queue.store, "finish", flaky_finish)
+        queue.start(runner)
+        job = await queue.submit({"image": "", "dict_of_vars": {}}, priority=5)
+        # The lease runs out and the same worker picks the job up again
+        while (await queue.get(job["id"]))["status"] != "succeeded":
+            await asyncio.sleep(0.01)
+        await queue.stop()
+
+    asyncio.run(run())
+    assert "Job worker error, continuing: database is locked" in caplog.text
+
+def test_get_does_not_write():
+    store = JobStore()
+    job = store.submit({"image": "", "dict_of_vars": {}}, priority=5)
+    store.finish(job["id"], "succeeded", {"data": []})
+    store._conn.execute("UPDATE jobs SET expires_at = 0")
+    assert store.get(job["id"]) is None
+    assert store.counts() == {"succeeded": 1}
+    assert store.prune() == 1
+
+def test_webhooks_rebound_to_internal_addresses_are_refused(monkeypatch):
+    hits = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            hits.append(self.path)
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    # The host passed the check, then DNS changed to point at loopback
+    monkeypatch.setattr(jobs, "webhook_allowed", lambda url: True)
+    try:
+        with pytest.raises(requests.ConnectionError, match="non-public address 127.0.0.1"):
+            jobs._post_json(f"http://127.0.0.1:{server.server_port}/hook", {}, timeout=2)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert hits == []
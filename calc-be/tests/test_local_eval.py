@@ -0,0 +1,59 @@
+import pytest
+from fastapi.testclient import TestClient
+from apps.calculator import route
+from apps.calculator.cache import ResultCache
+from apps.calculator.expression_cache import ExpressionCache
+from apps.calculator.local_eval import LocalEvaluator, UnsupportedExpression, evaluate_line, safe_eval
+
+@pytest.mark.parametrize("expr, dict_of_vars", [
+    ("sqrt(x)", {"x": -4}),
+    ("log(0)", {}),
+    ("ln(x)", {"x": -1}),
+    ("1/x", {"x": 0}),
+    ("exp(1000)", {}),
+])
+def test_math_errors_are_unsupported(expr, dict_of_vars):
+    with pytest.raises(UnsupportedExpression):
+        safe_eval(expr, dict_of_vars)
+
+def test_changed_variables_outside_the_domain_go_back_to_the_model():
+    cache = ExpressionCache()
+    cache.record("drawing", [evaluate_line("sqrt(x)", {"x": 4})], {"x": 4})
+    assert cache.resolve("drawing", {"x": 9})[0]["result"] == "3"
+    assert cache.resolve("drawing", {"x": -4}) is None
+    assert cache.invalidated == 1
+
+def test_local_evaluator_falls_back_on_domain_errors():
+    class Recognizer:
+        def recognize(self, image):
+            return "log(x)", 1.0
+    evaluator = LocalEvaluator()
+    evaluator.register(Recognizer())
+    assert evaluator.try_answer(None, {"x": 0}) is None
+    assert evaluator.fallbacks == 1
+
+def test_calculate_resubmitted_outside_the_domain_asks_the_model(monkeypatch):
+    import main
+
+    calls = []
+
+    async def analyze(image, dict_of_vars):
+        calls.append(dict(dict_of_vars))
+        x = dict_of_vars["x"]
+        result = str(int(x ** 0.5)) if x >= 0 else f"{int((-x) ** 0.5)}i"
+        return [{"expr": "sqrt(x)", "result": result, "steps": [], "type": "arithmetic", "assign": False,
+                 "latex": f"\\sqrt{{x}} = {result}"}]
+    monkeypatch.setattr(route, "analyze_image_async", analyze)
+    monkeypatch.setattr(route, "result_cache", ResultCache())
+    monkeypatch.setattr(route, "expression_cache", ExpressionCache())
+    monkeypatch.setattr(route, "local_evaluator", None)
+    image = "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+    with TestClient(main.app) as client:
+        results = []
+        for x in (4, 9, -4):
+            response = client.post("/calculate", json={"image": image, "dict_of_vars": {"x": x}})
+            assert response.status_code == 200
+            results.append(response.json()["data"][0]["result"])
+    # x=9 is re-evaluated locally; x=-4 is outside sqrt's domain and goes back to the model
+    assert results == ["2", "3", "2i"]
+    assert calls == [{"x": 4}, {"x": -4}]
@@ -0,0 +1,153 @@
+import asyncio
+import time
+import pytest
+from google.api_core import exceptions as google_exceptions
+from apps.calculator.fake_model import FakeGenerativeModel
+from apps.calculator.model_client import CircuitBreaker, CircuitOpenError, ModelClient, ModelUnavailableError
+
+def fake_model(failure_rate: float = 0, failure_status: int = 503, latencies: list = None) -> FakeGenerativeModel:
+    model = FakeGenerativeModel(recordings=["[]"], latency_ms=1, latency_sigma=0, failure_rate=failure_rate,
+                                failure_status=failure_status, tail_rate=0, seed=1)
+    if latencies is not None:
+        model.sample_latency = lambda: latencies.pop(0)
+    return model
+
+def client(max_retries: int = 0, failure_threshold: int = 3, reset_seconds: float = 60, **kwargs) -> ModelClient:
+    breaker = CircuitBreaker(failure_threshold=failure_threshold, reset_seconds=reset_seconds)
+    return ModelClient(timeout_seconds=1, max_retries=max_retries, retry_base_seconds=0.001,
+                       retry_max_seconds=0.001, breaker=breaker, **kwargs)
+
+def call(model_client: ModelClient, model: FakeGenerativeModel, hedge: bool = True):
+    return model_client.call(lambda: model.generate_content_async("prompt"), hedge=hedge)
+
+def test_breaker_opens_after_consecutive_failures():
+    model = fake_model(failure_rate=1)
+    model_client = client(failure_threshold=3)
+
+    async def run():
+        for _ in range(3):
+            with pytest.raises(ModelUnavailableError):
+                await call(model_client, model)
+        assert model_client.breaker.state == "open"
+        # Open: fails fast without calling the model
+        with pytest.raises(CircuitOpenError):
+            await call(model_client, model)
+
+    asyncio.run(run())
+    assert model.calls == 3
+
+def test_half_open_allows_a_single_trial_call():
+    model = fake_model(failure_rate=1)
+    model_client = client(failure_threshold=1, reset_seconds=0.05)
+
+    async def run():
+        with pytest.raises(ModelUnavailableError):
+            await call(model_client, model)
+        with pytest.raises(CircuitOpenError):
+            await call(model_client, model)
+        await asyncio.sleep(0.06)
+
+        model.failure_rate = 0
+        model.sample_latency = lambda: 0.05
+        trial = asyncio.ensure_future(call(model_client, model))
+        await asyncio.sleep(0.01)
+        assert model_client.breaker.state == "half_open"
+        with pytest.raises(CircuitOpenError):
+            await call(model_client, model)
+        await trial
+        assert model_client.breaker.state == "closed"
+
+    asyncio.run(run())
+    assert model.calls == 2
+
+def test_failed_trial_reopens_the_circuit():
+    model = fake_model(failure_rate=1)
+    model_client = client(failure_threshold=1, reset_seconds=0.05)
+
+    async def run():
+        with pytest.raises(ModelUnavailableError):
+            await call(model_client, model)
+        await asyncio.sleep(0.06)
+        with pytest.raises(ModelUnavailableError):
+            await call(model_client, model)
+        assert model_client.breaker.state == "open"
+        assert model_client.breaker.opened == 2
+
+    asyncio.run(run())
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_retryable_errors_are_retried(status):
+    model = fake_model(failure_rate=1, failure_status=status)
+    model_client = client(max_retries=2, failure_threshold=10)
+
+    async def run():
+        with pytest.raises(ModelUnavailableError):
+            await call(model_client, model)
+
+    asyncio.run(run())
+    assert model.calls == 3
+    assert model_client.retries == 2
+
+def test_retry_recovers_from_a_transient_error():
+    model = fake_model(failure_rate=1)
+    model_client = client(max_retries=2, failure_threshold=10)
+    outcome = model._outcome
+
+    def fail_once():
+        latency, failed, text = outcome()
+        return latency, failed and model.calls == 1, text
+    model._outcome = fail_once
+
+    response = asyncio.run(call(model_client, model))
+    assert response.text == "[]"
+    assert model.calls == 2
+    assert model_client.breaker.consecutive_failures == 0
+
+def test_non_retryable_errors_propagate_without_tripping_the_breaker():
+    attempts = []
+
+    async def bad_request():
+        attempts.append(1)
+        raise google_exceptions.InvalidArgument("Image is too large")
+    model_client = client(max_retries=2, failure_threshold=1)
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(google_exceptions.InvalidArgument):
+                await model_client.call(bad_request)
+
+    asyncio.run(run())
+    assert len(attempts) == 2
+    assert model_client.retries == 0
+    assert model_client.breaker.state == "closed"
+
+def test_hedge_fires_after_the_latency_quantile():
+    # The primary attempt is stuck in the tail; the hedge answers quickly
+    model = fake_model(latencies=[0.5, 0.01])
+    model_client = client(hedge=True, hedge_quantile=0.5, hedge_min_samples=1)
+    model_client.latency.record(0.02)
+
+    async def run():
+        start = time.monotonic()
+        await call(model_client, model)
+        return time.monotonic() - start
+
+    elapsed = asyncio.run(run())
+    assert model.calls == 2
+    assert model_client.hedged == 1
+    assert model_client.hedge_wins == 1
+    assert 0.02 <= elapsed < 0.25
+
+def test_fast_calls_and_unhedged_calls_are_not_hedged():
+    model = fake_model(latencies=[0.005, 0.5])
+    model_client = client(hedge=True, hedge_quantile=0.5, hedge_min_samples=1)
+    model_client.latency.record(0.05)
+
+    async def run():
+        await call(model_client, model)
+        # Streaming calls opt out of hedging
+        await call(model_client, model, hedge=False)
+
+    asyncio.run(run())
+    assert model.calls == 2
+    assert model_client.hedged == 0
@@ -0,0 +1,50 @@
+import asyncio
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+from apps.calculator import route
+from apps.calculator.cache import ResultCache
+from apps.calculator.phash import MultiIndexHashIndex, hamming, perceptual_fingerprint
+
+DISTINCT_PAIRS = [("3+4", "8+4"), ("24+13", "24+18"), ("6*7", "8*7"), ("x=5", "x=6")]
+
+def render(text: str, fill="white", offset=(40, 30)) -> Image.Image:
+    image = Image.new("RGBA", (480, 160))
+    ImageDraw.Draw(image).text(offset, text, fill=fill, font=ImageFont.load_default(size=64))
+    return image
+
+def answer_for(text: str) -> list:
+    return [{"expr": text, "result": text, "steps": [], "type": "arithmetic", "assign": False, "latex": text}]
+
+@pytest.fixture
+def caches(monkeypatch):
+    monkeypatch.setattr(route, "result_cache", ResultCache())
+    monkeypatch.setattr(route, "near_duplicate_index", MultiIndexHashIndex())
+    monkeypatch.setattr(route, "expression_cache", None)
+
+def solve_from_cache(image: Image.Image, answers: list = None):
+    """Look the canvas up, storing answers on a miss; returns the cached answers or None"""
+    async def run():
+        cached, store = await route.lookup_cached_answers(image, {})
+        if cached is None and answers is not None:
+            await store(answers)
+        return cached
+    return asyncio.run(run())
+
+def test_dhash_cannot_tell_digits_apart():
+    # Why the index needs an exact confirmation step
+    _, first, _ = perceptual_fingerprint(render("3+4"))
+    _, second, _ = perceptual_fingerprint(render("8+4"))
+    assert hamming(first, second) <= MultiIndexHashIndex().max_distance
+
+@pytest.mark.parametrize("first,second", DISTINCT_PAIRS)
+def test_distinct_expressions_never_share_an_answer(caches, first, second):
+    assert solve_from_cache(render(first), answer_for(first)) is None
+    assert solve_from_cache(render(second), answer_for(second)) is None
+    assert solve_from_cache(render(first)) == answer_for(first)
+    assert solve_from_cache(render(second)) == answer_for(second)
+
+def test_same_strokes_resolve_to_the_prior_answer(caches):
+    assert solve_from_cache(render("3+4"), answer_for("3+4")) is None
+    # Another colour and position misses the exact fingerprint but not the ink signature
+    assert solve_from_cache(render("3+4", fill="#ff0000", offset=(90, 50))) == answer_for("3+4")
+    assert route.near_duplicate_index.hits == 1
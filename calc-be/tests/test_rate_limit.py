@@ -0,0 +1,53 @@
+import asyncio
+import threading
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from apps.calculator.rate_limit import MemoryBucketStore, RateLimitMiddleware, SQLiteBucketStore, take_tokens
+from apps.calculator.route import router
+
+def client(burst: int) -> TestClient:
+    app = FastAPI()
+    app.include_router(router, prefix="/calculate")
+    # No refill within the test, so only the burst is available
+    app.add_middleware(RateLimitMiddleware, store=MemoryBucketStore(), rate=0.001, burst=burst, api_keys={})
+    return TestClient(app)
+
+def batch(size: int, unique: int = None) -> dict:
+    unique = unique or size
+    return {"images": [{"image": f"not-an-image-{index % unique}", "id": str(index)} for index in range(size)]}
+
+def test_batches_are_charged_per_image():
+    with client(burst=5) as test_client:
+        assert test_client.post("/calculate/batch", json=batch(3)).status_code == 200
+        response = test_client.post("/calculate/batch", json=batch(3))
+        assert response.status_code == 429
+        assert "retry-after" in response.headers
+
+def test_batches_beyond_the_burst_are_rejected():
+    with client(burst=5) as test_client:
+        assert test_client.post("/calculate/batch", json=batch(6)).status_code == 413
+
+def test_duplicate_images_are_not_charged():
+    with client(burst=5) as test_client:
+        # 50 entries but only 2 unique images: 2 of the 5 tokens
+        assert test_client.post("/calculate/batch", json=batch(50, unique=2)).status_code == 200
+        assert test_client.post("/calculate/batch", json=batch(3)).status_code == 200
+        assert test_client.post("/calculate/batch", json=batch(1)).status_code == 429
+
+def test_sqlite_buckets_are_taken_off_the_event_loop(tmp_path):
+    store = SQLiteBucketStore(str(tmp_path / "buckets.db"))
+    threads = []
+    take = store.take
+
+    def recording_take(*args):
+        threads.append(threading.get_ident())
+        return take(*args)
+    store.take = recording_take
+
+    async def run():
+        allowed, _, tokens = await take_tokens(store, "ip:test", 1, 5)
+        return allowed, tokens, threading.get_ident()
+
+    allowed, tokens, loop_thread = asyncio.run(run())
+    assert allowed and tokens == 4
+    assert threads and threads[0] != loop_thread
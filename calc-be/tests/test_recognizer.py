@@ -0,0 +1,62 @@
+import base64
+from io import BytesIO
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image, ImageDraw, ImageFont
+from apps.calculator import route
+from apps.calculator.cache import ResultCache
+from apps.calculator.local_eval import LocalEvaluator
+from apps.calculator.recognizer import LABELS, TEMPLATES_DIR, TemplateRecognizer
+from constants import LOCAL_EVAL_MIN_CONFIDENCE
+
+FONT = ImageFont.load_default(size=64)
+FILE_STEMS = {label: stem for stem, label in LABELS.items()}
+
+def render(text: str) -> Image.Image:
+    image = Image.new("RGBA", (64 * len(text) + 80, 120))
+    ImageDraw.Draw(image).text((40, 20), text, fill="white", font=FONT)
+    return image
+
+def data_url(image: Image.Image) -> str:
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+def write_templates(path, labels: str):
+    for label in labels:
+        render(label).save(path / f"{FILE_STEMS[label]}_001.png")
+
+def test_glyphs_match_their_own_templates(tmp_path):
+    write_templates(tmp_path, "0123456789+")
+    recognizer = TemplateRecognizer.from_directory(str(tmp_path))
+    text, confidence = recognizer.recognize(render("12+34"))
+    assert text == "12+34"
+    assert confidence >= LOCAL_EVAL_MIN_CONFIDENCE
+
+@pytest.mark.parametrize("text", ["12+34", "(3+4)*2", "0.5-1", "x=5", "y=x/2", "a+b"])
+def test_bundled_templates_recognize_printed_expressions(text):
+    recognized, confidence = TemplateRecognizer.from_directory(TEMPLATES_DIR).recognize(render(text))
+    assert recognized == text
+    assert confidence >= LOCAL_EVAL_MIN_CONFIDENCE
+
+@pytest.mark.parametrize("text, dict_of_vars, expr, result, assign", [
+    ("12+34", {}, "12+34", "46", False),
+    ("x*3", {"x": 4}, "x*3", "12", False),
+    ("y=x-2", {"x": 4}, "y", "2", True),
+])
+def test_calculate_answers_printed_canvases_locally(monkeypatch, text, dict_of_vars, expr, result, assign):
+    import main
+
+    async def analyze(image, dict_of_vars):
+        raise AssertionError("the model should not be called")
+    evaluator = LocalEvaluator()
+    evaluator.register(TemplateRecognizer.from_directory(TEMPLATES_DIR))
+    monkeypatch.setattr(route, "analyze_image_async", analyze)
+    monkeypatch.setattr(route, "local_evaluator", evaluator)
+    monkeypatch.setattr(route, "result_cache", ResultCache())
+    with TestClient(main.app) as client:
+        response = client.post("/calculate", json={"image": data_url(render(text)), "dict_of_vars": dict_of_vars})
+    assert response.status_code == 200
+    answer = response.json()["data"][0]
+    assert (answer["expr"], answer["result"], answer["assign"]) == (expr, result, assign)
+    assert evaluator.answered == 1
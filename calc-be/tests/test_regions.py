@@ -0,0 +1,51 @@
+import asyncio
+import pytest
+from apps.calculator import route
+from apps.calculator.model_client import ModelUnavailableError
+
+PARSE_FAILURE = ValueError("No valid answers found in AI response")
+
+def answer(expr: str) -> dict:
+    return {"expr": expr, "result": "0", "steps": [], "type": "arithmetic", "assign": False, "latex": expr}
+
+def fake_solver(outcomes: dict, cancelled: list):
+    """solve_image stand-in: regions are names mapped to answers, an exception or "slow" """
+    async def solve_image(region, dict_of_vars, original_bytes, preprocess_override=None, split=True, drawing=None):
+        outcome = outcomes[region]
+        if outcome == "slow":
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(region)
+                raise
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome, None
+    return solve_image
+
+def solve(monkeypatch, outcomes: dict, cancelled: list = None):
+    monkeypatch.setattr(route, "solve_image", fake_solver(outcomes, cancelled if cancelled is not None else []))
+    return asyncio.run(route.solve_regions(list(outcomes), {}))
+
+def test_unparseable_region_is_dropped(monkeypatch):
+    answers, complete = solve(monkeypatch, {"a": [answer("1+1")], "speck": PARSE_FAILURE, "b": [answer("2+2")]})
+    assert [item["expr"] for item in answers] == ["1+1", "2+2"]
+    assert not complete
+
+def test_all_regions_unparseable_raises_the_parse_failure(monkeypatch):
+    with pytest.raises(ValueError, match="No valid answers"):
+        solve(monkeypatch, {"a": PARSE_FAILURE, "b": PARSE_FAILURE})
+
+def test_fatal_region_error_cancels_the_others(monkeypatch):
+    cancelled = []
+
+    async def run():
+        monkeypatch.setattr(route, "solve_image", fake_solver(
+            {"a": ModelUnavailableError("circuit open", 5), "b": "slow"}, cancelled))
+        with pytest.raises(ModelUnavailableError):
+            await route.solve_regions(["a", "b"], {})
+        # Let the cancellation reach the sibling task; asyncio.run would cancel it anyway on exit
+        await asyncio.sleep(0)
+        assert cancelled == ["b"]
+
+    asyncio.run(run())
@@ -0,0 +1,77 @@
+import json
+from fastapi.testclient import TestClient
+from apps.calculator import route
+from apps.calculator.cache import ResultCache
+from apps.calculator.response_parser import IncrementalAnswerParser, parse_answers
+
+ANSWERS = [
+    {"expr": "2+2", "result": 4, "steps": [{"type": "math", "content": "2 + 2 = 4"}]},
+    {"expr": "3*3", "result": 9, "steps": [{"type": "math", "content": "3 * 3 = 9"}]},
+]
+# The middle answer has no result, so validation rejects it
+STREAM = json.dumps([
+    ANSWERS[0],
+    {"expr": "x", "steps": [{"type": "text", "content": "no result"}]},
+    ANSWERS[1],
+])
+IMAGE = "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+
+def test_bare_json_takes_the_fast_path():
+    assert parse_answers(json.dumps(ANSWERS)) == (ANSWERS, "json")
+
+def test_fenced_json():
+    text = "```json\n" + json.dumps(ANSWERS, indent=2) + "\n```"
+    assert parse_answers(text) == (ANSWERS, "json")
+
+def test_prose_around_the_payload():
+    text = "Here are the results:\n" + json.dumps(ANSWERS) + "\nLet me know if you need more [help]."
+    parsed, method = parse_answers(text)
+    assert parsed == ANSWERS
+    assert method == "tolerant"
+
+def test_python_literals_and_latex_escapes():
+    text = "[{'expr': '\\int x dx', 'result': 'x^2/2', 'assign': False, 'steps': [],}]"
+    parsed, method = parse_answers(text)
+    assert method == "tolerant"
+    assert parsed == [{"expr": "\\int x dx", "result": "x^2/2", "assign": False, "steps": []}]
+
+def test_no_payload_fails():
+    assert parse_answers("I could not read the image.") == ([], "failed")
+
+def test_incremental_parser_reassembles_split_chunks():
+    parser = IncrementalAnswerParser()
+    events = []
+    # Chunk boundaries fall inside keys, strings and escapes
+    for i in range(0, len(STREAM), 7):
+        events.extend(parser.feed(STREAM[i:i + 7]))
+    assert [(kind, index) for kind, index, _ in events] == [
+        ("step", 0), ("answer", 0), ("step", 1), ("answer", 1), ("step", 2), ("answer", 2),
+    ]
+    assert events[1][2] == ANSWERS[0]
+    assert events[5][2] == ANSWERS[1]
+    assert parser.answers_emitted == 3
+
+def test_stream_indexes_count_only_emitted_answers(monkeypatch):
+    import main
+
+    async def stream(image, dict_of_vars):
+        for i in range(0, len(STREAM), 11):
+            yield STREAM[i:i + 11]
+    monkeypatch.setattr(route, "stream_analysis_async", stream)
+    monkeypatch.setattr(route, "result_cache", ResultCache())
+    monkeypatch.setattr(route, "expression_cache", None)
+    monkeypatch.setattr(route, "local_evaluator", None)
+    with TestClient(main.app) as client:
+        response = client.post("/calculate/stream", json={"image": IMAGE, "dict_of_vars": {}})
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        event, data = block.split("\n", 1)
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+
+    steps = [payload["answer_index"] for event, payload in events if event == "step"]
+    answers = [(payload["index"], payload["answer"]["expr"]) for event, payload in events if event == "answer"]
+    # The rejected answer's step is superseded by the next answer with the same index
+    assert steps == [0, 1, 1]
+    assert answers == [(0, "2+2"), (1, "3*3")]
+    assert events[-1][0] == "done"
+    assert [answer["expr"] for answer in events[-1][1]["data"]] == ["2+2", "3*3"]
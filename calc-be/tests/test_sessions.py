@@ -0,0 +1,63 @@
+import logging
+import os
+import constants
+from apps.calculator.expression_cache import analyze_dependencies
+from apps.calculator.sessions import MemorySessionBackend, SQLiteSessionBackend, SessionStore
+
+MODEL_ASSIGNMENTS = [
+    {"expr": "x = 5", "result": "5", "assign": True, "latex": "x = 5", "type": "variable_assignment"},
+    {"expr": "y = x + 2", "result": "7", "assign": True, "latex": "y = x + 2 = 7", "type": "variable_assignment"},
+]
+
+def test_capture_uses_the_assignment_target():
+    store = SessionStore(MemorySessionBackend())
+    assert store.capture("session-1", MODEL_ASSIGNMENTS) == {"x": "5", "y": "7"}
+    assert store.get("session-1") == {"x": "5", "y": "7"}
+
+def test_capture_accepts_local_evaluator_answers():
+    store = SessionStore(MemorySessionBackend())
+    local = {"expr": "z", "result": "3", "assign": True, "latex": "z = 3", "type": "variable_assignment"}
+    assert store.capture("session-1", [local]) == {"z": "3"}
+
+def test_capture_skips_non_identifier_targets():
+    store = SessionStore(MemorySessionBackend())
+    answers = [
+        {"expr": "2x = 4", "result": "2", "assign": True, "latex": "2x = 4"},
+        {"expr": "pi = 3", "result": "3", "assign": True, "latex": "pi = 3"},
+    ]
+    assert store.capture("session-1", answers) == {}
+
+def test_assignment_dependencies():
+    assert analyze_dependencies(MODEL_ASSIGNMENTS[1]) == ({"x"}, "y = x + 2")
+    assert analyze_dependencies(MODEL_ASSIGNMENTS[0]) == (set(), "x = 5")
+
+def test_truncated_prompt_variables_are_logged(caplog):
+    store = SessionStore(MemorySessionBackend())
+    variables = {f"v{index}": index for index in range(25)}
+    with caplog.at_level(logging.WARNING, logger="apps.calculator.sessions"):
+        selected = store.prompt_vars("session-1", variables)
+    assert list(selected) == [f"v{index}" for index in range(5, 25)]
+    assert store.stats()["prompt_vars_truncated"] == 1
+    assert "omitting v0, v1, v2, v3, v4" in caplog.text
+
+def test_known_drawings_are_not_reported_as_truncated(caplog):
+    store = SessionStore(MemorySessionBackend())
+    variables = {f"v{index}": index for index in range(25)}
+    with caplog.at_level(logging.WARNING, logger="apps.calculator.sessions"):
+        assert store.prompt_vars("session-1", variables, referenced={"v0"}) == {"v0": 0}
+    assert store.stats()["prompt_vars_truncated"] == 0
+    assert not caplog.text
+
+def test_sessions_default_to_a_shared_file_with_several_workers(monkeypatch):
+    monkeypatch.delenv("SESSION_DB_PATH", raising=False)
+    monkeypatch.setattr(constants, "SERVER_WORKER_COUNT", 1)
+    assert constants._shared_db_path("SESSION_DB_PATH", "sessions.sqlite3") == ""
+    monkeypatch.setattr(constants, "SERVER_WORKER_COUNT", 4)
+    assert constants._shared_db_path("SESSION_DB_PATH", "sessions.sqlite3") == \
+        os.path.join(constants.SERVER_STATE_DIR, "sessions.sqlite3")
+
+def test_workers_sharing_a_file_see_each_others_variables(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    first, second = SessionStore(SQLiteSessionBackend(path)), SessionStore(SQLiteSessionBackend(path))
+    first.capture("session-1", MODEL_ASSIGNMENTS)
+    assert second.prompt_vars("session-1", {}) == {"x": "5", "y": "7"}